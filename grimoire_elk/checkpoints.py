@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Persistent checkpoints of the enrichment of the raw items"""
+
+import hashlib
+import logging
+
+import requests
+
+from grimoirelab_toolkit.datetime import datetime_utcnow
+
+from . import codec
+from .enriched.utils import ConnectionRegistry, anonymize_url
+
+logger = logging.getLogger(__name__)
+
+HEADER_JSON = {"Content-Type": "application/json"}
+
+
+class CheckpointStore:
+    """Store the position of the last raw item enriched and uploaded.
+
+    There is a checkpoint for each connector, origin, filter raw and
+    enriched index, stored as a document of the index `index`. The
+    checkpoint keeps the incremental date of the last raw item whose
+    enriched items were acknowledged by ElasticSearch and, when the raw
+    items are read in order, its sort values, so the enrichment can be
+    resumed right after it with `search_after`.
+
+    :param url: ElasticSearch URL
+    :param index: name of the index with the checkpoints
+    :param insecure: support https with invalid certificates
+    """
+    def __init__(self, url, index, insecure=True):
+        self.url = url
+        self.index = index
+        self.index_url = url + "/" + index
+        self.requests = ConnectionRegistry.get_session(insecure)
+
+    @staticmethod
+    def get_checkpoint_id(connector, origin, filter_raw, enrich_index):
+        """Get the id of the checkpoint document"""
+
+        key = [connector, origin, filter_raw, enrich_index]
+        return hashlib.sha1(codec.encode(key)).hexdigest()
+
+    def get(self, connector, origin, filter_raw, enrich_index):
+        """Get the checkpoint of the enrichment, None if there isn't any.
+
+        :returns: dict with the incremental date (`timestamp`) and the sort
+            values (`sort`, None when they aren't known) of the last item
+        """
+        checkpoint_id = self.get_checkpoint_id(connector, origin, filter_raw, enrich_index)
+
+        res = self.requests.get(self.index_url + "/_doc/" + checkpoint_id)
+        if res.status_code == 404:
+            return None
+        res.raise_for_status()
+
+        doc = codec.decode_response(res)['_source']
+        checkpoint = {
+            'timestamp': doc['timestamp'],
+            'sort': codec.decode(doc['sort']) if doc.get('sort') else None
+        }
+        return checkpoint
+
+    def save(self, connector, origin, filter_raw, enrich_index, timestamp, sort=None):
+        """Store the checkpoint of the enrichment.
+
+        :param timestamp: incremental date of the last raw item enriched
+        :param sort: sort values of the last raw item enriched
+        """
+        checkpoint_id = self.get_checkpoint_id(connector, origin, filter_raw, enrich_index)
+        doc = {
+            'connector': connector,
+            'origin': origin,
+            'filter_raw': filter_raw,
+            'enrich_index': enrich_index,
+            'timestamp': timestamp,
+            # The sort values mix types, they are stored as JSON
+            'sort': codec.encode(sort).decode('utf-8') if sort else None,
+            'updated_on': datetime_utcnow().isoformat()
+        }
+
+        res = self.requests.put(self.index_url + "/_doc/" + checkpoint_id,
+                                data=codec.encode(doc), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            logger.warning("Can't store the checkpoint of {} in {}: {}".format(
+                           origin, anonymize_url(self.index_url), res.text))
+
+    def delete(self, connector, origin, filter_raw, enrich_index):
+        """Delete the checkpoint of the enrichment, if any"""
+
+        checkpoint_id = self.get_checkpoint_id(connector, origin, filter_raw, enrich_index)
+
+        res = self.requests.delete(self.index_url + "/_doc/" + checkpoint_id)
+        if res.status_code != 404:
+            res.raise_for_status()
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""JSON codec used to encode and decode the documents exchanged with ElasticSearch"""
+
+import json
+import logging
+import math
+import re
+
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Lone surrogates (e.g., mbox data) can only come in JSON as escapes
+SURROGATE_ESCAPES = (b'\\ud', b'\\uD')
+
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read from the HTTP responses at once
+
+# UTF-8 multibyte characters never contain ASCII bytes, so the
+# JSON structure can be scanned in the raw bytes
+STRUCTURE = re.compile(rb'["{}\[\]:]')
+STRING_END = re.compile(rb'["\\]')
+SPACES = re.compile(rb'[\s,]*')
+
+
+class JSONCodec:
+    """JSON codec based on the standard library.
+
+    Documents are encoded to UTF-8 removing the characters that can't be
+    encoded, and decoded removing the lone surrogates, which can't be
+    encoded back to UTF-8 when the documents are uploaded again. The
+    non-finite floats (NaN and infinities), which aren't valid JSON, are
+    encoded as null.
+    """
+    name = 'json'
+
+    def encode(self, obj):
+        """Encode an object to UTF-8 JSON, removing the characters that can't be encoded.
+
+        :param obj: object to encode
+        :returns: bytes representation of the object
+        """
+        try:
+            data_json = json.dumps(obj, ensure_ascii=False, allow_nan=False)
+        except ValueError:
+            data_json = json.dumps(self.remove_non_finite(obj), ensure_ascii=False)
+        try:
+            return data_json.encode('utf-8')
+        except UnicodeEncodeError:
+            logger.warning("Encoding error in document, removing invalid characters")
+            return data_json.encode('utf-8', errors='ignore')
+
+    def decode(self, data):
+        """Decode a JSON document, removing the lone surrogates.
+
+        :param data: JSON document, as bytes or str
+        :returns: decoded object
+        """
+        obj = json.loads(data)
+
+        escapes = SURROGATE_ESCAPES if isinstance(data, bytes) else [escape.decode() for escape in SURROGATE_ESCAPES]
+        if any(escape in data for escape in escapes):
+            obj = json.loads(self.encode(obj))
+
+        return obj
+
+    @classmethod
+    def remove_non_finite(cls, obj):
+        """Replace the non-finite floats of an object with None"""
+
+        if isinstance(obj, float) and not math.isfinite(obj):
+            return None
+        if isinstance(obj, dict):
+            return {key: cls.remove_non_finite(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [cls.remove_non_finite(value) for value in obj]
+        return obj
+
+
+def _reject_type(obj):
+    """Refuse to encode the types `orjson` supports but the standard library doesn't"""
+
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+class OrjsonCodec(JSONCodec):
+    """JSON codec based on `orjson`.
+
+    The values not supported by `orjson` (e.g., lone surrogates, integers
+    bigger than 64 bits or subclasses of float) are processed with the
+    standard library. The datetimes and dataclasses, which the standard
+    library can't encode, aren't encoded by `orjson` either, so the errors
+    are the same of `JSONCodec`. UUIDs and enums are encoded by `orjson`.
+    """
+    name = 'orjson'
+
+    def encode(self, obj):
+        try:
+            return orjson.dumps(obj, default=_reject_type,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                                | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except TypeError:
+            return super().encode(obj)
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            return super().decode(data)
+
+
+CODECS = {JSONCodec.name: JSONCodec}
+if ORJSON_AVAILABLE:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+
+_codec = OrjsonCodec() if ORJSON_AVAILABLE else JSONCodec()
+
+
+def get_codec():
+    """Get the codec in use"""
+
+    return _codec
+
+
+def set_codec(name):
+    """Set the codec used by the whole process.
+
+    :param name: name of the codec, one of `CODECS`
+    """
+    global _codec
+
+    if name not in CODECS:
+        raise ValueError("Unknown JSON codec {}, available ones: {}".format(name, list(CODECS)))
+
+    _codec = CODECS[name]()
+    logger.debug("JSON codec set to {}".format(name))
+
+
+def encode(obj):
+    """Encode an object to UTF-8 JSON with the codec in use"""
+
+    return _codec.encode(obj)
+
+
+def decode(data):
+    """Decode a JSON document, as bytes or str, with the codec in use"""
+
+    return _codec.decode(data)
+
+
+def decode_response(response):
+    """Decode the JSON body of a HTTP response with the codec in use"""
+
+    return _codec.decode(response.content)
+
+
+def decode_search_response(response):
+    """Decode a page of search results while it is downloaded.
+
+    The hits of the page are decoded one by one with the codec in use,
+    straight from the HTTP response, so the whole page is never held in
+    memory. The fields of the page before the hits (e.g., `_scroll_id`
+    or `hits.total`) are decoded right away, while `hits.hits` is an
+    iterator of the hits. The fields after the hits, if any, are added
+    to the page once all the hits are read.
+
+    :param response: HTTP response of a search, requested with `stream=True`
+    :returns: page of results, with `hits.hits` as an iterator
+    """
+    return SearchStreamDecoder(response.iter_content(STREAM_CHUNK_SIZE), close=response.close).decode()
+
+
+class SearchStreamDecoder:
+    """Decoder of search results which yields the hits one by one.
+
+    :param chunks: iterable of bytes with the JSON search results
+    :param close: function called once the results are read
+    """
+    def __init__(self, chunks, close=None):
+        self.chunks = iter(chunks)
+        self.close = close
+        # Chunks are appended, and the hits read are discarded, in place
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def decode(self):
+        """Read the results until their hits and return the page"""
+
+        try:
+            head = self.__read_head()
+        except Exception:
+            self.__close()
+            raise
+
+        page = decode(head + b'[]}}')
+        page['hits']['hits'] = self.__read_hits(page, head)
+
+        return page
+
+    def __fill(self):
+        """Read the next chunk of the results, failing if there are no more"""
+
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += chunk
+                return
+        raise ValueError("Search results truncated")
+
+    def __close(self):
+        if self.close:
+            self.close()
+            self.close = None
+
+    def __read_head(self):
+        """Read the results until the start of `hits.hits`, which isn't included"""
+
+        containers = []
+        keys = []
+        string = None
+
+        while True:
+            match = STRUCTURE.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                self.__fill()
+                continue
+
+            char = match.group()
+            if char == b'"':
+                end = self.__skip_string(match.end())
+                string = self.buffer[match.end():end - 1]
+                self.pos = end
+                continue
+
+            self.pos = match.end()
+            if char == b':':
+                keys[-1] = string
+            elif char in b'{[':
+                if char == b'[' and keys == [b'hits', b'hits'] and containers == [b'{', b'{']:
+                    head = bytes(self.buffer[:match.start()])
+                    del self.buffer[:self.pos]
+                    self.pos = 0
+                    return head
+                containers.append(char)
+                keys.append(None)
+            else:
+                containers.pop()
+                keys.pop()
+                if not containers:
+                    raise ValueError("Search results without hits")
+
+    def __skip_string(self, pos):
+        """Return the position after the end of the string starting at `pos`"""
+
+        while True:
+            match = STRING_END.search(self.buffer, pos)
+            if not match or match.end() == len(self.buffer) and match.group() == b'\\':
+                pos = match.start() if match else len(self.buffer)
+                self.__fill()
+                continue
+            if match.group() == b'"':
+                return match.end()
+            pos = match.end() + 1
+
+    def __skip_spaces(self):
+        """Skip the spaces and commas between the hits"""
+
+        while True:
+            self.pos = SPACES.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return
+            self.__fill()
+
+    def __read_hits(self, page, head):
+        """Yield the hits decoding each one on its own, then complete the page"""
+
+        try:
+            while True:
+                self.__skip_spaces()
+                if self.buffer[self.pos:self.pos + 1] == b']':
+                    break
+                yield decode(self.__read_object())
+
+            # Fields after the hits, e.g. `}, "pit_id": "..."}`
+            tail = self.buffer[self.pos:]
+            for chunk in self.chunks:
+                tail += chunk
+            page.update(decode(head + b'[' + bytes(tail)))
+        finally:
+            self.__close()
+
+    def __read_object(self):
+        """Read the object starting at the current position"""
+
+        start = self.pos
+        pos = start
+        depth = 0
+
+        while True:
+            match = STRUCTURE.search(self.buffer, pos)
+            if not match:
+                pos = len(self.buffer)
+                self.__fill()
+                continue
+
+            char = match.group()
+            if char == b'"':
+                pos = self.__skip_string(match.end())
+                continue
+
+            pos = match.end()
+            if char == b'{':
+                depth += 1
+            elif char == b'}':
+                depth -= 1
+                if depth == 0:
+                    obj = bytes(self.buffer[start:pos])
+                    self.pos = pos
+                    # Discard the hits read once in a while, not after every hit
+                    if pos > STREAM_CHUNK_SIZE:
+                        del self.buffer[:pos]
+                        self.pos = 0
+                    return obj
+
+
+class CodecSerializer(JSONSerializer):
+    """Serializer of the ElasticSearch clients using the codec in use"""
+
+    def loads(self, s):
+        try:
+            return decode(s)
+        except ValueError:
+            return super().loads(s)
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+
+        try:
+            return encode(data).decode('utf-8')
+        except TypeError:
+            return super().dumps(data)
@@ -19,47 +19,125 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import datetime
+import hashlib
 import json
 import logging
-import sys
-from time import time
+import re
+import time
+from contextlib import contextmanager
 
 import requests
 
-from grimoirelab_toolkit.datetime import (str_to_datetime,
+from grimoirelab_toolkit.datetime import (datetime_utcnow,
+                                          str_to_datetime,
                                           unixtime_to_datetime,
                                           InvalidDateError)
 
+from grimoire_elk import codec
 from grimoire_elk.errors import ELKError, ElasticError
-from grimoire_elk.enriched.utils import (grimoire_con,
+from grimoire_elk.elastic_bulk import BulkWriter
+from grimoire_elk.enriched.utils import (ConnectionRegistry,
                                          get_diff_current_date,
-                                         anonymize_url)
+                                         anonymize_url,
+                                         register_nodes)
 
 logger = logging.getLogger(__name__)
 
 HEADER_JSON = {"Content-Type": "application/json"}
 
+# Field of the mapping `_meta` with the hash of the index configuration
+CONFIG_META_FIELD = 'gelk_config'
+
+# Field of the documents used to route them to a shard, in the indexes created with routing
+ROUTING_FIELD = 'origin'
+
+# Monthly backing indexes of the partitioned indexes: <index>-<year>.<month> (e.g., git_raw-2023.01)
+PARTITION_FORMAT = '%Y.%m'
+PARTITION_REGEX = re.compile(r'-(\d{4})\.(\d{2})$')
+PARTITION_TEMPLATE_PRIORITY = 100  # plus the length of the index, the longest names are the most specific
+
+# After version 6, strings are keywords (not analyzed)
+DYNAMIC_TEMPLATES = """
+{
+  "dynamic_templates": [
+    { "notanalyzed": {
+          "match": "*",
+          "match_mapping_type": "string",
+          "mapping": {
+              "type": "keyword"
+          }
+       }
+    },
+    { "formatdate": {
+          "match": "*",
+          "match_mapping_type": "date",
+          "mapping": {
+              "type": "date",
+              "format" : "strict_date_optional_time||epoch_millis"
+          }
+       }
+    }
+  ]
+}
+"""
+
+# Major version and distribution of the instances, by URL
+_instances_cache = {}
+
+# Major and minor version numbers of the instances, by URL
+_versions_cache = {}
+
+# Last values of a field for each origin (or other grouping fields) of an index, with the time
+# they were read and the origins written since then, by index URL, field and grouping fields
+_last_values_cache = {}
+
+# Buckets requested in each page of the composite aggregation of the last values
+LAST_VALUES_PAGE_SIZE = 1000
+
+# Refresh of the index after bulk requests: on each request, waiting for
+# the next scheduled refresh, never or once when the upload finishes
+REFRESH_POLICIES = ['true', 'wait_for', 'none', 'end']
+
 
 class ElasticSearch(object):
 
     max_items_bulk = 1000
+    max_bytes_bulk = 10 * 1024 * 1024  # max size in bytes of a bulk request
+    max_inflight_bulks = 1  # max bulk requests sent concurrently
+    max_retries_bulk = 5  # max retries of the items rejected in a bulk request
+    retry_delay_bulk = 1  # seconds to wait before the first retry of rejected items
+    max_latency_bulk = 30  # bulk requests slower than this (seconds) reduce the bulk size
+    dead_letter_path = None  # NDJSON file to store the items that couldn't be uploaded
+    refresh_policy = 'true'  # index refresh after bulk requests, see REFRESH_POLICIES
+    compress_level = None  # gzip level (1-9) of the requests bodies, None to disable it
     max_items_clause = 1000  # max items in search clause (refresh identities)
+    last_values_ttl = 0  # seconds the last dates/offsets of all the origins are cached, 0 to disable it
+    route_by_origin = False  # route the documents of the new indexes to a shard by their origin
+    sort_index = False  # sort the new indexes by their incremental date
+    monthly_indexes = False  # write the new indexes into monthly backing indexes behind an alias
+    routing_field = None  # field used to route the documents of the index, set when it is created with routing
+    partitioned = False  # the index is an alias of monthly backing indexes
 
     def __init__(self, url, index, mappings=None, clean=False,
-                 insecure=True, analyzers=None, aliases=None):
+                 insecure=True, analyzers=None, aliases=None, date_field=None):
         """Class to handle the operations with the ElasticSearch database, such as
         creating indexes, mappings, setting up aliases and uploading documents.
 
-        :param url: ES url
+        :param url: ES url, or comma separated urls of several nodes of the cluster
         :param index: index name
         :param mappings: an instance of the Mapping class
         :param clean: if True, deletes an existing index and create it again
         :param insecure: support https with invalid certificates
         :param analyzers: analyzers for ElasticSearch
         :param aliases: list of aliases, defined as strings, to be added to the index
+        :param date_field: incremental date field, used to sort and partition the new indexes
         """
+        # Requests are balanced among the nodes, the url of the first one identifies the cluster
+        url = register_nodes(url)
+
         # Get major version of Elasticsearch instance
-        major, distribution = self.check_instance(url, insecure)
+        major, distribution = self.get_instance(url, insecure)
         self.major = major
         self.distribution = distribution
         logger.debug("Found version of {} instance at {}: {}.".format(
@@ -72,23 +150,43 @@ class ElasticSearch(object):
         self.aliases = aliases
 
         self.index_url = self.url + "/" + self.index
+        self.date_field = date_field
         self.wait_bulk_seconds = 2  # time to wait to complete a bulk operation
+        self.new_index = False  # the index was created or cleaned by this object
+        self.bulk_loading = False  # the index is in bulk load mode
 
-        self.requests = grimoire_con(insecure)
+        self.requests = ConnectionRegistry.get_session(insecure, compress_level=self.compress_level)
 
         analyzer_settings = None
+        map_dict = None
 
         if analyzers:
             analyzers_dict = analyzers.get_elastic_analyzers(es_major=self.major)
             analyzer_settings = analyzers_dict['items']
+        if mappings:
+            map_dict = mappings.get_elastic_mappings(es_major=self.major)
+
+        if self.monthly_indexes and self.date_field and not self.is_legacy():
+            # The backing indexes are configured by their template
+            if self.create_partitioned_index(analyzer_settings, map_dict, aliases, clean):
+                return
 
-        self.create_index(analyzer_settings, clean)
+        index_info = self.create_index(analyzer_settings, clean)
 
+        if not (analyzers or mappings or aliases):
+            return
+
+        # Skip the configuration when the index was configured with the same settings
+        config_hash = self.get_config_hash(analyzer_settings, map_dict, aliases)
+        if index_info and self.get_config_meta(index_info) == config_hash:
+            logger.debug("Index {} already configured".format(anonymize_url(self.index_url)))
+            return
+
+        configured = True
         if analyzers:
-            self.update_analyzers(analyzer_settings)
+            configured &= self.update_analyzers(analyzer_settings)
         if mappings:
-            map_dict = mappings.get_elastic_mappings(es_major=self.major)
-            self.create_mappings(map_dict)
+            configured &= self.create_mappings(map_dict)
 
         if aliases:
             for alias in aliases:
@@ -97,7 +195,52 @@ class ElasticSearch(object):
                                  alias, anonymize_url(self.index_url), anonymize_url(self.url)))
                     continue
 
-                self.add_alias(alias)
+                configured &= self.add_alias(alias)
+
+        if configured:
+            self.set_config_meta(config_hash)
+
+    @staticmethod
+    def get_config_hash(analyzers, mappings, aliases):
+        """Get the hash of the configuration of an index
+
+        :param analyzers: analyzer settings of the index
+        :param mappings: dict with the mappings of the index
+        :param aliases: list of aliases of the index
+        """
+        config = {
+            "analyzers": analyzers,
+            "mappings": mappings,
+            "aliases": aliases
+        }
+        config_json = json.dumps(config, sort_keys=True)
+        return hashlib.sha1(config_json.encode('utf-8')).hexdigest()
+
+    def get_config_meta(self, index_info):
+        """Get the hash of the configuration stored in the index mapping
+
+        :param index_info: index definition returned by ElasticSearch
+        """
+        mappings = index_info.get('mappings', {})
+        if self.is_legacy():
+            mappings = mappings.get('items', {})
+
+        return mappings.get('_meta', {}).get(CONFIG_META_FIELD)
+
+    def set_config_meta(self, config_hash):
+        """Store the hash of the configuration in the index mapping
+
+        :param config_hash: hash of the index configuration
+        """
+        url_map = self.get_mapping_url('items')
+        meta = {"_meta": {CONFIG_META_FIELD: config_hash}}
+
+        res = self.requests.put(url_map, data=json.dumps(meta), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            logger.warning("Can't store the configuration hash of {}: {}".format(
+                           anonymize_url(self.index_url), res.text))
 
     @classmethod
     def safe_index(cls, unique_id):
@@ -111,6 +254,23 @@ class ElasticSearch(object):
             index = unique_id.replace("/", "_").lower()
         return index
 
+    @classmethod
+    def get_instance(cls, url, insecure):
+        """Get the major version and the distribution of the instance in url.
+
+        The values are retrieved only once per process for each url.
+
+        :value      url: url of the instance to check
+        :value insecure: don't verify ssl connection (boolean)
+
+        :returns:        major version, as str and the distribution name.
+        """
+        key = (url, insecure)
+        if key not in _instances_cache:
+            _instances_cache[key] = cls.check_instance(url, insecure)
+
+        return _instances_cache[key]
+
     @staticmethod
     def check_instance(url, insecure):
         """Checks if there is an instance of ElasticSearch/OpenSearch in url.
@@ -124,7 +284,7 @@ class ElasticSearch(object):
 
         :returns:        major version, as str and the distribution name.
         """
-        res = grimoire_con(insecure).get(url)
+        res = ConnectionRegistry.get_session(insecure).get(url)
         if res.status_code != 200:
             msg = "Got {} from url {}".format(res.status_code, url)
             logger.error(msg)
@@ -148,57 +308,504 @@ class ElasticSearch(object):
 
         :param analyzers: set index analyzers
         :param clean: if True, the index is deleted and recreated
+
+        :returns: the definition of the index when it already existed, None otherwise
         """
         res = self.requests.get(self.index_url)
 
         headers = {"Content-Type": "application/json"}
         if res.status_code != 200:
             # Index does no exists
-            res = self.requests.put(self.index_url, data=analyzers,
+            res = self.requests.put(self.index_url, data=self.get_index_definition(analyzers),
                                     headers=headers)
             if res.status_code != 200:
                 msg = "Can't create index {} ({})".format(anonymize_url(self.index_url), res.status_code)
                 logger.error(msg)
                 raise ElasticError(cause=msg)
             else:
+                self.new_index = True
+                self.clear_last_values()
+                self.set_routing(self.route_by_origin)
                 logger.info("Created index {}".format(anonymize_url(self.index_url)))
         else:
             if clean:
                 res = self.requests.delete(self.index_url)
                 res.raise_for_status()
-                res = self.requests.put(self.index_url, data=analyzers,
+                res = self.requests.put(self.index_url, data=self.get_index_definition(analyzers),
                                         headers=headers)
                 res.raise_for_status()
+                self.new_index = True
+                self.clear_last_values()
+                self.set_routing(self.route_by_origin)
                 logger.info("Deleted and created index {}".format(anonymize_url(self.index_url)))
+            else:
+                # The index url may point to an alias, the definition is keyed by index
+                index_info = list(res.json().values())[0]
+                routing = index_info.get('mappings', {}).get('_routing', {})
+                self.set_routing(routing.get('required', False))
+                return index_info
 
-    def safe_put_bulk(self, url, bulk_json):
-        """Bulk items to a target index `url`. In case of UnicodeEncodeError,
-        the bulk is encoded with iso-8859-1.
+        return None
+
+    def get_index_definition(self, analyzers=None, routed=None):
+        """Get the definition of a new index, with its routing and sorting.
+
+        Index sorting and routing can only be defined when the index is
+        created. The documents are routed by `ROUTING_FIELD` when
+        `route_by_origin` is set, and the index is sorted by `date_field`,
+        from the newest documents, when `sort_index` is set.
+
+        :param analyzers: analyzer settings of the index, as JSON
+        :param routed: whether the documents are routed, by default `route_by_origin`
+
+        :returns: the definition of the index, as JSON
+        """
+        routed = self.route_by_origin if routed is None else routed
+
+        if self.is_legacy() or not (routed or (self.sort_index and self.date_field)):
+            return analyzers
+
+        definition = codec.decode(analyzers) if analyzers else {}
+        mappings = definition.setdefault('mappings', {})
+
+        if routed:
+            mappings['_routing'] = {'required': True}
+        if self.sort_index and self.date_field:
+            settings = definition.setdefault('settings', {})
+            settings['index.sort.field'] = self.date_field
+            settings['index.sort.order'] = 'desc'
+            # The field must be mapped to sort the index
+            mappings.setdefault('properties', {})[self.date_field] = {'type': 'date'}
+
+        return codec.encode(definition)
+
+    def create_partitioned_index(self, analyzers=None, mappings=None, aliases=None, clean=False):
+        """Create an index partitioned in monthly backing indexes.
+
+        The index is an alias of its backing indexes, one for each month of
+        the incremental date (`date_field`) of the documents. An index
+        template defines the settings, mappings and aliases of the backing
+        indexes, which are created when the first document of each month
+        is uploaded. If clean is `True`, the backing indexes are deleted.
+
+        :param analyzers: analyzer settings of the index, as JSON
+        :param mappings: dict with the mappings of the index
+        :param aliases: list of aliases to be added to the backing indexes
+        :param clean: if True, the backing indexes are deleted
+
+        :returns: False when there is a plain index with the name of the
+            index, which can't be partitioned; True otherwise
+        """
+        index_res = self.requests.get(self.index_url)
+        if index_res.status_code == 200 and self.index in index_res.json():
+            logger.warning("Index {} already exists, it won't be partitioned".format(anonymize_url(self.index_url)))
+            return False
+
+        partitions = self.get_partitions()
+        if clean and partitions:
+            for partition in partitions:
+                res = self.requests.delete(self.url + "/" + partition)
+                res.raise_for_status()
+            logger.info("Deleted backing indexes of {}".format(anonymize_url(self.index_url)))
+            partitions = []
+
+        if partitions:
+            # New backing indexes are routed as the previous ones
+            index_info = index_res.json()[partitions[-1]]
+            self.set_routing(index_info.get('mappings', {}).get('_routing', {}).get('required', False))
+        else:
+            self.set_routing(self.route_by_origin)
+
+        self.put_partition_template(analyzers, mappings, aliases)
+        self.partitioned = True
+
+        if not partitions:
+            # The alias of the index needs a backing index to be read
+            partition = self.get_partition({})
+            res = self.requests.put(self.url + "/" + partition)
+            res.raise_for_status()
+            self.new_index = True
+            self.clear_last_values()
+            logger.info("Created index {} with backing index {}".format(anonymize_url(self.index_url), partition))
+
+        return True
+
+    def put_partition_template(self, analyzers=None, mappings=None, aliases=None):
+        """Store the template of the backing indexes of the index.
+
+        Composable index templates are used when the instance supports
+        them, legacy templates otherwise.
+        """
+
+        definition = codec.decode(self.get_index_definition(analyzers, routed=bool(self.routing_field)) or '{}')
+
+        index_mappings = codec.decode(mappings['items']) if mappings else {}
+        index_mappings.update(codec.decode(DYNAMIC_TEMPLATES))
+        for key, value in definition.get('mappings', {}).items():
+            if key == 'properties':
+                # The mappings of the index take precedence
+                value.update(index_mappings.get('properties', {}))
+            index_mappings[key] = value
+
+        # Names of other indexes may start with this one, the template of the longest one applies
+        priority = PARTITION_TEMPLATE_PRIORITY + len(self.index)
+        index_template = {
+            "settings": definition.get('settings', {}),
+            "mappings": index_mappings,
+            "aliases": {alias: {} for alias in [self.index] + (aliases or [])}
+        }
+
+        if self.supports_index_templates():
+            template = {
+                "index_patterns": [self.index + "-*"],
+                "priority": priority,
+                "template": index_template
+            }
+            url = self.url + "/_index_template/" + self.index
+        else:
+            # Legacy templates, before ES 7.8, are merged by their order
+            template = {
+                "index_patterns": [self.index + "-*"],
+                "order": priority
+            }
+            template.update(index_template)
+            url = self.url + "/_template/" + self.index
+
+        res = self.requests.put(url, data=codec.encode(template), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            msg = "Can't store the template of {}: {}".format(anonymize_url(self.index_url), res.text)
+            logger.error(msg)
+            raise ElasticError(cause=msg)
+
+    def get_partitions(self):
+        """Get the names of the backing indexes of the index, from the oldest"""
+
+        res = self.requests.get(self.url + "/_alias/" + self.index)
+        if res.status_code == 404:
+            return []
+        res.raise_for_status()
+
+        partitions = [index for index in res.json() if index.startswith(self.index + "-")
+                      and PARTITION_REGEX.search(index)]
+        return sorted(partitions)
+
+    def get_partition(self, doc):
+        """Get the backing index of a document, by the month of its incremental date.
+
+        The documents without incremental date go to the one of the current month.
+        """
+        date = doc.get(self.date_field) if self.date_field else None
+        date = str_to_datetime(date) if date else datetime_utcnow()
+        date = date.astimezone(datetime.timezone.utc) if date.tzinfo else date
+
+        return self.index + "-" + date.strftime(PARTITION_FORMAT)
+
+    @staticmethod
+    def get_partition_dates(partition):
+        """Get the first date of the month of a backing index and the first date of the next month"""
+
+        year, month = (int(value) for value in PARTITION_REGEX.search(partition).groups())
+        start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+        return start, end
+
+    def get_partitions_url(self, from_date=None):
+        """Get the URL to read the documents of the index after a date.
+
+        Only the backing indexes of the months after `from_date` are read.
+
+        :param from_date: incremental date from which to read the documents
+        """
+        if not self.partitioned or not from_date:
+            return self.index_url
+
+        if not from_date.tzinfo:
+            from_date = from_date.replace(tzinfo=datetime.timezone.utc)
+
+        partitions = [partition for partition in self.get_partitions()
+                      if self.get_partition_dates(partition)[1] > from_date]
+        if not partitions:
+            return self.index_url
+
+        return self.url + "/" + ",".join(partitions)
+
+    def get_stale_copies(self, docs):
+        """Get the delete actions of the copies of documents moved to another backing index.
+
+        A document moves when its incremental date changes to another month,
+        the copy in the backing index of the previous month must be deleted.
+
+        :param docs: list of tuples with the id of the documents and their backing index
+
+        :returns: list of bulk delete actions
+        """
+        indexes = dict(docs)
+        query = {
+            "size": len(indexes),
+            "_source": False,
+            "query": {"ids": {"values": list(indexes)}}
+        }
+
+        res = self.requests.post(self.index_url + "/_search", data=codec.encode(query), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            logger.debug("Can't look up the copies of the documents in {}: {}".format(
+                         anonymize_url(self.index_url), res.text))
+            return []
+
+        actions = []
+        for hit in codec.decode_response(res)['hits']['hits']:
+            if hit['_index'] == indexes.get(hit['_id']):
+                continue
+            action = {"_index": hit['_index'], "_id": hit['_id']}
+            if hit.get('_routing'):
+                action["routing"] = hit['_routing']
+            actions.append({"delete": action})
+
+        return actions
+
+    def set_routing(self, routed):
+        """Set whether the documents of the index are routed by `ROUTING_FIELD`"""
+
+        self.routing_field = ROUTING_FIELD if routed and not self.is_legacy() else None
+
+    def get_routing(self, doc, doc_id):
+        """Get the routing of a document of the index.
+
+        :param doc: document of the index
+        :param doc_id: id of the document, the routing of the documents
+            without `ROUTING_FIELD`
+
+        :returns: the routing value, None when the index isn't routed
+        """
+        if not self.routing_field:
+            return None
+
+        return doc.get(self.routing_field) or doc_id
+
+    def get_filters_routing(self, filters_):
+        """Get the routing of the documents selected by some filters.
+
+        :param filters_: filters with `name` and `value` (e.g., the origin)
+
+        :returns: the routing value, None when the documents can be in any shard
+        """
+        if not self.routing_field:
+            return None
+
+        for filter_ in filters_:
+            if filter_ and filter_['name'] == self.routing_field:
+                return filter_['value']
+
+        return None
+
+    def put_bulk(self, url, bulk_json):
+        """Bulk items to a target index `url` and return the response of ElasticSearch.
+        In case of UnicodeEncodeError, the bulk is encoded with iso-8859-1.
 
         :param url: target index where to bulk the items
-        :param bulk_json: str representation of the items to upload
+        :param bulk_json: str or bytes representation of the items to upload
+
+        :returns: dict with the result of the bulk, including the result of each item
         """
         headers = {"Content-Type": "application/x-ndjson"}
 
         try:
-            res = self.requests.put(url + '?refresh=true', data=bulk_json, headers=headers)
+            res = self.requests.put(url + self.get_refresh_param(), data=bulk_json, headers=headers)
             res.raise_for_status()
         except UnicodeEncodeError:
             # Related to body.encode('iso-8859-1'). mbox data
             logger.warning("Encondig error ... converting bulk to iso-8859-1")
             bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
-            res = self.requests.put(url, data=bulk_json, headers=headers)
+            res = self.requests.put(url + self.get_refresh_param(), data=bulk_json, headers=headers)
+            res.raise_for_status()
+
+        return codec.decode_response(res)
+
+    def get_refresh_param(self):
+        """Get the query string to apply the refresh policy to bulk requests"""
+
+        if self.refresh_policy not in REFRESH_POLICIES:
+            msg = "Unknown refresh policy {}, valid ones are {}".format(self.refresh_policy, REFRESH_POLICIES)
+            raise ELKError(cause=msg)
+
+        if self.refresh_policy in ['true', 'wait_for']:
+            return '?refresh=' + self.refresh_policy
+        return ''
+
+    def refresh(self):
+        """Refresh the index to make the uploaded documents visible to searches"""
+
+        res = self.requests.post(self.index_url + "/_refresh", headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+            logger.debug("Refreshed index {}".format(anonymize_url(self.index_url)))
+        except requests.exceptions.HTTPError as ex:
+            logger.error("Error refreshing index {}. {}".format(anonymize_url(self.index_url), ex))
+
+    def get_version(self):
+        """Get the major and minor version numbers of the instance, as a tuple of ints.
+
+        The full version of the instance is retrieved only once per process.
+        When it can't be read, only the major version is returned.
+        """
+        if self.url not in _versions_cache:
+            version = (int(self.major),) if self.major else ()
+            res = self.requests.get(self.url)
+            try:
+                res.raise_for_status()
+                number = codec.decode_response(res)['version']['number']
+                version = tuple(int(n) for n in number.split('-')[0].split('.')[:2])
+            except (requests.exceptions.HTTPError, ValueError, KeyError):
+                logger.debug("Could not get the version of {}".format(anonymize_url(self.url)))
+            _versions_cache[self.url] = version
+
+        return _versions_cache[self.url]
+
+    def supports_pit(self):
+        """Check whether the instance supports points in time with `_shard_doc` sort (ES >= 7.12)"""
+
+        if self.distribution != 'elasticsearch' or self.is_legacy():
+            return False
+
+        return self.get_version() >= (7, 12)
+
+    def supports_index_templates(self):
+        """Check whether the instance supports composable index templates (ES >= 7.8, OpenSearch)"""
+
+        if self.is_legacy():
+            return False
+        if self.distribution != 'elasticsearch':
+            return True
+
+        return self.get_version() >= (7, 8)
+
+    def open_pit(self, keep_alive, routing=None, index_url=None):
+        """Open a point in time of the index, to read it with `search_after`.
+
+        :param keep_alive: time to keep the point in time alive (e.g., 10m)
+        :param routing: routing of the documents to read, to search only
+            the shard where they are
+        :param index_url: URL of the indexes to read, by default the one of the index
+
+        :returns: id of the point in time, None when the instance doesn't
+            support points in time or it couldn't be opened (e.g., the
+            index doesn't exist)
+        """
+        if not self.supports_pit():
+            return None
+
+        params = {"keep_alive": keep_alive}
+        if routing:
+            params["routing"] = routing
+
+        res = self.requests.post((index_url or self.index_url) + "/_pit", params=params)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            logger.debug("Could not open a point in time of {}: {}".format(anonymize_url(self.index_url), res.text))
+            return None
+
+        return codec.decode_response(res)['id']
+
+    def close_pit(self, pit_id):
+        """Close a point in time to release its resources"""
+
+        data = codec.encode({"id": pit_id})
+        res = self.requests.delete(self.url + "/_pit", data=data, headers=HEADER_JSON)
+        try:
             res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            logger.debug("Error closing point in time of {}: {}".format(anonymize_url(self.index_url), res.text))
+
+    def get_index_settings(self):
+        """Get the settings of the index"""
+
+        res = self.requests.get(self.index_url + "/_settings", headers=HEADER_JSON)
+        res.raise_for_status()
+
+        # The index url may point to an alias, the settings are keyed by index
+        return list(res.json().values())[0]['settings']['index']
+
+    def update_index_settings(self, settings):
+        """Update the dynamic settings of the index
+
+        :param settings: dict with the index settings to update
+        """
+        data = json.dumps({"index": settings})
+        res = self.requests.put(self.index_url + "/_settings", data=data, headers=HEADER_JSON)
+        res.raise_for_status()
+
+    @contextmanager
+    def bulk_load(self):
+        """Context to upload large amounts of documents to the index.
+
+        While the context is active, the index isn't refreshed periodically
+        and, when it was created by this object, it has no replicas. When
+        the context finishes, even because of an error, the original
+        settings are restored and the index is refreshed once.
+        """
+        bulk_settings = {"refresh_interval": "-1"}
+        if self.new_index:
+            # The replicas of an index which may be read by others are kept
+            bulk_settings["number_of_replicas"] = 0
+
+        index_settings = None
+        try:
+            index_settings = self.get_index_settings()
+            self.update_index_settings(bulk_settings)
+            self.bulk_loading = True
+            logger.debug("Bulk load mode enabled for {}".format(anonymize_url(self.index_url)))
+        except requests.exceptions.HTTPError as ex:
+            logger.warning("Bulk load mode not enabled for {}. {}".format(anonymize_url(self.index_url), ex))
+
+        try:
+            yield self
+        finally:
+            if self.bulk_loading:
+                self.bulk_loading = False
+                self.__restore_settings(index_settings, list(bulk_settings))
+
+    def __restore_settings(self, index_settings, keys):
+        """Restore the settings changed by the bulk load mode and refresh the index
+
+        :param index_settings: settings of the index before the bulk load mode
+        :param keys: names of the settings changed by the bulk load mode
+        """
+        # A null setting resets it to the default value
+        original = {key: index_settings.get(key, None) for key in keys}
+        try:
+            self.update_index_settings(original)
+            logger.debug("Bulk load mode disabled for {}".format(anonymize_url(self.index_url)))
+        except requests.exceptions.HTTPError as ex:
+            logger.error("Error restoring settings {} of {}. {}".format(
+                         original, anonymize_url(self.index_url), ex))
+        self.refresh()
+
+    def safe_put_bulk(self, url, bulk_json):
+        """Bulk items to a target index `url`. In case of UnicodeEncodeError,
+        the bulk is encoded with iso-8859-1.
+
+        :param url: target index where to bulk the items
+        :param bulk_json: str or bytes representation of the items to upload
+
+        :returns: number of items inserted
+        """
+        result = self.put_bulk(url, bulk_json)
 
-        result = res.json()
         failed_items = []
         error = ""
         if result['errors']:
-            # Due to multiple errors that may be thrown when inserting bulk data, only the first error is returned
-            failed_items = [item['index'] for item in result['items'] if 'error' in item['index']]
+            failed_items = [list(item.values())[0] for item in result['items']]
+            failed_items = [item for item in failed_items if 'error' in item]
             error = str(failed_items[0]['error'])
 
-            logger.error("Failed to insert data to ES: {}, {}".format(error, anonymize_url(url)))
+            logger.error("Failed to insert data to ES: {}/{} items failed, first error {}, {}".format(
+                         len(failed_items), len(result['items']), error, anonymize_url(url)))
 
         inserted_items = len(result['items']) - len(failed_items)
 
@@ -251,15 +858,19 @@ class ElasticSearch(object):
         :param alias: target alias
         :return: bool
         """
-        aliases = self.all_es_aliases()
-        return alias in aliases
+        if not isinstance(alias, str):
+            return False
+
+        # Check only the target alias instead of listing all of them
+        r = self.requests.head(self.url + "/_alias/" + alias, verify=False)
+        return r.status_code == 200
 
     def add_alias(self, alias):
         """Add an alias to the index set in the elastic obj
 
         :param alias: alias to add
 
-        :returns: None
+        :returns: True if the alias is set on the index, False otherwise
         """
         aliases = self.list_aliases()
         alias_dict = alias
@@ -273,7 +884,7 @@ class ElasticSearch(object):
                 alias_dict['alias'],
                 anonymize_url(self.index_url)
             ))
-            return
+            return True
 
         # add alias
         alias_dict['index'] = self.index
@@ -291,20 +902,62 @@ class ElasticSearch(object):
         except requests.exceptions.HTTPError as ex:
             logger.warning("Something went wrong when adding an alias on {}. Alias not set. {}".format(
                            anonymize_url(self.index_url), ex))
-            return
+            return False
 
         logger.info("Alias {} created on {}.".format(alias, anonymize_url(self.index_url)))
+        return True
 
     def get_bulk_url(self):
         """Get the bulk URL endpoint"""
 
-        if not self.is_legacy():
+        if self.partitioned:
+            # The backing index is set in the action of each document
+            bulk_url = self.url + '/_bulk'
+        elif not self.is_legacy():
             bulk_url = self.index_url + '/_bulk'
         else:
             bulk_url = self.index_url + '/items/_bulk'
 
         return bulk_url
 
+    def mget_fields(self, ids, fields, routings=None):
+        """Get some fields of the documents of the index with the given ids.
+
+        :param ids: ids of the documents
+        :param fields: fields of the documents to get
+        :param routings: routing of each document, when the index is routed
+
+        :returns: dict with the fields of each document found, by id
+        """
+        if not ids:
+            return {}
+
+        if self.partitioned:
+            # Documents can't be got by id from an alias of several indexes
+            query = {"size": len(ids), "_source": fields, "query": {"ids": {"values": ids}}}
+            res = self.requests.post(self.index_url + "/_search", data=codec.encode(query), headers=HEADER_JSON)
+            res.raise_for_status()
+            return {hit['_id']: hit.get('_source', {}) for hit in codec.decode_response(res)['hits']['hits']}
+
+        url = self.index_url + ('/_mget' if not self.is_legacy() else '/items/_mget')
+        docs = [{"_id": doc_id, "_source": fields} for doc_id in ids]
+        if routings:
+            for doc, routing in zip(docs, routings):
+                if routing:
+                    doc["routing"] = routing
+        data = {"docs": docs}
+
+        res = self.requests.post(url, data=codec.encode(data), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            # The index could not exist yet
+            logger.debug("Can't get the documents from {}: {}".format(anonymize_url(self.index_url), res.text))
+            return {}
+
+        docs = codec.decode_response(res)['docs']
+        return {doc['_id']: doc.get('_source', {}) for doc in docs if doc.get('found')}
+
     def get_mapping_url(self, _type=None):
         """Get the mapping URL endpoint
 
@@ -323,39 +976,180 @@ class ElasticSearch(object):
         :param items: list of items to be uploaded
         :param field_id: unique ID attribute used to differentiate the items
         """
-        current = 0
-        new_items = 0  # total items added with bulk
-        bulk_json = ""
-
         if not items:
-            return new_items
-
-        url = self.get_bulk_url()
-
-        logger.debug("Adding items to {} (in {} packs)".format(anonymize_url(url), self.max_items_bulk))
-        task_init = time()
-
-        for item in items:
-            if current >= self.max_items_bulk:
-                task_init = time()
-                new_items += self.safe_put_bulk(url, bulk_json)
-                current = 0
-                json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                logger.debug("bulk packet sent ({:.2f} sec, {} total, {:.2f} MB)".format(
-                             time() - task_init, new_items, json_size))
-                bulk_json = ""
-            data_json = json.dumps(item)
-            bulk_json += '{{"index" : {{"_id" : "{}" }} }}\n'.format(item[field_id])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-        if current > 0:
-            new_items += self.safe_put_bulk(url, bulk_json)
-            json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-            logger.debug("bulk packet sent ({:.2f} sec prev, {} total, {:.2f} MB)".format(
-                         time() - task_init, new_items, json_size))
-
-        return new_items
+            return 0
+
+        with BulkWriter(self) as writer:
+            logger.debug("Adding items to {} (in {} packs, {:.2f} MB max)".format(
+                         anonymize_url(writer.url), self.max_items_bulk, self.max_bytes_bulk / (1024 * 1024)))
+
+            for item in items:
+                writer.add(item, item[field_id])
+
+        return writer.total
+
+    def bulk_update(self, docs, fields, field_id='uuid', doc_as_upsert=False):
+        """Update some fields of the documents of the index using bulk API.
+
+        Only the values of `fields` are sent, the rest of fields of the
+        documents in the index are kept. Documents not found in the index
+        fail, unless `doc_as_upsert` is set.
+
+        :param docs: documents with the values to update
+        :param fields: fields of the documents to update
+        :param field_id: unique ID attribute used to differentiate the documents
+        :param doc_as_upsert: insert the documents not found in the index
+
+        :returns: number of documents updated
+        """
+        with BulkWriter(self) as writer:
+            logger.debug("Updating fields {} of items in {} (in {} packs, {:.2f} MB max)".format(
+                         fields, anonymize_url(writer.url), self.max_items_bulk, self.max_bytes_bulk / (1024 * 1024)))
+
+            for chunk in self.__get_chunks(docs):
+                locations = self.get_update_locations([doc[field_id] for doc in chunk])
+                for doc in chunk:
+                    update = {"doc": {field: doc[field] for field in fields if field in doc}}
+                    if doc_as_upsert:
+                        update["doc_as_upsert"] = True
+                    action = self.get_update_action(doc[field_id], locations, doc)
+                    writer.origins.add(self.get_update_origin(doc[field_id], locations, doc))
+                    writer.add_action(action, update)
+
+        return writer.total
+
+    def bulk_script_update(self, ids, script_id, params=None, scripted_upsert=False):
+        """Update the documents of the index running a stored script using bulk API.
+
+        The script must be stored in the cluster before (see `put_script`).
+        Documents not found in the index fail, unless `scripted_upsert` is set;
+        in that case the script runs on an empty document to create them.
+
+        :param ids: ids of the documents to update
+        :param script_id: id of the stored script
+        :param params: params of the script, the same for all the documents
+        :param scripted_upsert: run the script to create the documents not found
+
+        :returns: number of documents updated
+        """
+        with BulkWriter(self) as writer:
+            logger.debug("Updating items in {} with script {} (in {} packs, {:.2f} MB max)".format(
+                         anonymize_url(writer.url), script_id, self.max_items_bulk, self.max_bytes_bulk / (1024 * 1024)))
+
+            update = {"script": {"id": script_id, "params": params if params else {}}}
+            if scripted_upsert:
+                update["scripted_upsert"] = True
+                update["upsert"] = {}
+
+            for chunk in self.__get_chunks(ids):
+                locations = self.get_update_locations(chunk)
+                for doc_id in chunk:
+                    writer.origins.add(self.get_update_origin(doc_id, locations))
+                    writer.add_action(self.get_update_action(doc_id, locations), update)
+
+        return writer.total
+
+    def get_update_origin(self, doc_id, locations=None, doc=None):
+        """Get the origin of a document to update, None when it is unknown.
+
+        The cached last values of the origins of the documents updated are
+        outdated, those of all the origins when any of them is unknown.
+
+        :param doc_id: id of the document
+        :param locations: index and routing of the documents found, by id
+            (see `get_update_locations`)
+        :param doc: new values of the document, if any
+        """
+        if doc and ROUTING_FIELD in doc:
+            return doc[ROUTING_FIELD]
+        if self.routing_field == ROUTING_FIELD:
+            return (locations or {}).get(doc_id, (None, None))[1]
+
+        return None
+
+    def get_update_action(self, doc_id, locations=None, doc=None):
+        """Get the bulk action to update a document, retrying on version conflicts.
+
+        On routed or partitioned indexes, the action targets the backing
+        index and the shard where the document is stored. The ones of the
+        documents not found are those where `doc` would be uploaded.
+
+        :param doc_id: id of the document
+        :param locations: index and routing of the documents found, by id
+            (see `get_update_locations`)
+        :param doc: new values of the document, if any
+        """
+        action = {"_id": doc_id, "retry_on_conflict": self.max_retries_bulk}
+
+        doc = doc if doc else {}
+        index, routing = (locations or {}).get(doc_id, (None, None))
+        if self.partitioned:
+            action["_index"] = index if index else self.get_partition(doc)
+        routing = routing if routing else self.get_routing(doc, doc_id)
+        if routing:
+            action["routing"] = routing
+
+        return {"update": action}
+
+    def get_update_locations(self, ids):
+        """Get the backing index and the routing of the documents to update.
+
+        The documents of routed or partitioned indexes are updated in the
+        shard and the backing index where they are stored, which are read
+        searching their ids.
+
+        :param ids: ids of the documents
+
+        :returns: dict with a tuple (index, routing) for each document
+            found, by id; empty when the index isn't routed or partitioned
+        """
+        if not (self.routing_field or self.partitioned) or not ids:
+            return {}
+
+        query = {"size": len(ids), "_source": False, "query": {"ids": {"values": ids}}}
+
+        res = self.requests.post(self.index_url + "/_search", data=codec.encode(query), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            msg = "Can't look up the documents to update in {}: {}".format(anonymize_url(self.index_url), res.text)
+            logger.error(msg)
+            raise ElasticError(cause=msg)
+
+        return {hit['_id']: (hit['_index'], hit.get('_routing'))
+                for hit in codec.decode_response(res)['hits']['hits']}
+
+    def __get_chunks(self, values):
+        """Split the values in lists of `max_items_clause` values"""
+
+        chunk = []
+        for value in values:
+            chunk.append(value)
+            if len(chunk) >= self.max_items_clause:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def put_script(self, script_id, source, lang='painless'):
+        """Store a script in the cluster to be used by `bulk_script_update`.
+
+        :param script_id: id of the script
+        :param source: source code of the script
+        :param lang: language of the script
+        """
+        url = self.url + "/_scripts/" + script_id
+        data = {"script": {"lang": lang, "source": source}}
+
+        res = self.requests.put(url, data=codec.encode(data), headers=HEADER_JSON)
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            msg = "Error storing script {} in {}: {}".format(script_id, anonymize_url(self.url), res.text)
+            logger.error(msg)
+            raise ElasticError(cause=msg)
+
+        logger.debug("Script {} stored in {}".format(script_id, anonymize_url(self.url)))
 
     def update_analyzers(self, analyzers):
         """Update the settings with the analyzer for a given index.
@@ -365,9 +1159,11 @@ class ElasticSearch(object):
         3. Open the index.
 
         :param analyzers: elastic_analyzer.Analyzer object
+
+        :returns: True if the settings are updated, False if there were errors
         """
         if analyzers == '{}':
-            return
+            return True
 
         headers = {"Content-Type": "application/json"}
 
@@ -383,7 +1179,9 @@ class ElasticSearch(object):
         analysis = json.loads(analyzers)['settings']['analysis']
         if 'analysis' in index_settings and analysis == index_settings['analysis']:
             logger.debug("Index settings for {} is already updated. No need to update it".format(self.index))
-            return
+            return True
+
+        updated = True
 
         close_index_url = "{}/_close".format(self.index_url)
         res = self.requests.post(close_index_url, headers=headers)
@@ -391,6 +1189,7 @@ class ElasticSearch(object):
             res.raise_for_status()
         except requests.exceptions.HTTPError:
             logger.error("Error closing the index before updating settings: {}".format(res.text))
+            updated = False
 
         url_set = "{}/_settings".format(self.index_url)
         res = self.requests.put(url_set, data=analyzers,
@@ -399,6 +1198,7 @@ class ElasticSearch(object):
             res.raise_for_status()
         except requests.exceptions.HTTPError:
             logger.error("Error updating index settings {}. Settings: {}".format(res.text, analyzers))
+            updated = False
 
         open_index_url = "{}/_open".format(self.index_url)
         res = self.requests.post(open_index_url, headers=headers)
@@ -407,14 +1207,20 @@ class ElasticSearch(object):
             logger.debug("Index settings updated {}: {}".format(self.index, analyzers))
         except requests.exceptions.HTTPError:
             logger.error("Error opening the index after updating settings: {}".format(res.text))
+            updated = False
+
+        return updated
 
     def create_mappings(self, mappings):
         """Create the mappings for a given index. It includes the index
         pattern plus dynamic templates.
 
         :param mappings: elastic_mapping.Mapping object
+
+        :returns: True if the mappings are created, False if there were errors
         """
         headers = {"Content-Type": "application/json"}
+        created = True
 
         for _type in mappings:
 
@@ -428,35 +1234,16 @@ class ElasticSearch(object):
                     res.raise_for_status()
                 except requests.exceptions.HTTPError:
                     logger.error("Error creating ES mappings {}. Mapping: {}".format(res.text, str(mappings[_type])))
+                    created = False
 
-            # After version 6, strings are keywords (not analyzed)
-            not_analyze_strings = """
-            {
-              "dynamic_templates": [
-                { "notanalyzed": {
-                      "match": "*",
-                      "match_mapping_type": "string",
-                      "mapping": {
-                          "type": "keyword"
-                      }
-                   }
-                },
-                { "formatdate": {
-                      "match": "*",
-                      "match_mapping_type": "date",
-                      "mapping": {
-                          "type": "date",
-                          "format" : "strict_date_optional_time||epoch_millis"
-                      }
-                   }
-                }
-              ]
-            } """
-            res = self.requests.put(url_map, data=not_analyze_strings, headers=headers)
+            res = self.requests.put(url_map, data=DYNAMIC_TEMPLATES, headers=headers)
             try:
                 res.raise_for_status()
             except requests.exceptions.HTTPError:
-                logger.error("Can't add mapping {}: {}".format(anonymize_url(url_map), not_analyze_strings))
+                logger.error("Can't add mapping {}: {}".format(anonymize_url(url_map), DYNAMIC_TEMPLATES))
+                created = False
+
+        return created
 
     def get_last_date(self, field, filters_=[]):
         """Find the date of the last item stored in the index
@@ -481,6 +1268,12 @@ class ElasticSearch(object):
     def get_last_item_field(self, field, filters_=[], offset=False):
         """Find the offset/date of the last item stored in the index.
 
+        When the items are filtered, e.g. by origin, the last values of
+        all the origins are read at once with `get_last_values` and cached
+        for `last_values_ttl` seconds, so looking up the rest of origins
+        doesn't need more queries. The origins whose items were written
+        to the index since then are looked up on their own.
+
         :param field: field with the data
         :param filters_: additional filters to find the date
         :param offset: if True, returns the offset field instead of date field
@@ -493,6 +1286,19 @@ class ElasticSearch(object):
         if filters_ is None:
             filters_ = []
 
+        filters_ = [filter_ for filter_ in filters_ if filter_]
+        names = tuple(sorted(filter_['name'] for filter_ in filters_))
+        if names and self.last_values_ttl and len(set(names)) == len(names):
+            last_values = self.get_last_values(field, names, offset=offset)
+            values = {filter_['name']: str(filter_['value']) for filter_ in filters_}
+            written = _last_values_cache.get((self.index_url, field, names, offset), (None, None, set()))[2]
+            if last_values is not None and values.get(ROUTING_FIELD) not in written:
+                return last_values.get(tuple(values[name] for name in names))
+
+        # The items of an origin are in a single shard
+        routing = self.get_filters_routing(filters_)
+        params = {"routing": routing} if routing else None
+
         terms = []
         for filter_ in filters_:
             if not filter_:
@@ -520,28 +1326,122 @@ class ElasticSearch(object):
 
         headers = {"Content-Type": "application/json"}
 
-        res = self.requests.post(url, data=data_json, headers=headers)
+        res = self.requests.post(url, data=data_json, headers=headers, params=params)
         res.raise_for_status()
         res_json = res.json()
 
         if 'aggregations' in res_json:
-            last_value = res_json["aggregations"]["1"]["value"]
+            last_value = self.get_max_value(res_json["aggregations"]["1"], offset=offset)
+
+        return last_value
+
+    def get_last_values(self, field, group_fields, offset=False):
+        """Find the offset/date of the last item of each group of items in the index.
+
+        The groups are the combinations of values of `group_fields` (e.g.,
+        the origins), read in pages with a composite aggregation. The values
+        are cached by index for `last_values_ttl` seconds.
+
+        :param field: field with the data
+        :param group_fields: tuple of fields which define the groups (e.g., ("origin",))
+        :param offset: if True, returns the offset field instead of date field
 
-            if offset:
-                if last_value is not None:
-                    last_value = int(last_value)
+        :returns: dict with the last value by tuple of values of `group_fields`,
+            None if the values can't be aggregated
+        """
+        key = (self.index_url, field, group_fields, offset)
+        cached = _last_values_cache.get(key)
+        if cached and time.time() - cached[0] < self.last_values_ttl:
+            return cached[1]
+
+        url = self.index_url + "/_search"
+        query = {
+            "size": 0,
+            "aggs": {
+                "groups": {
+                    "composite": {
+                        "size": LAST_VALUES_PAGE_SIZE,
+                        "sources": [{name: {"terms": {"field": name}}} for name in group_fields]
+                    },
+                    "aggs": {
+                        "1": {
+                            "max": {
+                                "field": field
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        read_time = time.time()
+        last_values = {}
+        while True:
+            res = self.requests.post(url, data=codec.encode(query), headers=HEADER_JSON)
+            try:
+                res.raise_for_status()
+            except requests.exceptions.HTTPError:
+                logger.debug("Can't aggregate the last {} of {} by {}: {}".format(
+                             field, anonymize_url(self.index_url), group_fields, res.text))
+                return None
+
+            groups = codec.decode_response(res).get('aggregations', {}).get('groups', {})
+            for bucket in groups.get('buckets', []):
+                values = tuple(str(bucket['key'][name]) for name in group_fields)
+                last_values[values] = self.get_max_value(bucket["1"], offset=offset)
+
+            if not groups.get('buckets') or 'after_key' not in groups:
+                break
+            query['aggs']['groups']['composite']['after'] = groups['after_key']
+
+        logger.debug("Last {} of {} groups by {} read from {}".format(
+                     field, len(last_values), group_fields, anonymize_url(self.index_url)))
+
+        _last_values_cache[key] = (read_time, last_values, set())
+        return last_values
+
+    def clear_last_values(self):
+        """Forget the cached last values of the index"""
+
+        for key in [key for key in _last_values_cache if key[0] == self.index_url]:
+            _last_values_cache.pop(key, None)
+
+    def forget_last_values(self, origins):
+        """Forget the cached last values of the origins whose items were written to the index.
+
+        The last values of the rest of origins stay cached. When the
+        values aren't grouped by origin, or the origin of some items is
+        unknown, all the cached last values of the index are forgotten.
+
+        :param origins: set of the origins of the items written
+        """
+        for key in [key for key in _last_values_cache if key[0] == self.index_url]:
+            if None in origins or ROUTING_FIELD not in key[2]:
+                _last_values_cache.pop(key, None)
+            else:
+                _last_values_cache.get(key, (None, None, set()))[2].update(origins)
+
+    @staticmethod
+    def get_max_value(agg, offset=False):
+        """Convert the result of a max aggregation to an offset or a date"""
+
+        last_value = agg["value"]
+
+        if offset:
+            if last_value is not None:
+                last_value = int(last_value)
+        else:
+            if "value_as_string" in agg:
+                last_value = agg["value_as_string"]
+                last_value = str_to_datetime(last_value)
             else:
-                if "value_as_string" in res_json["aggregations"]["1"]:
-                    last_value = res_json["aggregations"]["1"]["value_as_string"]
-                    last_value = str_to_datetime(last_value)
-                else:
-                    last_value = res_json["aggregations"]["1"]["value"]
-                    if last_value:
-                        try:
-                            last_value = unixtime_to_datetime(last_value)
-                        except InvalidDateError:
-                            # last_value is in microsecs
-                            last_value = unixtime_to_datetime(last_value / 1000)
+                last_value = agg["value"]
+                if last_value:
+                    try:
+                        last_value = unixtime_to_datetime(last_value)
+                    except InvalidDateError:
+                        # last_value is in microsecs
+                        last_value = unixtime_to_datetime(last_value / 1000)
         return last_value
 
     def delete_items(self, retention_time, time_field="metadata__updated_on"):
@@ -561,6 +1461,16 @@ class ElasticSearch(object):
         before_date = get_diff_current_date(minutes=retention_time)
         before_date_str = before_date.isoformat()
 
+        index_url = self.index_url
+        if self.partitioned:
+            # Only the backing index of the month of the date has items to delete one by one
+            partitions = self.delete_partitions(before_date)
+            partitions = [partition for partition in partitions
+                          if self.get_partition_dates(partition)[0] <= before_date]
+            if not partitions:
+                return
+            index_url = self.url + "/" + ",".join(partitions)
+
         es_query = '''
                     {
                       "query": {
@@ -573,7 +1483,7 @@ class ElasticSearch(object):
                     }
                     ''' % (time_field, before_date_str)
 
-        r = self.requests.post(self.index_url + "/_delete_by_query?refresh",
+        r = self.requests.post(index_url + "/_delete_by_query?refresh",
                                data=es_query, headers=HEADER_JSON, verify=False)
         try:
             r.raise_for_status()
@@ -585,6 +1495,38 @@ class ElasticSearch(object):
                          anonymize_url(self.index_url), ex))
             return
 
+    def delete_partitions(self, before_date):
+        """Delete the backing indexes of the months before a date.
+
+        All their documents have an incremental date, and thus an update
+        date, before `before_date`. The backing index of the current month
+        is never deleted, the alias of the index needs it.
+
+        :param before_date: date before which the backing indexes are deleted
+
+        :returns: list with the names of the backing indexes kept
+        """
+        partitions = self.get_partitions()
+        kept = []
+
+        for i, partition in enumerate(partitions):
+            if i == len(partitions) - 1 or self.get_partition_dates(partition)[1] > before_date:
+                kept.extend(partitions[i:])
+                break
+
+            res = self.requests.delete(self.url + "/" + partition)
+            try:
+                res.raise_for_status()
+                logger.debug("[items retention] Index {} deleted from {}.".format(
+                             partition, anonymize_url(self.index_url)))
+            except requests.exceptions.HTTPError as ex:
+                logger.error("[items retention] Error deleting index {}. {}".format(partition, ex))
+                kept.append(partition)
+
+        self.clear_last_values()
+
+        return kept
+
     def all_properties(self):
         """Get all properties of a given index"""
 
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Streaming writer of NDJSON bulk requests to ElasticSearch"""
+
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+
+import requests
+
+from . import codec
+from .enriched.utils import anonymize_url
+
+logger = logging.getLogger(__name__)
+
+# Bulk items failing with these errors are retried, the rest are dead letters
+RETRY_STATUS = [429, 503]
+RETRY_ERRORS = ['es_rejected_execution_exception']
+
+MIN_SCALE_BULK = 1 / 16  # min fraction of the configured bulk size
+INCREASE_SCALE_BULK = 1 / 8  # fraction of the bulk size increased after a healthy bulk
+
+
+class BulkWriter:
+    """Accumulate documents into bulk requests bounded in bytes.
+
+    Each document is encoded to UTF-8 on its own, so a document with
+    characters that can't be encoded is cleaned up without affecting
+    the rest of the documents of the bulk. The bulk request is sent
+    to ElasticSearch as soon as adding a new document would exceed
+    the byte budget (`max_bytes_bulk`) or the number of documents
+    reaches `max_items_bulk`, both defined in the ElasticSearch object.
+
+    Up to `max_inflight_bulks` requests can be in flight at the same
+    time, so documents keep being produced while ElasticSearch indexes
+    the previous bulks. The results are acknowledged in the same order
+    the bulks were sent, thus `watermark` is always the marker of the
+    last document which has been processed together with all the
+    documents added before it.
+
+    The size of the bulks adapts to the cluster load (AIMD): it is halved
+    when ElasticSearch rejects documents or a bulk takes longer than
+    `max_latency_bulk` seconds, and it grows again slowly, up to the
+    configured limits, with every healthy bulk. Rejected documents are
+    retried up to `max_retries_bulk` times waiting exponentially longer
+    between attempts. Documents which can't be uploaded are written to
+    the NDJSON file `dead_letter_path`, when defined, so they can be
+    uploaded later with `replay_dead_letter`.
+
+    Documents added with `create` which already exist in the index are
+    not failures, they are counted in `existing`.
+
+    :param elastic: ElasticSearch object where the documents are uploaded
+    :param url: bulk endpoint, by default the one of the `elastic` index
+    :param on_watermark: function called with the new `watermark` every
+        time a bulk with markers is acknowledged (e.g., to store it)
+    """
+    def __init__(self, elastic, url=None, on_watermark=None):
+        self.elastic = elastic
+        self.url = url if url else elastic.get_bulk_url()
+        self.on_watermark = on_watermark
+        self.max_bytes = elastic.max_bytes_bulk
+        self.max_items = elastic.max_items_bulk
+        self.max_inflight = max(1, elastic.max_inflight_bulks)
+        self.max_retries = elastic.max_retries_bulk
+        self.retry_delay = elastic.retry_delay_bulk
+        self.max_latency = elastic.max_latency_bulk
+        self.dead_letter_path = elastic.dead_letter_path
+        self.scale = 1.0
+
+        self.chunks = []
+        self.size = 0
+        self.current = 0
+        self.marker = None
+        self.total = 0
+        self.failed = 0
+        self.skipped = 0
+        self.existing = 0
+        self.partitioned_docs = []  # id and backing index of the documents of the bulk
+        self.origins = set()  # origins of the documents written, their cached last values are outdated
+        self.watermark = None
+
+        self.executor = None
+        self.inflight = deque()
+        if self.max_inflight > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_inflight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.shutdown()
+
+    @staticmethod
+    def encode_document(doc):
+        """Encode a document to UTF-8 JSON, removing the characters that can't be encoded.
+
+        :param doc: document to encode
+        :returns: bytes representation of the document
+        """
+        return codec.encode(doc)
+
+    @staticmethod
+    def encode_action(action):
+        """Encode a bulk action line (e.g., `{"index": {"_id": "1"}}`)"""
+
+        return codec.encode(action) + b'\n'
+
+    @property
+    def bulk_bytes(self):
+        """Max size in bytes of the next bulk, adapted to the cluster load"""
+
+        return max(1, int(self.max_bytes * self.scale))
+
+    @property
+    def bulk_items(self):
+        """Max number of documents of the next bulk, adapted to the cluster load"""
+
+        return max(1, int(self.max_items * self.scale))
+
+    def add(self, doc, doc_id, marker=None):
+        """Add a document to the bulk, sending the bulk before if it is full.
+
+        :param doc: document to upload
+        :param doc_id: id of the document in the index
+        :param marker: value that identifies the position of the document
+            in the input (e.g., its incremental date), used as `watermark`
+            once the document is uploaded
+        """
+        self.add_action({"index": self.get_action_meta(doc, doc_id)}, doc, marker=marker)
+
+    def create(self, doc, doc_id, marker=None):
+        """Add a document to the bulk only if it isn't in the index yet.
+
+        :param doc: document to upload
+        :param doc_id: id of the document in the index
+        :param marker: value that identifies the position of the document
+            in the input, used as `watermark` once the document is processed
+        """
+        self.add_action({"create": self.get_action_meta(doc, doc_id)}, doc, marker=marker)
+
+    def get_action_meta(self, doc, doc_id):
+        """Get the metadata of the bulk action of a document: its id and routing"""
+
+        self.origins.add(doc.get('origin'))
+
+        meta = {"_id": doc_id}
+        routing = self.elastic.get_routing(doc, doc_id)
+        if routing:
+            meta["routing"] = routing
+        if self.elastic.partitioned:
+            meta["_index"] = self.elastic.get_partition(doc)
+
+        return meta
+
+    def add_action(self, action, doc, marker=None):
+        """Add a bulk action and its document, sending the bulk before if it is full.
+
+        :param action: bulk action of the document
+        :param doc: document (source) of the action
+        :param marker: value that identifies the position of the document
+            in the input, used as `watermark` once the action is processed
+        """
+        self.add_entry(action, self.encode_entry(action, doc), marker=marker)
+
+    def encode_entry(self, action, doc):
+        """Encode a bulk action and its document as an entry of the bulk request"""
+
+        return self.encode_action(action) + self.encode_document(doc) + b'\n'
+
+    def add_entry(self, action, entry, marker=None):
+        """Add an entry already encoded, sending the bulk before if it is full.
+
+        It allows encoding the documents somewhere else (e.g., in other
+        threads) than where they are added to the bulk.
+
+        :param action: bulk action of the entry
+        :param entry: action and document encoded with `encode_entry`
+        :param marker: value that identifies the position of the document
+            in the input, used as `watermark` once the action is processed
+        """
+        if self.current and (self.current >= self.bulk_items or self.size + len(entry) > self.bulk_bytes):
+            self.flush()
+
+        self.chunks.append(entry)
+        self.size += len(entry)
+        self.current += 1
+        meta = action.get('index', action.get('create', {}))
+        if '_index' in meta and self.elastic.partitioned:
+            self.partitioned_docs.append((meta['_id'], meta['_index']))
+        if marker is not None:
+            self.marker = marker
+
+    def skip(self, marker=None):
+        """Account for a document which doesn't need to be uploaded.
+
+        The document counts in `skipped` and its marker becomes the
+        `watermark` once the documents added before it are processed.
+
+        :param marker: value that identifies the position of the document
+            in the input, used as `watermark`
+        """
+        self.skipped += 1
+
+        if marker is None:
+            return
+
+        if self.current:
+            self.marker = marker
+        elif self.inflight:
+            # Acknowledged after the bulks in flight, without a request
+            if self.inflight[-1][0] is None:
+                self.inflight.pop()
+            self.inflight.append((None, marker))
+        else:
+            self.__set_watermark(marker)
+
+    def flush(self):
+        """Send the documents pending to ElasticSearch.
+
+        When concurrent bulks are enabled, the bulk is sent in background
+        and this method only waits for the oldest bulk when there are
+        already `max_inflight_bulks` requests in flight.
+        """
+        if not self.current:
+            return
+
+        entries = self.chunks
+        if self.partitioned_docs:
+            # Delete the copies of the documents in the backing indexes of other months
+            stale = self.elastic.get_stale_copies(self.partitioned_docs)
+            entries = entries + [self.encode_action(action) for action in stale]
+            self.partitioned_docs = []
+
+        if self.executor:
+            while sum(1 for future, _ in self.inflight if future) >= self.max_inflight:
+                self.__ack()
+            future = self.executor.submit(self.__put_bulk, entries, self.size)
+            self.inflight.append((future, self.marker))
+        else:
+            self.__ack_result(self.__put_bulk(entries, self.size), self.marker)
+
+        self.chunks = []
+        self.size = 0
+        self.current = 0
+
+    def wait(self):
+        """Wait until all the bulks in flight are acknowledged"""
+
+        while self.inflight:
+            self.__ack()
+
+    def close(self):
+        """Send the documents pending and return the number of documents uploaded.
+
+        The number of documents which couldn't be uploaded is available
+        in `failed`.
+        """
+
+        try:
+            self.flush()
+            self.wait()
+        finally:
+            self.shutdown()
+
+        # Refresh once, unless the bulk load of the index will do it
+        if self.total and self.elastic.refresh_policy == 'end' and not self.elastic.bulk_loading:
+            self.elastic.refresh()
+
+        return self.total
+
+    def shutdown(self):
+        """Release the threads used to send concurrent bulks.
+
+        The cached last values of the origins written are forgotten,
+        so they are read again from the index.
+        """
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.inflight.clear()
+
+        if self.origins:
+            self.elastic.forget_last_values(self.origins)
+            self.origins = set()
+
+    @staticmethod
+    def is_retryable(result):
+        """Check whether the result of a bulk item is a rejection that can be retried"""
+
+        error = result.get('error', {})
+        error_type = error.get('type') if isinstance(error, dict) else None
+
+        return result.get('status') in RETRY_STATUS or error_type in RETRY_ERRORS
+
+    def __put_bulk(self, entries, size):
+        """Send the entries, retrying the rejected ones.
+
+        :returns: tuple with the number of documents uploaded, the number
+            of documents created before, the list of entries that failed
+            with their results, whether there were rejections and the number
+            of seconds it took
+        """
+        task_init = time()
+
+        inserted = 0
+        existing = 0
+        failed = []
+        rejected = False
+        retries = 0
+
+        while entries:
+            try:
+                result = self.elastic.put_bulk(self.url, b''.join(entries))
+                results = [list(item.items())[0] for item in result['items']]
+            except requests.exceptions.HTTPError as ex:
+                if ex.response is None or ex.response.status_code not in RETRY_STATUS:
+                    raise
+                results = [(None, {'status': ex.response.status_code, 'error': str(ex)})] * len(entries)
+
+            retry = []
+            for entry, (action, item) in zip(entries, results):
+                if action == 'delete':
+                    # Copies of documents moved to other indexes, deleted or not found
+                    continue
+                elif 'error' not in item:
+                    inserted += 1
+                elif action == 'create' and item.get('status') == 409:
+                    existing += 1
+                elif self.is_retryable(item):
+                    retry.append((entry, item))
+                else:
+                    failed.append((entry, item))
+
+            entries = []
+            if retry:
+                rejected = True
+                if retries < self.max_retries:
+                    delay = self.retry_delay * 2 ** retries
+                    retries += 1
+                    logger.warning("{} items rejected by {}, retry {}/{} in {} sec".format(
+                                   len(retry), anonymize_url(self.url), retries, self.max_retries, delay))
+                    sleep(delay)
+                    entries = [entry for entry, _ in retry]
+                else:
+                    failed.extend(retry)
+
+        latency = time() - task_init
+
+        logger.debug("bulk packet sent ({:.2f} sec, {} items, {:.2f} MB) to {}".format(
+                     latency, inserted, size / (1024 * 1024), anonymize_url(self.url)))
+        return inserted, existing, failed, rejected, latency
+
+    def __ack(self):
+        future, marker = self.inflight.popleft()
+        if future is None:
+            self.__set_watermark(marker)
+        else:
+            self.__ack_result(future.result(), marker)
+
+    def __ack_result(self, result, marker):
+        inserted, existing, failed, rejected, latency = result
+
+        self.total += inserted
+        self.existing += existing
+        if failed:
+            self.failed += len(failed)
+            self.__dead_letter(failed)
+        if marker is not None:
+            self.__set_watermark(marker)
+
+        self.__adapt(rejected or latency > self.max_latency)
+
+    def __set_watermark(self, marker):
+        self.watermark = marker
+        if self.on_watermark:
+            self.on_watermark(marker)
+
+    def __adapt(self, overloaded):
+        """Shrink the size of the bulks when the cluster is overloaded, grow it otherwise"""
+
+        if overloaded:
+            scale = max(MIN_SCALE_BULK, self.scale / 2)
+        else:
+            scale = min(1.0, self.scale + INCREASE_SCALE_BULK)
+
+        if scale != self.scale:
+            logger.debug("bulk size for {} set to {} items, {:.2f} MB".format(
+                         anonymize_url(self.url), max(1, int(self.max_items * scale)),
+                         self.max_bytes * scale / (1024 * 1024)))
+        self.scale = scale
+
+    def __dead_letter(self, failed):
+        """Store the entries that couldn't be uploaded in the dead-letter file"""
+
+        errors = {}
+        for _, item in failed:
+            error = item.get('error', {})
+            error_type = error.get('type', str(error)) if isinstance(error, dict) else str(error)
+            errors[error_type] = errors.get(error_type, 0) + 1
+
+        if not self.dead_letter_path:
+            logger.error("{} items not uploaded to {}: {}".format(
+                         len(failed), anonymize_url(self.url), errors))
+            return
+
+        with open(self.dead_letter_path, 'ab') as fd:
+            for entry, item in failed:
+                action, doc = entry.split(b'\n', 1)
+                letter = {
+                    'url': anonymize_url(self.url),
+                    'status': item.get('status'),
+                    'error': item.get('error'),
+                    'action': codec.decode(action),
+                    'document': codec.decode(doc)
+                }
+                fd.write(self.encode_document(letter) + b'\n')
+
+        logger.error("{} items not uploaded to {}, stored in {}: {}".format(
+                     len(failed), anonymize_url(self.url), self.dead_letter_path, errors))
+
+
+def replay_dead_letter(elastic, path):
+    """Upload again the documents stored in a dead-letter file.
+
+    The documents are uploaded to the index of `elastic` with the same
+    bulk actions that failed. The documents which fail again are stored
+    in the dead-letter file of `elastic`, if any.
+
+    :param elastic: ElasticSearch object where the documents are uploaded
+    :param path: path of the NDJSON dead-letter file
+
+    :returns: number of documents uploaded
+    """
+    # Read the whole file first, failed documents may be appended to it
+    with open(path, 'rb') as fd:
+        lines = fd.readlines()
+
+    with BulkWriter(elastic) as writer:
+        for line in lines:
+            if not line.strip():
+                continue
+            letter = codec.decode(line)
+            writer.add_action(letter['action'], letter['document'])
+
+    logger.info("{} items replayed from {} to {}, {} failed".format(
+                writer.total, path, anonymize_url(elastic.index_url), writer.failed))
+    return writer.total
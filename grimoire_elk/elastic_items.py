@@ -22,22 +22,35 @@
 """Generates items from ElasticSearch based on filters """
 
 
+import copy
 import json
 import logging
+import queue
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
-from .enriched.utils import get_repository_filter, get_confluence_spaces_filter, grimoire_con, anonymize_url
+from grimoirelab_toolkit.datetime import str_to_datetime
+
+from . import codec
+from .enriched.utils import get_repository_filter, get_confluence_spaces_filter, ConnectionRegistry, anonymize_url
 from .elastic_mapping import Mapping
+from .errors import ELKError
 
 HEADER_JSON = {"Content-Type": "application/json"}
 MAX_BULK_UPDATE_SIZE = 1000
+KEEP_ALIVE = "10m"  # time to keep a scroll or point in time alive between pages
+MAX_SHARD_DOC = 2 ** 63 - 1  # max `_shard_doc`, to search after all the items with the same sort values
 
 FILTER_DATA_ATTR = 'data.'
 FILTER_SEPARATOR = r",\s*%s" % FILTER_DATA_ATTR
 PROJECTS_JSON_LABELS_PATTERN = r".*(--labels=\[(.*)\]).*"
 PROJECTS_JSON_SPACES_PATTERN = r".*(--spaces=\[(.*)\]).*"
 
+SIZE_BATCH_SCAN_LOAD = 100  # items of a shared scan prepared at once by its readers
+
 logger = logging.getLogger(__name__)
 
 
@@ -49,6 +62,12 @@ class ElasticItems:
     # Change it from p2o command line or mordred config
     scroll_size = 100
     scroll_wait = 900
+    compress_level = None  # gzip level (1-9) of the requests bodies, None to disable it
+    use_pit = True  # read with point in time and search_after when the instance supports it
+    fetch_slices = 1  # slices read in parallel by the full reads of an index
+    fetch_read_ahead = 0  # pages read in background ahead of the items being processed, 0 to disable it
+    immutable_items = False  # the items never change once collected (e.g., commits or messages)
+    skip_immutable = False  # don't upload nor enrich again the immutable items already stored
 
     def __init__(self, perceval_backend, from_date=None, insecure=True, offset=None, to_date=None):
         """Class to perform operations over the items stored in a ES index.
@@ -70,10 +89,15 @@ class ElasticItems:
         self.repo_labels = None
         self.repo_spaces = None
 
-        self.requests = grimoire_con(insecure)
+        self.requests = ConnectionRegistry.get_session(insecure, compress_level=self.compress_level)
         self.elastic = None
         self.elastic_url = None
         self.cfg_section_name = None
+        self.search_after = None  # sort values of the last item fetched
+        self.watermark = None  # incremental date until which all the items have been fetched
+        self.source_includes = None  # fields of the items to read, None to read all of them
+        self.source_excludes = None  # fields of the items not to read
+        self.tiebreak_field = None  # unique field to sort the items with the same date the same way in every read
 
     def get_repository_filter_raw(self, term=False):
         """Returns the filter to be used in queries in a repository items"""
@@ -190,6 +214,15 @@ class ElasticItems:
         """
         self.cfg_section_name = cfg_section_name
 
+    def set_source_fields(self, includes=None, excludes=None):
+        """Set the fields of the items read from the index, by default all of them
+
+        :param includes: list of fields to read (e.g., ["data.commit", "metadata__*"])
+        :param excludes: list of fields not to read (e.g., ["data.body.html"])
+        """
+        self.source_includes = includes
+        self.source_excludes = excludes
+
     def set_from_date(self, last_enrich_date):
         """Set the from date
 
@@ -215,25 +248,106 @@ class ElasticItems:
             logger.debug("Error releasing scroll: {}".format(res.json()))
 
     # Items generator
-    def fetch(self, _filter=None, ignore_incremental=False):
+    def fetch(self, _filter=None, ignore_incremental=False, search_after=None, slices=1, source_includes=None):
         """Fetch the items from raw or enriched index. An optional _filter can be
         provided to filter the data collected
 
+        The items are read with a point in time and `search_after` when the
+        instance supports it, so no scroll context is kept by the server for
+        each reader. Otherwise, they are read with a scroll. The sort values
+        of the last item fetched are available in `search_after`, to resume
+        the reading later; across different reads, the items with the same
+        date are sorted the same way only with a `tiebreak_field`.
+
+        With several `slices`, the index is read in parallel by one thread per
+        slice and the items are yielded in the order they are received. As
+        the items of each slice are sorted, `watermark` is the minimum value
+        of the incremental date received from the slices still in progress:
+        all the items before it have been fetched.
+
+        With `fetch_read_ahead` pages, the next pages are read in a background
+        thread while the items already received are processed.
+
         :param _filter: optional filter of data collected
         :param ignore_incremental: if True, incremental collection is ignored
+        :param search_after: sort values of the item after which to start
+            reading, only used with a single slice
+        :param slices: number of slices read in parallel
+        :param source_includes: fields of the items to read (e.g., ["data.commit"]),
+            by default the ones set with `set_source_fields`
         """
 
         logger.debug("Creating a elastic items generator.")
 
+        self.search_after = search_after
+        self.watermark = None
+
+        if slices > 1:
+            yield from self.__fetch_sliced(slices, _filter, ignore_incremental, source_includes)
+            return
+
+        order_field = self.get_elastic_items_order_field()
+
+        hits = self.fetch_hits(_filter=_filter, ignore_incremental=ignore_incremental, search_after=search_after,
+                               source_includes=source_includes)
+        if self.fetch_read_ahead > 0:
+            hits = self.__read_ahead(hits, self.fetch_read_ahead)
+
+        for hit in hits:
+            eitem = hit['_source']
+            self.search_after = hit.get('sort', self.search_after)
+            if order_field:
+                self.watermark = eitem.get(order_field, self.watermark)
+            yield eitem
+
+    def fetch_hits(self, _filter=None, ignore_incremental=False, search_after=None, slice_=None, pit_id=None,
+                   source_includes=None):
+        """Fetch the hits (items with their sort values) from raw or enriched index.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param search_after: sort values of the item after which to start
+            reading; with scroll, the items until it are read and skipped
+        :param slice_: slice of the index to read (e.g., {"id": 0, "max": 4})
+        :param pit_id: point in time to read, opened (and closed) by this
+            method when it isn't provided
+        :param source_includes: fields of the items to read, by default the
+            ones set with `set_source_fields`
+        """
+        source = self.get_elastic_items_source(source_includes)
+
+        own_pit = not pit_id
+        if own_pit and self.use_pit and self.elastic:
+            pit_id = self.elastic.open_pit(KEEP_ALIVE, routing=self.get_elastic_items_routing(),
+                                           index_url=self.get_elastic_items_index_url(ignore_incremental))
+
+        if pit_id:
+            # The id of the point in time may change with every search
+            pit = {'id': pit_id}
+            page = self.get_elastic_items_pit(pit_id, search_after, _filter=_filter,
+                                              ignore_incremental=ignore_incremental, slice_=slice_, source=source,
+                                              stream=True)
+            try:
+                if page:
+                    yield from self.__fetch_pit_hits(page, pit, _filter, ignore_incremental, slice_, source)
+                    return
+            finally:
+                if own_pit:
+                    self.elastic.close_pit(pit['id'])
+
+            # The search with point in time failed, read with scroll instead
+
         scroll_id = None
-        page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
+        page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                      slice_=slice_, source=source, stream=True)
         if page and 'too_many_scrolls' in page:
             sec = self.scroll_wait
             while sec > 0:
                 logger.debug("Too many scrolls open, waiting up to {} seconds".format(sec))
                 time.sleep(1)
                 sec -= 1
-                page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
+                page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                              slice_=slice_, source=source, stream=True)
                 if not page:
                     logger.debug("Waiting for scroll terminated")
                     break
@@ -256,41 +370,191 @@ class ElasticItems:
 
         while scroll_size > 0:
 
-            logger.debug("Fetching from {}: {} received".format(
-                         anonymize_url(self.elastic.index_url), len(page['hits']['hits'])))
+            scroll_size = 0
             for item in page['hits']['hits']:
-                eitem = item['_source']
-                yield eitem
+                scroll_size += 1
+                if search_after:
+                    if item.get('sort', [])[:len(search_after)] <= list(search_after):
+                        continue
+                    search_after = None
+                yield item
 
-            page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
+            logger.debug("Fetching from {}: {} received".format(
+                         anonymize_url(self.elastic.index_url), scroll_size))
 
-            if not page:
+            if not scroll_size:
                 break
 
-            scroll_size = len(page['hits']['hits'])
+            page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                          stream=True)
+
+            if not page:
+                break
 
         self.free_scroll(scroll_id)
         logger.debug("Fetching from {}: done receiving".format(anonymize_url(self.elastic.index_url)))
 
-    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, ignore_incremental=False):
+    def __fetch_pit_hits(self, page, pit, _filter, ignore_incremental, slice_, source):
+        """Yield the hits of the pages of a point in time, starting with `page`"""
+
+        while page:
+            pit['id'] = page.get('pit_id', pit['id'])
+
+            received = 0
+            hit = None
+            for hit in page['hits']['hits']:
+                received += 1
+                yield hit
+
+            logger.debug("Fetching from {}: {} received".format(
+                         anonymize_url(self.elastic.index_url), received))
+
+            if received < self.scroll_size:
+                break
+
+            page = self.get_elastic_items_pit(pit['id'], hit['sort'], _filter=_filter,
+                                              ignore_incremental=ignore_incremental, slice_=slice_, source=source,
+                                              stream=True)
+
+        logger.debug("Fetching from {}: done receiving".format(anonymize_url(self.elastic.index_url)))
+
+    def __read_ahead(self, hits, pages):
+        """Yield the hits read in a background thread, up to `pages` pages ahead"""
+
+        buffer = queue.Queue(maxsize=pages * self.scroll_size)
+        stop = threading.Event()
+        done = object()
+
+        def put(entry):
+            while not stop.is_set():
+                try:
+                    buffer.put(entry, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read():
+            try:
+                for hit in hits:
+                    if not put(hit):
+                        break
+            except Exception as ex:
+                put(ex)
+            finally:
+                # Release the scroll or point in time when the reading is interrupted
+                hits.close()
+                put(done)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        try:
+            while True:
+                hit = buffer.get()
+                if hit is done:
+                    break
+                if isinstance(hit, Exception):
+                    raise hit
+                yield hit
+        finally:
+            stop.set()
+            reader.join()
+
+    def __fetch_sliced(self, slices, _filter, ignore_incremental, source_includes):
+        """Yield the items of several slices of the index read in parallel"""
+
+        order_field = self.get_elastic_items_order_field()
+        pit_id = None
+        if self.use_pit and self.elastic:
+            pit_id = self.elastic.open_pit(KEEP_ALIVE, routing=self.get_elastic_items_routing(),
+                                           index_url=self.get_elastic_items_index_url(ignore_incremental))
+
+        hits = queue.Queue(maxsize=slices * self.scroll_size)
+        stop = threading.Event()
+
+        def put(entry):
+            while not stop.is_set():
+                try:
+                    hits.put(entry, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_slice(slice_id):
+            slice_ = {"id": slice_id, "max": slices}
+            try:
+                for hit in self.fetch_hits(_filter=_filter, ignore_incremental=ignore_incremental,
+                                           slice_=slice_, pit_id=pit_id, source_includes=source_includes):
+                    if not put((slice_id, hit)):
+                        return
+            except Exception as ex:
+                put((slice_id, ex))
+            finally:
+                put((slice_id, None))
+
+        logger.debug("Fetching from {} in {} slices".format(anonymize_url(self.elastic.index_url), slices))
+
+        executor = ThreadPoolExecutor(max_workers=slices)
+        for slice_id in range(slices):
+            executor.submit(read_slice, slice_id)
+
+        active = set(range(slices))
+        last = {}
+        try:
+            while active:
+                slice_id, hit = hits.get()
+                if isinstance(hit, Exception):
+                    raise hit
+
+                if hit is None:
+                    active.discard(slice_id)
+                elif order_field and hit['_source'].get(order_field) is not None:
+                    last[slice_id] = hit['_source'][order_field]
+
+                # The slices without items received yet could have older items
+                if active and all(slice_ in last for slice_ in active):
+                    self.watermark = min(last[slice_] for slice_ in active)
+
+                if hit is not None:
+                    yield hit['_source']
+
+            if last:
+                self.watermark = max(last.values())
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+            if pit_id:
+                self.elastic.close_pit(pit_id)
+
+    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, ignore_incremental=False, slice_=None,
+                          source=None, stream=False):
         """Get the items from the index related to the backend applying and
         optional _filter if provided
 
         :param elastic_scroll_id: If not None, it allows to continue scrolling the data
         :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
         :param ignore_incremental: if True, incremental collection is ignored
+        :param slice_: if not None, slice of the index to scroll (e.g., {"id": 0, "max": 4})
+        :param source: if not None, `_source` fields to read (e.g., {"includes": ["data.commit"]})
+        :param stream: if True, the hits of the page (`hits.hits`) are an iterator
+            decoded one by one while the page is downloaded
         """
         headers = {"Content-Type": "application/json"}
 
         if not self.elastic:
             return None
-        url = self.elastic.index_url
+        url = self.get_elastic_items_index_url(ignore_incremental)
         # 1 minute to process the results of size items
         # In gerrit enrich with 500 items per page we need >1 min
         # In Mozilla ES in Amazon we need 10m
-        max_process_items_pack_time = "10m"  # 10 minutes
+        max_process_items_pack_time = KEEP_ALIVE
         url += "/_search?scroll=%s&size=%i" % (max_process_items_pack_time,
                                                self.scroll_size)
+        routing = self.get_elastic_items_routing()
+        if routing:
+            # The items of the repository are in a single shard
+            url += "&" + urlencode({"routing": routing})
 
         if elastic_scroll_id:
             """ Just continue with the scrolling """
@@ -302,71 +566,21 @@ class ElasticItems:
             }
             query_data = json.dumps(scroll_data)
         else:
-            # If using a perceval backends always filter by repository
-            # to support multi repository indexes
-            filters_dict = self.get_repository_filter_raw(term=True)
-            if filters_dict:
-                filters = json.dumps(filters_dict)
-            else:
-                filters = ''
-
-            if self.filter_raw:
-                for fltr in self.filter_raw_dict:
-                    filters += '''
-                        , {"term":
-                            { "%s":"%s"  }
-                        }
-                    ''' % (fltr['name'], fltr['value'])
-
-            if _filter:
-                filter_str = '''
-                    , {"terms":
-                        { "%s": %s }
-                    }
-                ''' % (_filter['name'], _filter['value'])
-                # List to string conversion uses ' that are not allowed in JSON
-                filter_str = filter_str.replace("'", "\"")
-                filters += filter_str
-
-            filters_spaces_dict = self.get_confluence_spaces(self.repo_spaces)
-            if filters_spaces_dict:
-                filters_spaces = json.dumps(filters_spaces_dict)
-                filters += '''
-                    , {"bool":%s}
-                ''' % (filters_spaces)
-
-            # The code below performs the incremental enrichment based on the last value of `metadata__timestamp`
-            # in the enriched index, which is calculated in the TaskEnrich before enriching the single repos that
-            # belong to a given data source. The old implementation of the incremental enrichment, which consisted in
-            # collecting the last value of `metadata__timestamp` in the enriched index for each repo, didn't work
-            # for global data source (which are collected globally and only partially enriched).
-            if self.from_date and not ignore_incremental:
-                date_field = self.get_incremental_date()
-                from_date = self.from_date.isoformat()
-
-                filters += '''
-                    , {"range":
-                        {"%s": {"gte": "%s"}}
-                    }
-                ''' % (date_field, from_date)
-            elif self.offset and not ignore_incremental:
-                filters += '''
-                    , {"range":
-                        {"offset": {"gte": %i}}
-                    }
-                ''' % self.offset
+            filters = self.get_elastic_items_filters(_filter=_filter, ignore_incremental=ignore_incremental)
 
             # Order the raw items from the old ones to the new so if the
             # enrich process fails, it could be resume incrementally
             order_query = ''
-            order_field = None
-            if self.perceval_backend:
-                order_field = self.get_incremental_date()
+            order_field = self.get_elastic_items_order_field()
             if order_field is not None:
-                order_query = ', "sort": { "%s": { "order": "asc" }} ' % order_field
-
-            # Fix the filters string if it starts with "," (empty first filter)
-            filters = filters.lstrip()[1:] if filters.lstrip().startswith(',') else filters
+                sort = [{order_field: {"order": "asc"}}]
+                if self.tiebreak_field:
+                    sort.append({self.tiebreak_field: {"order": "asc"}})
+                order_query = ', "sort": %s ' % json.dumps(sort)
+            if slice_:
+                order_query += ', "slice": %s ' % json.dumps(slice_)
+            if source:
+                order_query += ', "_source": %s ' % json.dumps(source)
 
             query = """
             {
@@ -384,12 +598,15 @@ class ElasticItems:
 
         rjson = None
         try:
-            res = self.requests.post(url, data=query_data, headers=headers)
-            if self.too_many_scrolls(res):
+            res = self.requests.post(url, data=query_data, headers=headers, stream=stream)
+            # Lone surrogates are removed, they can't be uploaded again
+            if stream and res.ok:
+                return codec.decode_search_response(res)
+            page = codec.decode_response(res)
+            if self.too_many_scrolls(page):
                 return {'too_many_scrolls': True}
             res.raise_for_status()
-            rjson = json.loads(json.dumps(res.json(), ensure_ascii=False)
-                               .encode('utf-8', errors='ignore').decode('utf-8'))
+            rjson = page
 
         except Exception:
             # The index could not exists yet or it could be empty
@@ -397,9 +614,173 @@ class ElasticItems:
 
         return rjson
 
-    def too_many_scrolls(self, res):
+    def get_elastic_items_pit(self, pit_id, search_after=None, _filter=None, ignore_incremental=False, slice_=None,
+                              source=None, stream=False):
+        """Get a page of items of a point in time, sorted by the incremental date.
+
+        :param pit_id: id of the point in time
+        :param search_after: sort values of the last item of the previous page
+        :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param slice_: if not None, slice of the index to read (e.g., {"id": 0, "max": 4})
+        :param source: if not None, `_source` fields to read (e.g., {"includes": ["data.commit"]})
+        :param stream: if True, the hits of the page (`hits.hits`) are an iterator
+            decoded one by one while the page is downloaded
+
+        :returns: page of items, None if the search failed
+        """
+        url = self.elastic.url + "/_search"
+
+        filters = self.get_elastic_items_filters(_filter=_filter, ignore_incremental=ignore_incremental)
+
+        # Sort on the incremental date, ties are broken by the position of the document in the shards
+        sort = [{"_shard_doc": "asc"}]
+        order_field = self.get_elastic_items_order_field()
+        if order_field is not None:
+            if self.tiebreak_field:
+                sort.insert(0, {self.tiebreak_field: {"order": "asc"}})
+            sort.insert(0, {order_field: {"order": "asc"}})
+
+        query = {
+            "size": self.scroll_size,
+            "query": {
+                "bool": {
+                    "filter": codec.decode("[%s]" % filters)
+                }
+            },
+            "pit": {
+                "id": pit_id,
+                "keep_alive": KEEP_ALIVE
+            },
+            "sort": sort,
+            "track_total_hits": False
+        }
+        if search_after:
+            # Sort values stored without `_shard_doc` (e.g., checkpoints) skip all the items with them
+            query["search_after"] = list(search_after) + [MAX_SHARD_DOC] * (len(sort) - len(search_after))
+        if slice_:
+            query["slice"] = slice_
+        if source:
+            query["_source"] = source
+
+        res = self.requests.post(url, data=codec.encode(query), headers=HEADER_JSON, stream=stream)
+        try:
+            res.raise_for_status()
+        except Exception:
+            logger.debug("Error searching in {}: {}".format(anonymize_url(self.elastic.index_url), res.text))
+            return None
+
+        # Lone surrogates are removed, they can't be uploaded again
+        if stream:
+            return codec.decode_search_response(res)
+        return codec.decode_response(res)
+
+    def get_elastic_items_source(self, includes=None):
+        """Get the `_source` fields to read, None to read the whole items
+
+        :param includes: fields to read instead of `source_includes`
+        """
+        includes = includes if includes else self.source_includes
+
+        source = {}
+        if includes:
+            source['includes'] = includes
+        if self.source_excludes:
+            source['excludes'] = self.source_excludes
+
+        return source if source else None
+
+    def get_elastic_items_index_url(self, ignore_incremental=False):
+        """Get the URL of the indexes to read, only the backing indexes after `from_date`
+        when the index is partitioned by the incremental date"""
+
+        if (self.from_date and not ignore_incremental and self.elastic.partitioned
+                and self.elastic.date_field == self.get_incremental_date()):
+            return self.elastic.get_partitions_url(self.from_date)
+
+        return self.elastic.index_url
+
+    def get_elastic_items_routing(self):
+        """Get the routing of the items of the repository, None to read all the shards"""
+
+        filter_ = self.get_repository_filter_raw()
+        if not filter_ or not self.elastic:
+            return None
+
+        return self.elastic.get_filters_routing([filter_])
+
+    def get_elastic_items_order_field(self):
+        """Get the field used to sort the items, None to read them unsorted"""
+
+        return self.get_incremental_date() if self.perceval_backend else None
+
+    def get_elastic_items_filters(self, _filter=None, ignore_incremental=False):
+        """Get the filters of the query to read the items, as a JSON list without brackets
+
+        :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
+        :param ignore_incremental: if True, incremental collection is ignored
+        """
+        # If using a perceval backends always filter by repository
+        # to support multi repository indexes
+        filters_dict = self.get_repository_filter_raw(term=True)
+        if filters_dict:
+            filters = json.dumps(filters_dict)
+        else:
+            filters = ''
+
+        if self.filter_raw:
+            for fltr in self.filter_raw_dict:
+                filters += '''
+                    , {"term":
+                        { "%s":"%s"  }
+                    }
+                ''' % (fltr['name'], fltr['value'])
+
+        if _filter:
+            filter_str = '''
+                , {"terms":
+                    { "%s": %s }
+                }
+            ''' % (_filter['name'], _filter['value'])
+            # List to string conversion uses ' that are not allowed in JSON
+            filter_str = filter_str.replace("'", "\"")
+            filters += filter_str
+
+        filters_spaces_dict = self.get_confluence_spaces(self.repo_spaces)
+        if filters_spaces_dict:
+            filters_spaces = json.dumps(filters_spaces_dict)
+            filters += '''
+                , {"bool":%s}
+            ''' % (filters_spaces)
+
+        # The code below performs the incremental enrichment based on the last value of `metadata__timestamp`
+        # in the enriched index, which is calculated in the TaskEnrich before enriching the single repos that
+        # belong to a given data source. The old implementation of the incremental enrichment, which consisted in
+        # collecting the last value of `metadata__timestamp` in the enriched index for each repo, didn't work
+        # for global data source (which are collected globally and only partially enriched).
+        if self.from_date and not ignore_incremental:
+            date_field = self.get_incremental_date()
+            from_date = self.from_date.isoformat()
+
+            filters += '''
+                , {"range":
+                    {"%s": {"gte": "%s"}}
+                }
+            ''' % (date_field, from_date)
+        elif self.offset and not ignore_incremental:
+            filters += '''
+                , {"range":
+                    {"offset": {"gte": %i}}
+                }
+            ''' % self.offset
+
+        # Fix the filters string if it starts with "," (empty first filter)
+        filters = filters.lstrip()[1:] if filters.lstrip().startswith(',') else filters
+
+        return filters
+
+    def too_many_scrolls(self, r):
         """Check if result conatins 'too many scroll contexts' error"""
-        r = res.json()
         return (
             r
             and 'status' in r
@@ -410,3 +791,213 @@ class ElasticItems:
             and 'reason' in r['error']['root_cause'][0]
             and 'Trying to create too many scroll contexts' in r['error']['root_cause'][0]['reason']
         )
+
+
+class SharedScan:
+    """Read the items of an index once for several consumers.
+
+    Each consumer gets a `ScanReader`, which can be used in place of the
+    `ElasticItems` object of the scan (e.g., by `Enrich.enrich_items`):
+    its `fetch` generates the items read by the scan, with their sort
+    values and watermark. The consumers run in their own threads and
+    each one gets its own copy of the items through a bounded queue, so
+    the scan goes at the pace of the slowest consumer.
+
+    The scan starts from the oldest incremental date (or offset) of the
+    readers, and each reader drops the items older than its own one.
+
+    :param ocean_backend: ElasticItems object with the items to read
+    :param queue_size: items waiting to be consumed by each reader,
+        by default the size of a page of the scan
+    """
+    def __init__(self, ocean_backend, queue_size=None):
+        self.ocean_backend = ocean_backend
+        self.queue_size = queue_size if queue_size else ocean_backend.scroll_size
+        self.readers = []
+
+    def get_reader(self, from_date=None, offset=None, load_items=None):
+        """Get a reader of the items for a new consumer.
+
+        :param from_date: incremental date of the reader, by default the one of the scan
+        :param offset: incremental offset of the reader, by default the one of the scan
+        :param load_items: function called with each batch of items before
+            generating them (e.g., to add their identities to SortingHat)
+        """
+        reader = ScanReader(self, load_items=load_items)
+        if from_date:
+            reader.from_date = from_date
+        if offset:
+            reader.offset = offset
+        self.readers.append(reader)
+
+        return reader
+
+    def run(self, consumers):
+        """Read the items while the consumers process them.
+
+        :param consumers: list with a function for each reader, in the
+            same order, called with the reader in a thread of its own
+
+        :returns: list with the results of the consumers
+        """
+        threads = []
+        for reader, consumer in zip(self.readers, consumers):
+            threads.append(threading.Thread(target=reader.consume, args=(consumer,), daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        error = None
+        try:
+            self.__scan()
+        except Exception as ex:
+            error = ex
+            logger.error("Error reading the items of {} for {} consumers: {}".format(
+                         anonymize_url(self.ocean_backend.elastic.index_url), len(self.readers), ex))
+        finally:
+            for reader in self.readers:
+                reader.finish(error)
+
+        for thread in threads:
+            thread.join()
+
+        errors = [reader.error for reader in self.readers if reader.error]
+        if error or errors:
+            raise error if error else errors[0]
+
+        return [reader.result for reader in self.readers]
+
+    def __scan(self):
+        ocean_backend = self.ocean_backend
+
+        from_dates = [reader.from_date for reader in self.readers]
+        ocean_backend.from_date = None if None in from_dates else min(from_dates)
+        offsets = [reader.offset for reader in self.readers]
+        ocean_backend.offset = None if None in offsets else min(offsets)
+        if ocean_backend.get_elastic_items_order_field():
+            ocean_backend.tiebreak_field = ocean_backend.get_field_unique_id()
+
+        for item in ocean_backend.fetch(slices=ocean_backend.fetch_slices):
+            search_after = list(ocean_backend.search_after) if ocean_backend.search_after else None
+            for i, reader in enumerate(self.readers):
+                # The consumers may modify the items, each one gets its own copy
+                reader_item = item if i == 0 else copy.deepcopy(item)
+                reader.put((reader_item, search_after, ocean_backend.watermark))
+
+
+class ScanReader:
+    """Items of a `SharedScan` for one of its consumers.
+
+    The attributes not defined by the reader are the ones of the
+    `ElasticItems` object of the scan.
+    """
+    def __init__(self, scan, load_items=None):
+        self.scan = scan
+        self.load_items = load_items
+        self.from_date = scan.ocean_backend.from_date
+        self.offset = scan.ocean_backend.offset
+        self.search_after = None
+        self.watermark = None
+
+        self.items = queue.Queue(scan.queue_size)
+        self.consumed = False  # the items of the scan were already generated
+        self.closed = False  # the consumer doesn't read more items
+        self.result = None
+        self.error = None
+
+    def __getattr__(self, name):
+        return getattr(self.scan.ocean_backend, name)
+
+    def fetch(self, _filter=None, ignore_incremental=False, search_after=None, slices=1, source_includes=None):
+        """Generate the items of the shared scan newer than the incremental date of the reader.
+
+        The items are generated from the incremental date of the reader
+        and, with `search_after` (e.g., the sort values of a checkpoint),
+        after the item with those sort values. Other reads of the items
+        (e.g., with a filter or after reading the items of the scan) are
+        done from the index by a copy of the `ElasticItems` object of the scan.
+        """
+        if _filter or self.consumed:
+            ocean_backend = copy.copy(self.scan.ocean_backend)
+            ocean_backend.from_date = self.from_date
+            ocean_backend.offset = self.offset
+            yield from ocean_backend.fetch(_filter=_filter, ignore_incremental=ignore_incremental,
+                                           search_after=search_after, slices=slices,
+                                           source_includes=source_includes)
+            return
+
+        self.consumed = True
+        from_date = self.from_date if not ignore_incremental else None
+        offset = self.offset if not ignore_incremental else None
+        search_after = list(search_after) if search_after and not ignore_incremental else None
+        date_field = self.get_incremental_date()
+
+        batch = []
+        while True:
+            entry = self.items.get()
+            if isinstance(entry, _ScanEnd):
+                break
+
+            item = entry[0]
+            if from_date and str_to_datetime(item[date_field]) < from_date:
+                continue
+            if offset and item.get('offset', offset) < offset:
+                continue
+            # The items with the date of the checkpoint were enriched up to the one with its sort values
+            sort = entry[1]
+            if search_after and sort and sort[:len(search_after)] <= search_after:
+                continue
+
+            batch.append(entry)
+            if not self.load_items or len(batch) >= SIZE_BATCH_SCAN_LOAD:
+                yield from self.__generate(batch)
+                batch = []
+
+        yield from self.__generate(batch)
+
+        if entry.error:
+            raise ELKError(cause="Items of {} not read: {}".format(
+                           anonymize_url(self.scan.ocean_backend.elastic.index_url), entry.error))
+
+    def __generate(self, batch):
+        if batch and self.load_items:
+            self.load_items([item for item, _, _ in batch])
+
+        for item, search_after, watermark in batch:
+            self.search_after = search_after
+            self.watermark = watermark
+            yield item
+
+    def consume(self, consumer):
+        """Run the consumer of the items, storing its result or its error"""
+
+        try:
+            self.result = consumer(self)
+        except Exception as ex:
+            self.error = ex
+            logger.error("Error consuming the items of {}: {}".format(
+                         anonymize_url(self.scan.ocean_backend.elastic.index_url), ex), exc_info=True)
+        finally:
+            self.closed = True
+
+    def put(self, entry):
+        """Add an entry for the consumer, waiting while its queue is full"""
+
+        while not self.closed:
+            try:
+                self.items.put(entry, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self, error=None):
+        """Let the consumer know the scan ended"""
+
+        self.put(_ScanEnd(error))
+
+
+class _ScanEnd:
+    """End of the items of a shared scan, with the error that stopped it, if any"""
+
+    def __init__(self, error=None):
+        self.error = error
@@ -20,30 +20,31 @@
 #   Quan Zhou <quan@bitergia.com>
 #
 
+import functools
 import inspect
 import logging
+from contextlib import nullcontext
 from functools import lru_cache
 
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-
 from perceval.backend import find_signature_parameters, Archive
 from perceval.errors import RateLimitError
 from grimoirelab_toolkit.datetime import (datetime_utcnow, str_to_datetime)
 
 from .elastic_mapping import Mapping as BaseMapping
-from .elastic_items import ElasticItems
+from .elastic_items import ElasticItems, SharedScan
 from .enriched.sortinghat_gelk import SortingHat
-from .enriched.utils import get_last_enrich, grimoire_con, get_diff_current_date, anonymize_url
+from .enriched.utils import (get_last_enrich, get_diff_current_date, anonymize_url, ConnectionRegistry,
+                             has_from_date)
+from .errors import ELKError
 from .utils import get_connectors, get_connector_from_name, get_elastic
 
 IDENTITIES_INDEX = "grimoirelab_identities_cache"
 SECRET_PARAMETERS = ["--api-token", "--backend-password"]
 SIZE_SCROLL_IDENTITIES_INDEX = 1000
+SIZE_BATCH_FED_IDENTITIES = 100
 
 logger = logging.getLogger(__name__)
 
-requests_ses = grimoire_con()
-
 
 def anonymize_params(parameters):
     """ The following parameters after SECRET_PARAMETERS will be
@@ -67,11 +68,24 @@ def anonymize_params(parameters):
     return tuple(param_list)
 
 
+def bulk_load(elastic):
+    """Context to write into `elastic`, in bulk load mode when the index is new or was cleaned"""
+
+    if elastic.new_index:
+        return elastic.bulk_load()
+    return nullcontext(elastic)
+
+
 def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
                  es_index=None, es_index_enrich=None, project=None,
                  es_aliases=None, projects_json_repo=None, repo_labels=None,
-                 anonymize=False):
-    """ Feed Ocean with backend data """
+                 anonymize=False, fused_enrich=None):
+    """ Feed Ocean with backend data
+
+    With `fused_enrich`, an enrich backend (see `get_enrich_backend`), the
+    items are also enriched while they are fed, instead of reading them
+    again from the raw index in a later enrichment.
+    """
 
     error_msg = None
     backend = None
@@ -123,6 +137,10 @@ def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
         ocean_backend.set_elastic(elastic_ocean)
         ocean_backend.set_repo_labels(repo_labels)
         ocean_backend.set_projects_json_repo(projects_json_repo)
+        if fused_enrich:
+            ocean_backend.set_items_consumer(functools.partial(enrich_fed_items,
+                                                               ocean_backend=ocean_backend,
+                                                               enrich_backend=fused_enrich))
 
         if fetch_archive:
             signature = inspect.signature(backend.fetch_from_archive)
@@ -202,7 +220,11 @@ def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
         if no_update:
             params['no_update'] = no_update
 
-        ocean_backend.feed(**params)
+        with bulk_load(elastic_ocean), bulk_load(fused_enrich.elastic) if fused_enrich else nullcontext():
+            ocean_backend.feed(**params)
+
+        if fused_enrich:
+            fused_enrich.update_items(ocean_backend, fused_enrich)
 
     except RateLimitError as ex:
         logger.error("Error feeding raw from {} ({}): rate limit exceeded".format(backend_name, backend.origin))
@@ -234,7 +256,7 @@ def refresh_projects(enrich_backend):
                  anonymize_url(enrich_backend.elastic.index_url)))
     total = 0
 
-    eitems = enrich_backend.fetch()
+    eitems = enrich_backend.fetch(slices=enrich_backend.fetch_slices)
     for eitem in eitems:
         new_project = enrich_backend.get_item_project(eitem)
         eitem.update(new_project)
@@ -388,6 +410,34 @@ def load_identities(ocean_backend, enrich_backend):
     return identities_count
 
 
+def enrich_fed_items(items, ocean_backend, enrich_backend):
+    """Enrich the raw items while they are fed, adding their identities to SortingHat before"""
+
+    if enrich_backend.sh_db and enrich_backend.has_identities():
+        items = load_fed_identities(items, enrich_backend)
+
+    total = enrich_backend.enrich_fed_items(ocean_backend, items)
+    logger.debug("Total fed items enriched {} ".format(total))
+
+    return total
+
+
+def load_fed_identities(items, enrich_backend):
+    """Add the identities of the raw items to SortingHat, in batches, before generating them"""
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= SIZE_BATCH_FED_IDENTITIES:
+            load_identities(batch, enrich_backend)
+            yield from batch
+            batch = []
+
+    if batch:
+        load_identities(batch, enrich_backend)
+        yield from batch
+
+
 def enrich_items(ocean_backend, enrich_backend, events=False):
     total = 0
 
@@ -399,6 +449,71 @@ def enrich_items(ocean_backend, enrich_backend, events=False):
     return total
 
 
+def start_enrichment(ocean_backend, enrich_backend, no_incremental=False, from_date=False):
+    """Set where the enrichment of the raw items starts.
+
+    The enrichment resumes from its checkpoint, if any, unless all the
+    raw items are enriched again, which deletes the checkpoint, or the
+    date or offset from which to enrich them is given.
+
+    :param ocean_backend: backend to access raw items
+    :param enrich_backend: backend to access enriched items
+    :param no_incremental: enrich all the raw items again
+    :param from_date: the date or offset of the raw items is given
+    """
+    if no_incremental:
+        enrich_backend.delete_checkpoint(ocean_backend)
+    elif from_date:
+        logger.debug("[{}] From date given, the checkpoint of the enrichment isn't used".format(
+                     enrich_backend.get_connector_name()))
+    else:
+        enrich_backend.resume_from_checkpoint(ocean_backend)
+
+
+def enrich_targets_items(ocean_backend, targets, no_incremental=False, from_date=False):
+    """Enrich the raw items for several targets reading the raw index once.
+
+    Each target enriches the raw items in a thread of its own, from its
+    own incremental date or checkpoint, and uploads them to its index. The
+    identities of the raw items are added to SortingHat, in batches, before
+    they are enriched.
+
+    :param ocean_backend: backend to access raw items
+    :param targets: list of tuples with an enrich backend, whether it enriches
+        the events of the items and the ocean backend with its incremental date
+    :param no_incremental: enrich all the raw items again
+    :param from_date: the date or offset of the raw items is given
+
+    :returns: list with the number of items enriched by each target
+    """
+    # The fields of the raw items read are the ones needed by any of the targets
+    includes = [enrich_backend.raw_fields_includes for enrich_backend, _, _ in targets]
+    excludes = [enrich_backend.raw_fields_excludes for enrich_backend, _, _ in targets]
+    ocean_backend.set_source_fields(None if None in includes else sorted(set().union(*includes)),
+                                    None if None in excludes else sorted(set(excludes[0]).intersection(*excludes)))
+
+    scan = SharedScan(ocean_backend)
+    consumers = []
+
+    for enrich_backend, events, target_ocean in targets:
+        load_items = None
+        if enrich_backend.sh_db and enrich_backend.has_identities():
+            load_items = functools.partial(load_identities, enrich_backend=enrich_backend)
+
+        reader = scan.get_reader(from_date=target_ocean.from_date, offset=target_ocean.offset,
+                                 load_items=load_items)
+
+        start_enrichment(reader, enrich_backend, no_incremental=no_incremental, from_date=from_date)
+
+        def consume(reader, enrich_backend=enrich_backend, events=events):
+            with bulk_load(enrich_backend.elastic):
+                return enrich_items(reader, enrich_backend, events=events)
+
+        consumers.append(consume)
+
+    return scan.run(consumers)
+
+
 def get_ocean_backend(backend_cmd, enrich_backend, no_incremental, filter_raw=None, repo_spaces=None):
     """ Get the ocean backend configured to start from the last enriched date """
 
@@ -445,6 +560,7 @@ def get_ocean_backend(backend_cmd, enrich_backend, no_incremental, filter_raw=No
         ocean_backend.set_filter_raw(filter_raw)
     if repo_spaces:
         ocean_backend.set_repo_spaces(repo_spaces)
+    ocean_backend.set_source_fields(enrich_backend.raw_fields_includes, enrich_backend.raw_fields_excludes)
 
     return ocean_backend
 
@@ -484,6 +600,57 @@ def do_studies(ocean_backend, enrich_backend, studies_args, retention_time=None)
                 elastic.delete_items(retention_time)
 
 
+def get_enrich_backend(url, clean, backend_name, backend_params, cfg_section_name, enrich_index,
+                       json_projects_map=None, db_sortinghat=None,
+                       db_user=None, db_password=None, db_host=None,
+                       db_port=None, db_path=None, db_ssl=False,
+                       db_verify_ssl=True, db_tenant=None,
+                       filter_raw=None, jenkins_rename_file=None,
+                       unaffiliated_group=None, pair_programming=False,
+                       node_regex=False, es_enrich_aliases=None,
+                       last_enrich_date=None, projects_json_repo=None,
+                       repo_labels=None, repo_spaces=None):
+    """Get the enrich backend of a connector, ready to write to the index `enrich_index` of `url`"""
+
+    connector = get_connector_from_name(backend_name)
+
+    enrich_backend = connector[2](db_sortinghat=db_sortinghat,
+                                  json_projects_map=json_projects_map,
+                                  db_user=db_user,
+                                  db_password=db_password,
+                                  db_host=db_host,
+                                  db_port=db_port,
+                                  db_path=db_path,
+                                  db_ssl=db_ssl,
+                                  db_verify_ssl=db_verify_ssl,
+                                  db_tenant=db_tenant)
+    enrich_backend.set_params(backend_params)
+    # store the cfg section name in the enrich backend to recover the corresponding project name in projects.json
+    enrich_backend.set_cfg_section_name(cfg_section_name)
+    enrich_backend.set_from_date(last_enrich_date)
+    elastic_enrich = get_elastic(url, enrich_index, clean, enrich_backend, es_enrich_aliases)
+    enrich_backend.set_elastic(elastic_enrich)
+    if jenkins_rename_file and backend_name == "jenkins":
+        enrich_backend.set_jenkins_rename_file(jenkins_rename_file)
+    if unaffiliated_group:
+        enrich_backend.unaffiliated_group = unaffiliated_group
+    if pair_programming:
+        enrich_backend.pair_programming = pair_programming
+    if node_regex:
+        enrich_backend.node_regex = node_regex
+
+    # The filter raw is needed to be able to assign the project value to an enriched item
+    # see line 544, grimoire_elk/enriched/enrich.py (fltr = eitem['origin'] + ' --filter-raw=' + self.filter_raw)
+    if filter_raw:
+        enrich_backend.set_filter_raw(filter_raw)
+
+    enrich_backend.set_projects_json_repo(projects_json_repo)
+    enrich_backend.set_repo_labels(repo_labels)
+    enrich_backend.set_repo_spaces(repo_spaces)
+
+    return enrich_backend
+
+
 def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
                    ocean_index=None,
                    ocean_index_enrich=None, json_projects_map=None,
@@ -500,8 +667,16 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
                    unaffiliated_group=None, pair_programming=False,
                    node_regex=False, studies_args=None, es_enrich_aliases=None,
                    last_enrich_date=None, projects_json_repo=None, repo_labels=None,
-                   repo_spaces=None):
-    """ Enrich Ocean index """
+                   repo_spaces=None, enrich_targets=None):
+    """ Enrich Ocean index
+
+    With `enrich_targets`, the raw items are also enriched for other
+    targets in the same read of the raw index (see `enrich_targets_items`).
+    Each target is a dict with the `backend` of the enricher (by default
+    `backend_name`), its enriched `index` and whether it enriches the
+    `events` of the items. The index of the events of the same backend
+    defaults to the enriched index plus "_events".
+    """
 
     backend = None
     enrich_index = None
@@ -534,42 +709,30 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
         if events_enrich:
             enrich_index += "_events"
 
-        enrich_backend = connector[2](db_sortinghat=db_sortinghat,
-                                      json_projects_map=json_projects_map,
-                                      db_user=db_user,
-                                      db_password=db_password,
-                                      db_host=db_host,
-                                      db_port=db_port,
-                                      db_path=db_path,
-                                      db_ssl=db_ssl,
-                                      db_verify_ssl=db_verify_ssl,
-                                      db_tenant=db_tenant)
-        enrich_backend.set_params(backend_params)
-        # store the cfg section name in the enrich backend to recover the corresponding project name in projects.json
-        enrich_backend.set_cfg_section_name(cfg_section_name)
-        enrich_backend.set_from_date(last_enrich_date)
-        if url_enrich:
-            elastic_enrich = get_elastic(url_enrich, enrich_index, clean, enrich_backend, es_enrich_aliases)
-        else:
-            elastic_enrich = get_elastic(url, enrich_index, clean, enrich_backend, es_enrich_aliases)
-        enrich_backend.set_elastic(elastic_enrich)
-        if jenkins_rename_file and backend_name == "jenkins":
-            enrich_backend.set_jenkins_rename_file(jenkins_rename_file)
-        if unaffiliated_group:
-            enrich_backend.unaffiliated_group = unaffiliated_group
-        if pair_programming:
-            enrich_backend.pair_programming = pair_programming
-        if node_regex:
-            enrich_backend.node_regex = node_regex
-
-        # The filter raw is needed to be able to assign the project value to an enriched item
-        # see line 544, grimoire_elk/enriched/enrich.py (fltr = eitem['origin'] + ' --filter-raw=' + self.filter_raw)
-        if filter_raw:
-            enrich_backend.set_filter_raw(filter_raw)
-
-        enrich_backend.set_projects_json_repo(projects_json_repo)
-        enrich_backend.set_repo_labels(repo_labels)
-        enrich_backend.set_repo_spaces(repo_spaces)
+        enrich_params = {
+            'json_projects_map': json_projects_map,
+            'db_sortinghat': db_sortinghat,
+            'db_user': db_user,
+            'db_password': db_password,
+            'db_host': db_host,
+            'db_port': db_port,
+            'db_path': db_path,
+            'db_ssl': db_ssl,
+            'db_verify_ssl': db_verify_ssl,
+            'db_tenant': db_tenant,
+            'filter_raw': filter_raw,
+            'jenkins_rename_file': jenkins_rename_file,
+            'unaffiliated_group': unaffiliated_group,
+            'pair_programming': pair_programming,
+            'node_regex': node_regex,
+            'es_enrich_aliases': es_enrich_aliases,
+            'last_enrich_date': last_enrich_date,
+            'projects_json_repo': projects_json_repo,
+            'repo_labels': repo_labels,
+            'repo_spaces': repo_spaces
+        }
+        enrich_backend = get_enrich_backend(url_enrich if url_enrich else url, clean, backend_name, backend_params,
+                                            cfg_section_name, enrich_index, **enrich_params)
 
         ocean_backend = get_ocean_backend(backend_cmd, enrich_backend, no_incremental, filter_raw, repo_spaces)
 
@@ -607,28 +770,57 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
             logger.debug("Adding enrichment data to {}".format(
                          anonymize_url(enrich_backend.elastic.index_url)))
 
-            if db_sortinghat and enrich_backend.has_identities():
-                # FIXME: This step won't be done from enrich in the future
-                logger.info(f"[{backend_name}] Load identities process starts")
-                total_ids = load_identities(ocean_backend, enrich_backend)
-                logger.info(f"[{backend_name}] Load identities process ends")
-                logger.debug("Total identities loaded {} ".format(total_ids))
+            targets = [(enrich_backend, events_enrich, ocean_backend)]
+            for target in enrich_targets or []:
+                target_name = target.get('backend', backend_name)
+                target_events = target.get('events', False)
+                target_index = target.get('index')
+                if not target_index:
+                    if not target_events or target_name != backend_name:
+                        raise ELKError(cause="Index of the enrich target {} not defined".format(target_name))
+                    target_index = enrich_index + "_events"
+                target_backend = get_enrich_backend(url_enrich if url_enrich else url, clean, target_name,
+                                                    backend_params, cfg_section_name, target_index,
+                                                    **enrich_params)
+                # Incremental date of the target, the raw items are read from the oldest one
+                target_ocean = get_ocean_backend(backend_cmd, target_backend, no_incremental, filter_raw, repo_spaces)
+                targets.append((target_backend, target_events, target_ocean))
+
+            if len(targets) > 1 and not only_identities:
+                logger.info("[{}] Enriching the raw items for {} targets at once".format(backend_name, len(targets)))
+                enrich_counts = enrich_targets_items(ocean_backend, targets, no_incremental=no_incremental,
+                                                     from_date=has_from_date(backend_cmd, enrich_backend))
+                logger.debug("Total items enriched {} ".format(enrich_counts))
+                if studies:
+                    for target_backend, _, _ in targets:
+                        do_studies(ocean_backend, target_backend, studies_args)
+            else:
+                if db_sortinghat and enrich_backend.has_identities():
+                    # FIXME: This step won't be done from enrich in the future
+                    logger.info(f"[{backend_name}] Load identities process starts")
+                    total_ids = load_identities(ocean_backend, enrich_backend)
+                    logger.info(f"[{backend_name}] Load identities process ends")
+                    logger.debug("Total identities loaded {} ".format(total_ids))
 
-            if only_identities:
-                logger.debug("Only SH identities added. Enrich not done!")
+                if only_identities:
+                    logger.debug("Only SH identities added. Enrich not done!")
 
-            else:
-                # Enrichment for the new items once SH update is finished
-                if not events_enrich:
-                    enrich_count = enrich_items(ocean_backend, enrich_backend)
-                    if enrich_count is not None:
-                        logger.debug("Total items enriched {} ".format(enrich_count))
                 else:
-                    enrich_count = enrich_items(ocean_backend, enrich_backend, events=True)
-                    if enrich_count is not None:
-                        logger.debug("Total events enriched {} ".format(enrich_count))
-                if studies:
-                    do_studies(ocean_backend, enrich_backend, studies_args)
+                    start_enrichment(ocean_backend, enrich_backend, no_incremental=no_incremental,
+                                     from_date=has_from_date(backend_cmd, enrich_backend))
+
+                    # Enrichment for the new items once SH update is finished
+                    with bulk_load(enrich_backend.elastic):
+                        if not events_enrich:
+                            enrich_count = enrich_items(ocean_backend, enrich_backend)
+                            if enrich_count is not None:
+                                logger.debug("Total items enriched {} ".format(enrich_count))
+                        else:
+                            enrich_count = enrich_items(ocean_backend, enrich_backend, events=True)
+                            if enrich_count is not None:
+                                logger.debug("Total events enriched {} ".format(enrich_count))
+                    if studies:
+                        do_studies(ocean_backend, enrich_backend, studies_args)
 
     except Exception as ex:
         if backend:
@@ -847,8 +1039,7 @@ def retain_identities(retention_time, es_enrichment_url, sortinghat_db, data_sou
     before_date = get_diff_current_date(minutes=retention_time)
     before_date_str = before_date.isoformat()
 
-    es = Elasticsearch([es_enrichment_url], timeout=120, max_retries=20, retry_on_timeout=True,
-                       connection_class=RequestsHttpConnection, verify_certs=False)
+    es = ConnectionRegistry.get_client(es_enrichment_url, timeout=120, max_retries=20)
 
     # delete the unique identities which have not been seen after `before_date`
     delete_inactive_unique_identities(es, sortinghat_db, before_date_str)
@@ -918,7 +1109,7 @@ def populate_identities_index(es_enrichment_url, enrich_index):
     logger.debug("[identities-index] Start adding identities to {}".format(IDENTITIES_INDEX))
 
     identities = []
-    for eitem in enriched_items.fetch(ignore_incremental=True):
+    for eitem in enriched_items.fetch(ignore_incremental=True, slices=enriched_items.fetch_slices):
         for sh_uuid_attr in sh_uuid_attributes:
 
             if sh_uuid_attr not in eitem:
@@ -154,8 +154,9 @@ class ESConnector(Connector):
         self._read_only = read_only
         self.__log_prefix = "[" + es_index + "] study "
 
-        self._es_major = self._es_conn.info()['version']['number'].split('.')[0]
-        self._es_distribution = self._es_conn.info()['version'].get('distribution', 'elasticsearch')
+        version = self._es_conn.info()['version']
+        self._es_major = version['number'].split('.')[0]
+        self._es_distribution = version.get('distribution', 'elasticsearch')
 
     def update_repo(self, repo):
         self._repo = repo
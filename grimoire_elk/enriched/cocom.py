@@ -26,20 +26,17 @@ import hashlib
 
 from dateutil.relativedelta import relativedelta
 
-from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
-
 from .enrich import (Enrich,
                      metadata)
 from .graal_study_evolution import (get_to_date,
                                     get_unique_repository,
                                     get_files_at_time)
-from .utils import fix_field_date, anonymize_url
+from .utils import fix_field_date, anonymize_url, ConnectionRegistry
 from ..elastic_mapping import Mapping as BaseMapping
 
 from grimoirelab_toolkit.datetime import datetime_utcnow
 from grimoire_elk.elastic import ElasticSearch
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
 LANGUAGES = {
     'java': 'Java',
     'py': 'Python',
@@ -263,25 +260,19 @@ class CocomEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend, events=False):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of the files analyzed in a commit with their ids"""
 
-        for item in ocean_backend.fetch():
-            rich_items = self.get_rich_items(item)
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in self.get_rich_items(item)]
 
-            items_to_enrich.extend(rich_items)
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+    def enrich_items(self, ocean_backend, events=False):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
@@ -299,8 +290,7 @@ class CocomEnrich(Enrich):
 
         logger.info("[cocom] study enrich-cocom-analysis start")
 
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
         interval_months = list(map(int, interval_months))
 
@@ -22,11 +22,10 @@
 import logging
 
 from ..elastic_mapping import Mapping as BaseMapping
-from .utils import get_time_diff_days, grimoire_con
+from .utils import get_time_diff_days
 
 from .enrich import Enrich, metadata
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
 # Headers
 HKEY = 'Api-Key'
 HUSER = 'Api-Username'
@@ -165,17 +164,14 @@ class DiscourseEnrich(Enrich):
 
     def __collect_categories(self, origin, headers):
         categories = {}
-        con = grimoire_con()
-
-        raw_site = con.get(origin + "/site.json", headers=headers)
+        raw_site = self.requests.get(origin + "/site.json", headers=headers)
         for cat in raw_site.json()['categories']:
             categories[cat['id']] = cat['name']
         return categories
 
     def __collect_categories_tree(self, origin, headers):
         tree = {}
-        con = grimoire_con()
-        raw = con.get(origin + "/categories.json", headers=headers)
+        raw = self.requests.get(origin + "/categories.json", headers=headers)
         raw_json = raw.json()
         if "category_list" in raw_json and 'categories' in raw_json["category_list"]:
             categories = raw_json["category_list"]['categories']
@@ -294,28 +290,22 @@ class DiscourseEnrich(Enrich):
     def get_field_unique_id(self):
         return "id"
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of a topic and its answers with their ids"""
 
-        for item in ocean_backend.fetch():
-            eitem = self.get_rich_item(item)
-            items_to_enrich.append(eitem)
+        items_to_enrich = [self.get_rich_item(item)]
+        items_to_enrich.extend(self.get_rich_item_answers(item))
 
-            rich_item_answers = self.get_rich_item_answers(item)
-            items_to_enrich.extend(rich_item_answers)
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
 
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
@@ -21,36 +21,43 @@
 #   Miguel Ángel Fernández <mafesan@bitergia.com>
 #
 import datetime
+import hashlib
 import json
 import functools
 import logging
+import multiprocessing
 import requests
-import sys
+import threading
 import time
 
+from collections import deque
+from contextlib import contextmanager
+
 from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 
 import pkg_resources
 from functools import lru_cache
 
-from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
 from geopy.geocoders import Nominatim
 
 from perceval.backend import find_signature_parameters
 from grimoirelab_toolkit.datetime import datetime_utcnow, str_to_datetime
 
+from ..checkpoints import CheckpointStore
 from ..elastic import ElasticSearch
 from ..elastic_analyzer import Analyzer
+from ..elastic_bulk import BulkWriter
 from ..elastic_items import (ElasticItems,
                              HEADER_JSON)
+from ..pipeline import Pipeline, Stage
 from .study_ceres_onion import ESOnionConnector, onion_study
 from .sortinghat_gelk import MULTI_ORG_NAMES
 from .graal_study_evolution import (get_to_date,
                                     get_unique_repository)
 from statsmodels.duration.survfunc import SurvfuncRight
 
-from .utils import grimoire_con, METADATA_FILTER_RAW, REPO_LABELS, anonymize_url
+from .utils import METADATA_FILTER_RAW, REPO_LABELS, anonymize_url, ConnectionRegistry
 from .. import __version__
 
 logger = logging.getLogger(__name__)
@@ -73,6 +80,23 @@ DEFAULT_DB_USER = 'root'
 CUSTOM_META_PREFIX = 'cm'
 EXTRA_PREFIX = 'extra'
 SH_UNKNOWN_VALUE = 'Unknown'
+CONTENT_HASH = 'metadata__content_hash'
+# Fields of the rich items which change in every enrichment, left out of their content hash
+VOLATILE_FIELDS = ['metadata__enriched_on', CONTENT_HASH]
+
+# Enricher of a worker process, see `Enrich.iter_rich_docs`
+_worker_enrich = None
+
+
+def _init_enrich_worker(enrich):
+    global _worker_enrich
+
+    _worker_enrich = enrich
+    enrich.init_worker()
+
+
+def _get_page_rich_docs(items, events):
+    return [_worker_enrich.get_rich_docs(item, events) if item is not None else None for item in items]
 
 
 def metadata(func):
@@ -97,6 +121,43 @@ def metadata(func):
     return decorator
 
 
+class ThreadSortingHatClient:
+    """SortingHat client with a connection for each thread.
+
+    The SortingHat clients aren't thread-safe. The threads which enrich
+    items at the same time (e.g., the consumers of a `SharedScan` or the
+    enrich stage of the pipeline) use a client of their own, created the
+    first time they access it. The attributes of this object are the ones
+    of the client of the current thread.
+
+    :param params: parameters to create the SortingHat clients
+    """
+    def __init__(self, **params):
+        self.params = params
+        self.local = threading.local()
+
+    def get_client(self):
+        """Get the client of the current thread, connecting it the first time"""
+
+        client = getattr(self.local, 'client', None)
+        if not client:
+            client = SortingHatClient(**self.params)
+            client.connect()
+            client.gqlc.logger.setLevel(logging.CRITICAL)
+            self.local.client = client
+
+        return client
+
+    def connect(self):
+        """Replace the clients of all the threads with a new one for the current thread"""
+
+        self.local = threading.local()
+        self.get_client()
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
 class Enrich(ElasticItems):
     analyzer = Analyzer
     sh_db = None
@@ -105,6 +166,25 @@ class Enrich(ElasticItems):
                        "offset", "origin", "tag", "uuid"]
     KEYWORD_MAX_LENGTH = 1000  # this control allows to avoid max_bytes_length_exceeded_exception
 
+    # Fields of the raw items read to enrich them (_source includes/excludes), None to read all of them
+    raw_fields_includes = None
+    raw_fields_excludes = None
+
+    # Index with the position of the last raw item enriched of each repository, to resume the
+    # enrichment right after it, None to disable the checkpoints
+    checkpoint_index = None
+
+    # Don't upload the rich items whose content hash is the same of the one in the index
+    skip_unchanged = False
+
+    # Processes running `get_rich_docs` on pages of raw items, 0 to enrich them in the main process
+    enrich_processes = 0
+
+    # Size of the queues between the stages of the enrichment, 0 to run the stages in sequence
+    pipeline_queue_size = 0
+    enrich_threads = 1
+    serialize_threads = 1
+
     ONION_INTERVAL = seconds = 3600 * 24 * 7
 
     def __init__(self, db_sortinghat=None, json_projects_map=None, db_user='',
@@ -121,13 +201,12 @@ class Enrich(ElasticItems):
             raise RuntimeError("Sorting hat configured but libraries not available.")
         if db_sortinghat:
             if not Enrich.sh_db:
-                client = SortingHatClient(host=db_host, port=db_port,
-                                          path=db_path, ssl=db_ssl,
-                                          verify_ssl=db_verify_ssl,
-                                          user=db_user, password=db_password,
-                                          tenant=db_tenant)
-                client.connect()
-                client.gqlc.logger.setLevel(logging.CRITICAL)
+                client = ThreadSortingHatClient(host=db_host, port=db_port,
+                                                path=db_path, ssl=db_ssl,
+                                                verify_ssl=db_verify_ssl,
+                                                user=db_user, password=db_password,
+                                                tenant=db_tenant)
+                client.get_client()
                 Enrich.sh_db = client
 
             self.sortinghat = True
@@ -148,7 +227,7 @@ class Enrich(ElasticItems):
 
         self.studies = []
 
-        self.requests = grimoire_con()
+        self.requests = ConnectionRegistry.get_session()
         self.elastic = None
         self.type_name = "items"  # type inside the index to store items enriched
 
@@ -162,6 +241,8 @@ class Enrich(ElasticItems):
         self.unaffiliated_group = 'Unknown'
         # Label used during enrichment for identities with no gender info
         self.unknown_gender = 'Unknown'
+        # Checkpoint of the enrichment to resume from, see `resume_from_checkpoint`
+        self.checkpoint = None
 
     def set_elastic_url(self, url):
         """ Elastic URL """
@@ -316,7 +397,7 @@ class Enrich(ElasticItems):
     def enrich_events(self, items):
         return self.enrich_items(items, events=True)
 
-    def enrich_items(self, ocean_backend, events=False):
+    def enrich_items(self, ocean_backend, events=False, on_docs=None):
         """
         Enrich the items fetched from ocean_backend generator
         generating enriched items/events which are uploaded to the Elasticsearch index for
@@ -324,60 +405,465 @@ class Enrich(ElasticItems):
 
         :param ocean_backend: Ocean backend object to fetch the items from
         :param events: enrich items or enrich events
+        :param on_docs: function called with the list of the rich items, and
+            their ids, of each raw item (see `upload_rich_docs`)
         :return: total number of enriched items/events uploaded to Elasticsearch
         """
 
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
+        # Items read in parallel slices aren't sorted, their position is the watermark of the reading
+        slices = ocean_backend.fetch_slices
 
-        items = ocean_backend.fetch()
+        store = self.get_checkpoint_store() if ocean_backend.get_elastic_items_order_field() else None
+        search_after = None
+        on_watermark = None
+        if store:
+            # The items with the same date must be read in the same order to resume after one of them
+            ocean_backend.tiebreak_field = ocean_backend.get_field_unique_id()
+            if self.checkpoint and slices == 1:
+                search_after = self.checkpoint['sort']
 
-        url = self.elastic.get_bulk_url()
+            checkpoint_key = self.get_checkpoint_key(ocean_backend)
 
-        logger.debug("Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
+            def save_checkpoint(marker):
+                store.save(*checkpoint_key, timestamp=marker[0], sort=marker[1])
 
-        if events:
-            logger.debug("Adding events items")
+            on_watermark = save_checkpoint
 
-        for item in items:
-            if current >= max_items:
-                try:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("Added {} items to {} ({:.2f} MB)".format(total, anonymize_url(url), json_size))
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.error("Unicode error in enriched items")
-                    logger.debug(bulk_json)
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    total += self.elastic.safe_put_bulk(url, safe_json)
-                bulk_json = ""
-                current = 0
-
-            if not events:
-                rich_item = self.get_rich_item(item)
-                data_json = json.dumps(rich_item)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                             (item[self.get_field_unique_id()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-            else:
-                rich_events = self.get_rich_events(item)
-                for rich_event in rich_events:
-                    data_json = json.dumps(rich_event)
-                    bulk_json += '{"index" : {"_id" : "%s_%s" } }\n' % \
-                                 (item[self.get_field_unique_id()],
-                                  rich_event[self.get_field_event_unique_id()])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        items = ocean_backend.fetch(slices=slices, search_after=search_after)
+
+        with BulkWriter(self.elastic, on_watermark=on_watermark) as writer:
+            logger.debug("Adding items to {} (in {} packs, {:.2f} MB max)".format(
+                         anonymize_url(writer.url), self.elastic.max_items_bulk,
+                         self.elastic.max_bytes_bulk / (1024 * 1024)))
+
+            if events:
+                logger.debug("Adding events items")
+
+            incremental_field = self.get_incremental_date()
+
+            def mark_items():
+                for item in items:
+                    marker = ocean_backend.watermark if slices > 1 else item.get(incremental_field)
+                    if store and marker is not None:
+                        # Sort values of the date and the tiebreak field, without `_shard_doc`
+                        sort = ocean_backend.search_after[:2] if slices == 1 and ocean_backend.search_after else None
+                        marker = (marker, sort)
+                    yield item, marker
+
+            self.upload_rich_docs(mark_items(), writer, events=events, on_docs=on_docs)
+
+        total = writer.total
+
+        if writer.skipped:
+            logger.info("{} unchanged or already enriched items not uploaded to {}".format(
+                        writer.skipped, anonymize_url(writer.url)))
+
+        if writer.watermark:
+            watermark = writer.watermark[0] if store else writer.watermark
+            logger.debug("Items uploaded to {} until {} {}".format(
+                         anonymize_url(writer.url), incremental_field, watermark))
 
         return total
 
+    def enrich_fed_items(self, ocean_backend, items):
+        """Enrich the raw items while they are fed to the raw index.
+
+        The raw items come from the collection instead of being read
+        from the raw index, which keeps being the source of truth. When
+        the checkpoints are enabled, the checkpoint of the enrichment is
+        moved to the last raw item whose rich items were uploaded, so a
+        later enrichment of the raw index resumes after it.
+
+        :param ocean_backend: Ocean backend object feeding the raw items
+        :param items: generator of the raw items added to the raw index
+        :return: total number of enriched items uploaded to Elasticsearch
+        """
+        store = self.get_checkpoint_store()
+        on_watermark = None
+        if store:
+            checkpoint_key = self.get_checkpoint_key(ocean_backend)
+
+            def save_checkpoint(marker):
+                # The raw items come in the order they were collected, not sorted by the index
+                store.save(*checkpoint_key, timestamp=marker)
+
+            on_watermark = save_checkpoint
+
+        with BulkWriter(self.elastic, on_watermark=on_watermark) as writer:
+            logger.debug("Adding fed items to {} (in {} packs, {:.2f} MB max)".format(
+                         anonymize_url(writer.url), self.elastic.max_items_bulk,
+                         self.elastic.max_bytes_bulk / (1024 * 1024)))
+
+            incremental_field = self.get_incremental_date()
+            marked_items = ((item, item.get(incremental_field)) for item in items)
+            self.upload_rich_docs(marked_items, writer)
+
+        total = writer.total
+
+        if writer.watermark:
+            logger.debug("Fed items uploaded to {} until {} {}".format(
+                         anonymize_url(writer.url), incremental_field, writer.watermark))
+
+        return total
+
+    def can_enrich_fed_items(self):
+        """Check whether the connector enriches each raw item on its own.
+
+        Connectors which override `enrich_items` without providing their
+        rich items with `get_rich_docs` need to read the raw index, so their
+        items can't be enriched while they are fed.
+        """
+        klass = type(self)
+
+        return klass.enrich_items is Enrich.enrich_items or klass.get_rich_docs is not Enrich.get_rich_docs
+
+    def upload_rich_docs(self, items, writer, events=False, on_docs=None):
+        """Enrich the raw items and add their rich items to the writer.
+
+        The raw items already enriched (see `skip_enriched_items`) and the
+        rich items which didn't change (see `add_changed_docs`) are skipped
+        when it is enabled. With `pipeline_queue_size`, the enrichment,
+        the encoding and the upload of the items run at the same time
+        in a pipeline of stages (see `get_pipeline`), otherwise they run
+        one after the other for each item.
+
+        :param items: iterator of tuples with a raw item and its marker
+        :param writer: BulkWriter where the rich items are added
+        :param events: enrich the events of the items instead of the items
+        :param on_docs: function called with the list of the rich items,
+            and their ids, of each raw item in the order they are added
+        """
+        skip_enriched = self.skip_immutable and self.immutable_items and not events
+
+        if self.pipeline_queue_size:
+            if skip_enriched:
+                items = self.skip_enriched_items(items)
+            pending = []
+            # The processes are forked before the threads of the pipeline start
+            with self.get_enrich_pool() as pool:
+                self.get_pipeline(items, writer, pending, events=events, on_docs=on_docs, pool=pool).run()
+            self.__add_changed_entries(writer, pending)
+            return
+
+        if skip_enriched:
+            items = self.skip_enriched_items(items, writer)
+
+        pending = []  # rich items to check whether they changed
+        for item, marker, rich_docs in self.iter_rich_docs(items, events=events):
+            if on_docs:
+                on_docs(rich_docs)
+
+            if not rich_docs:
+                # The item is processed with the rich items of the previous ones
+                if pending:
+                    pending[-1] = pending[-1][:2] + (marker,)
+                else:
+                    writer.skip(marker)
+                continue
+
+            # The item is processed once its last rich item is uploaded
+            docs = [(doc, doc_id, marker if i == len(rich_docs) - 1 else None)
+                    for i, (doc, doc_id) in enumerate(rich_docs)]
+
+            if self.skip_unchanged:
+                pending.extend(docs)
+                if len(pending) >= self.elastic.max_items_bulk:
+                    self.add_changed_docs(writer, pending)
+                    pending = []
+            else:
+                for doc, doc_id, doc_marker in docs:
+                    writer.add(doc, doc_id, marker=doc_marker)
+
+        self.add_changed_docs(writer, pending)
+
+    def get_pipeline(self, items, writer, pending, events=False, on_docs=None, pool=None):
+        """Get the pipeline which enriches the raw items and uploads their rich items.
+
+        The stages are `enrich` (`get_rich_docs`, run by `enrich_threads`
+        threads, or by the processes of `pool` together with the reading),
+        `serialize` (encoding of the bulk entries, run by `serialize_threads`
+        threads) and `upload` (`writer`). The raw items skipped are given
+        as None, to account for them in the upload.
+
+        :param items: iterator of tuples with a raw item, or None, and its marker
+        :param writer: BulkWriter where the rich items are added
+        :param pending: list where the entries to check whether they changed
+            are left once the pipeline ends
+        :param events: enrich the events of the items instead of the items
+        :param on_docs: function called with the list of the rich items,
+            and their ids, of each raw item in the order they are added
+        :param pool: pool of processes which enrich the raw items (see
+            `get_enrich_pool`), None to enrich them in threads
+
+        :returns: Pipeline object
+        """
+        def enrich(entry):
+            item, marker = entry
+            rich_docs = self.get_rich_docs(item, events) if item is not None else None
+            return [(rich_docs, marker)]
+
+        def serialize(entry):
+            rich_docs, marker = entry
+            if rich_docs is None:
+                return [(None, marker)]
+
+            entries = []
+            for doc, doc_id in rich_docs:
+                if self.skip_unchanged:
+                    doc[CONTENT_HASH] = self.get_content_hash(doc)
+                action = {"index": writer.get_action_meta(doc, doc_id)}
+                entries.append((doc, doc_id, action, writer.encode_entry(action, doc)))
+            return [(entries, marker)]
+
+        def upload(entry):
+            entries, marker = entry
+            if entries is None:
+                writer.skip(marker)
+                return
+            if on_docs:
+                on_docs([(doc, doc_id) for doc, doc_id, _, _ in entries])
+
+            if not entries:
+                # The item is processed with the rich items of the previous ones
+                if pending:
+                    pending[-1] = pending[-1][:4] + (marker,)
+                else:
+                    writer.skip(marker)
+                return
+
+            # The item is processed once its last rich item is uploaded
+            entries = [entry + (marker if i == len(entries) - 1 else None,) for i, entry in enumerate(entries)]
+
+            if self.skip_unchanged:
+                pending.extend(entries)
+                if len(pending) >= self.elastic.max_items_bulk:
+                    self.__add_changed_entries(writer, pending)
+                    pending.clear()
+            else:
+                for _, _, action, data, doc_marker in entries:
+                    writer.add_entry(action, data, marker=doc_marker)
+
+        stages = [
+            Stage('enrich', enrich, workers=self.enrich_threads),
+            Stage('serialize', serialize, workers=self.serialize_threads),
+            Stage('upload', upload)
+        ]
+        if pool:
+            # The raw items are enriched by the pool of processes as they are read
+            items = ((rich_docs, marker) for _, marker, rich_docs
+                     in self.iter_rich_docs(items, events=events, pool=pool))
+            stages = stages[1:]
+
+        return Pipeline(items, stages, queue_size=self.pipeline_queue_size,
+                        name="{} enrich".format(self.get_connector_name()))
+
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items, or the rich events, of a raw item with their ids.
+
+        Connectors which generate other rich items from a raw item override
+        this method to plug into `iter_rich_docs`.
+
+        :param item: raw item
+        :param events: get the rich events instead of the rich item
+
+        :returns: list of tuples with the rich items and their ids
+        """
+        if not events:
+            return [(self.get_rich_item(item), item[self.get_field_unique_id()])]
+
+        docs = []
+        for rich_event in self.get_rich_events(item):
+            event_id = "{}_{}".format(item[self.get_field_unique_id()],
+                                      rich_event[self.get_field_event_unique_id()])
+            docs.append((rich_event, event_id))
+
+        return docs
+
+    @contextmanager
+    def get_enrich_pool(self):
+        """Context with the pool of `enrich_processes` processes which enrich the raw items.
+
+        The processes are forked from this one when the context starts, so
+        each worker has its own copy of the enricher: its SortingHat
+        connection, projects and caches. The context must start before
+        other threads of the enrichment, whose locks would be copied in
+        the workers. The pool is None when the items are enriched in the
+        main process.
+        """
+        context = None
+        if self.enrich_processes > 1:
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                logger.warning("Processes can't be forked, items enriched in the main process")
+
+        if not context:
+            yield None
+            return
+
+        with context.Pool(self.enrich_processes, initializer=_init_enrich_worker, initargs=(self,)) as pool:
+            yield pool
+
+    def iter_rich_docs(self, items, events=False, pool=None):
+        """Generate the rich items of the raw items, in the same order.
+
+        With `enrich_processes`, the pages of raw items are enriched in
+        parallel by a pool of processes (see `get_enrich_pool`). Up to two
+        pages per process are in flight.
+
+        :param items: iterator of tuples with a raw item and a marker
+        :param events: get the rich events instead of the rich items
+        :param pool: pool of processes to use, by default one is created
+            when `enrich_processes` is set
+
+        :returns: generator of tuples with the raw item, its marker and
+            the list of its rich items with their ids (see `get_rich_docs`),
+            None for the raw items given as None
+        """
+        if not pool and self.enrich_processes > 1:
+            with self.get_enrich_pool() as pool:
+                if pool:
+                    yield from self.iter_rich_docs(items, events=events, pool=pool)
+                    return
+
+        if not pool:
+            for item, marker in items:
+                yield item, marker, self.get_rich_docs(item, events) if item is not None else None
+            return
+
+        pages = deque()
+        page = []
+        for item, marker in items:
+            page.append((item, marker))
+            if len(page) < self.scroll_size:
+                continue
+            if len(pages) >= 2 * self.enrich_processes:
+                yield from self.__get_page_rich_docs(*pages.popleft())
+            pages.append((page, pool.apply_async(_get_page_rich_docs, ([item for item, _ in page], events))))
+            page = []
+
+        if page:
+            pages.append((page, pool.apply_async(_get_page_rich_docs, ([item for item, _ in page], events))))
+        while pages:
+            yield from self.__get_page_rich_docs(*pages.popleft())
+
+    @staticmethod
+    def __get_page_rich_docs(page, result):
+        for (item, marker), rich_docs in zip(page, result.get()):
+            yield item, marker, rich_docs
+
+    def init_worker(self):
+        """Prepare the enricher of a forked worker process.
+
+        The connections inherited from the parent process are replaced
+        by new ones, the rest of the state is a copy of the parent's one.
+        """
+        ConnectionRegistry.reset()
+        self.requests = ConnectionRegistry.get_session()
+        if self.elastic:
+            self.elastic.requests = ConnectionRegistry.get_session(compress_level=self.elastic.compress_level)
+        if Enrich.sh_db:
+            Enrich.sh_db.connect()
+
+    def skip_enriched_items(self, items, writer=None):
+        """Skip the raw items already enriched by this version of ELK.
+
+        Only for immutable items, whose enriched items can't change while
+        the enrichment stays the same. The raw items are checked by their
+        uuid against the enriched index, in batches of `max_items_bulk`.
+
+        :param items: generator of tuples with the raw item and its marker
+        :param writer: BulkWriter where the skipped items are accounted,
+            when it isn't set the skipped items are generated as None
+
+        :returns: generator of tuples with the raw items to enrich and their marker
+        """
+        batch = []
+        for item, marker in items:
+            batch.append((item, marker))
+            if len(batch) >= self.elastic.max_items_bulk:
+                yield from self.__skip_enriched_batch(batch, writer)
+                batch = []
+
+        yield from self.__skip_enriched_batch(batch, writer)
+
+    def __skip_enriched_batch(self, batch, writer):
+        if not batch:
+            return
+
+        ids = [item['uuid'] for item, _ in batch]
+        # The enriched items are routed as their raw items
+        routings = [self.elastic.get_routing(item, item['uuid']) for item, _ in batch]
+        stored = self.elastic.mget_fields(ids, ['metadata__gelk_version'], routings=routings)
+
+        for item, marker in batch:
+            if stored.get(item['uuid'], {}).get('metadata__gelk_version') != self.gelk_version:
+                yield item, marker
+            elif writer:
+                writer.skip(marker)
+            else:
+                yield None, marker
+
+    def add_changed_docs(self, writer, docs):
+        """Add the documents whose content changed to the writer, skipping the rest.
+
+        The content hash of each document is compared with the one of the
+        document with the same id in the index, read in a single request.
+
+        :param writer: BulkWriter where the documents are added
+        :param docs: list of tuples with the document, its id and its marker
+        """
+        if not docs:
+            return
+
+        for doc, _, _ in docs:
+            doc[CONTENT_HASH] = self.get_content_hash(doc)
+
+        unchanged = self.get_unchanged_ids([(doc, doc_id) for doc, doc_id, _ in docs])
+
+        for doc, doc_id, marker in docs:
+            if doc_id in unchanged:
+                writer.skip(marker)
+            else:
+                writer.add(doc, doc_id, marker=marker)
+
+    def __add_changed_entries(self, writer, entries):
+        """Add the encoded entries of the documents whose content changed, see `add_changed_docs`"""
+
+        if not entries:
+            return
+
+        unchanged = self.get_unchanged_ids([(doc, doc_id) for doc, doc_id, _, _, _ in entries])
+
+        for _, doc_id, action, data, marker in entries:
+            if doc_id in unchanged:
+                writer.skip(marker)
+            else:
+                writer.add_entry(action, data, marker=marker)
+
+    def get_unchanged_ids(self, docs):
+        """Get the ids of the documents whose content hash is the same in the index.
+
+        :param docs: list of tuples with the documents, with their content
+            hash, and their ids
+
+        :returns: set with the ids of the documents that didn't change
+        """
+        ids = [doc_id for _, doc_id in docs]
+        routings = [self.elastic.get_routing(doc, doc_id) for doc, doc_id in docs]
+        stored = self.elastic.mget_fields(ids, [CONTENT_HASH], routings=routings)
+
+        return {doc_id for doc, doc_id in docs if stored.get(doc_id, {}).get(CONTENT_HASH) == doc[CONTENT_HASH]}
+
+    @staticmethod
+    def get_content_hash(eitem):
+        """Get a hash of the content of a rich item, without the volatile fields"""
+
+        content = {field: value for field, value in eitem.items() if field not in VOLATILE_FIELDS}
+        data = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+
+        return hashlib.sha1(data.encode('utf-8', errors='surrogatepass')).hexdigest()
+
     def add_repository_labels(self, eitem):
         """Add labels to the enriched item"""
 
@@ -444,6 +930,59 @@ class Enrich(ElasticItems):
 
         return last_update
 
+    def get_checkpoint_store(self):
+        """Get the store of the enrichment checkpoints, None when they are disabled"""
+
+        if not self.checkpoint_index or not self.elastic:
+            return None
+
+        return CheckpointStore(self.elastic.url, self.checkpoint_index)
+
+    def get_checkpoint_key(self, ocean_backend):
+        """Get the connector, origin, filter raw and enriched index of the checkpoint"""
+
+        perceval_backend = ocean_backend.perceval_backend
+        origin = anonymize_url(perceval_backend.origin) if perceval_backend else None
+
+        return self.get_connector_name(), origin, self.filter_raw, self.elastic.index
+
+    def resume_from_checkpoint(self, ocean_backend):
+        """Read the raw items from the checkpoint of the previous enrichment, if any.
+
+        The checkpoint replaces the incremental date of the raw items
+        calculated from the enriched index, and the enrichment starts
+        right after the last raw item acknowledged.
+
+        :param ocean_backend: Ocean backend object to fetch the items from
+
+        :returns: the checkpoint, None if there isn't any
+        """
+        self.checkpoint = None
+
+        store = self.get_checkpoint_store()
+        if not store or not ocean_backend.get_elastic_items_order_field():
+            return None
+
+        key = self.get_checkpoint_key(ocean_backend)
+        checkpoint = store.get(*key)
+        if checkpoint:
+            ocean_backend.from_date = str_to_datetime(checkpoint['timestamp'])
+            ocean_backend.offset = None
+            self.checkpoint = checkpoint
+            logger.info("[{}] Resuming the enrichment of {} from {} {}".format(
+                        key[0], key[1], checkpoint['timestamp'], checkpoint['sort']))
+
+        return checkpoint
+
+    def delete_checkpoint(self, ocean_backend):
+        """Delete the checkpoint of the enrichment, e.g. before enriching all the items again"""
+
+        self.checkpoint = None
+
+        store = self.get_checkpoint_store()
+        if store:
+            store.delete(*self.get_checkpoint_key(ocean_backend))
+
     def get_last_offset_from_es(self, _filters=[]):
         # offset is always the field name from perceval
         last_update = self.elastic.get_last_offset("offset", _filters)
@@ -1154,8 +1693,7 @@ class Enrich(ElasticItems):
         logger.info("{}  starting study - Input: {} Output: {}".format(log_prefix, in_index, out_index))
 
         # Creating connections
-        es = ES([enrich_backend.elastic.url], retry_on_timeout=True, timeout=100,
-                verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es = ConnectionRegistry.get_client(enrich_backend.elastic.url, verify_certs=self.elastic.requests.verify)
 
         in_conn = ESOnionConnector(es_conn=es, es_index=in_index,
                                    contribs_field=contribs_field,
@@ -1498,8 +2036,7 @@ class Enrich(ElasticItems):
         log_prefix = "[{}] Geolocation".format(data_source)
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
 
         query_locations_no_geo_points = """
@@ -1602,8 +2139,7 @@ class Enrich(ElasticItems):
         """
         logger.info("[enrich-forecast-activity] Start study")
 
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
 
         unique_repos = es_in.search(
@@ -2217,8 +2753,8 @@ class Enrich(ElasticItems):
         logger.info("[enrich-feelings] Start study on {} with data from {}".format(
             anonymize_url(self.elastic.index_url), nlp_rest_url))
 
-        es = ES([self.elastic_url], timeout=3600, max_retries=50, retry_on_timeout=True,
-                verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es = ConnectionRegistry.get_client(self.elastic_url, verify_certs=self.elastic.requests.verify,
+                                           timeout=3600, max_retries=50)
         search_fields = [attr for attr in attributes]
         search_fields.extend([uuid_field])
         page = es.search(index=enrich_backend.elastic.index,
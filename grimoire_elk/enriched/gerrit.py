@@ -32,7 +32,6 @@ from grimoirelab_toolkit.datetime import (str_to_datetime,
                                           unixtime_to_datetime)
 
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
 REVIEW_TYPE = 'review'
 CHANGESET_TYPE = 'changeset'
 COMMENT_TYPE = 'comment'
@@ -671,36 +670,33 @@ class GerritEnrich(Enrich):
 
         return last_status_code_review, last_status_verified
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of a review, its comments and its patchsets with their ids"""
 
-        for item in ocean_backend.fetch():
-            eitem = self.get_rich_item(item)
+        eitem = self.get_rich_item(item)
 
-            items_to_enrich.append(eitem)
+        items_to_enrich = [eitem]
 
-            comments = item['data'].get('comments', [])
-            if comments:
-                rich_item_comments = self.get_rich_item_comments(comments, eitem)
-                items_to_enrich.extend(rich_item_comments)
+        comments = item['data'].get('comments', [])
+        if comments:
+            rich_item_comments = self.get_rich_item_comments(comments, eitem)
+            items_to_enrich.extend(rich_item_comments)
 
-            patchsets = item['data'].get('patchSets', [])
-            if patchsets:
-                rich_item_patchsets = self.get_rich_item_patchsets(patchsets, eitem)
-                items_to_enrich.extend(rich_item_patchsets)
+        patchsets = item['data'].get('patchSets', [])
+        if patchsets:
+            rich_item_patchsets = self.get_rich_item_patchsets(patchsets, eitem)
+            items_to_enrich.extend(rich_item_patchsets)
 
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
+
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
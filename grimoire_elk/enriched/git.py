@@ -24,11 +24,9 @@
 import json
 import logging
 import re
-import sys
 
 import pkg_resources
 import requests
-from elasticsearch import Elasticsearch, RequestsHttpConnection
 
 from grimoirelab_toolkit.datetime import (datetime_to_utc,
                                           str_to_datetime,
@@ -41,7 +39,7 @@ from .enrich import Enrich, metadata
 from .study_ceres_aoc import areas_of_code, ESPandasConnector
 from ..elastic_mapping import Mapping as BaseMapping
 from ..elastic_items import HEADER_JSON, MAX_BULK_UPDATE_SIZE
-from .utils import anonymize_url
+from .utils import anonymize_url, ConnectionRegistry
 
 GITHUB = 'https://github.com/'
 DEMOGRAPHY_COMMIT_MIN_DATE = '1980-01-01'
@@ -74,6 +72,7 @@ class Mapping(BaseMapping):
 class GitEnrich(Enrich):
 
     mapping = Mapping
+    immutable_items = True
 
     # REGEX to extract authors from a multi author commit: several authors present
     # in the Author field in the commit. Used if self.pair_programming is True
@@ -446,6 +445,70 @@ class GitEnrich(Enrich):
             eitem.update(get_pair_programming_metrics(eitem, nauthors))
         return eitem
 
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of a commit with their ids. With pair programming,
+        a rich item is also generated for each of the other authors of the
+        commit and for each author who signed it off."""
+
+        if self.pair_programming:
+            # First we need to add the authors field to all commits
+            # Check multi author
+            m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
+            n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
+            if m or n:
+                logger.debug("[git] Multiauthor detected. Creating one commit "
+                             "per author: {}".format(item['data']['Author']))
+                item['data']['authors'] = self.__get_authors(item['data']['Author'])
+                item['data']['Author'] = item['data']['authors'][0]
+                item['data']['is_git_commit_multi_author'] = 1
+            m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
+            n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
+            if m or n:
+                logger.debug("[git] Multicommitter detected: using just the first committer")
+                item['data']['committers'] = self.__get_authors(item['data']['Commit'])
+                item['data']['Commit'] = item['data']['committers'][0]
+            # Add the authors list using the original Author and the Signed-off list
+            if 'Signed-off-by' in item['data']:
+                authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
+                item['data']['authors_signed_off'] = list(set(authors_all))
+
+        rich_item = self.get_rich_item(item)
+        docs = [(rich_item, rich_item[self.get_field_unique_id()])]
+
+        if self.pair_programming:
+            # Multi author support
+            if 'authors' in item['data']:
+                # First author already added in the above commit
+                authors = item['data']['authors']
+                for i in range(1, len(authors)):
+                    # logger.debug('Adding a new commit for %s', authors[i])
+                    item['data']['Author'] = authors[i]
+                    item['data']['is_git_commit_multi_author'] = 1
+                    rich_item = self.get_rich_item(item)
+                    commit_id = item["uuid"] + "_" + str(i - 1)
+                    rich_item['git_uuid'] = commit_id
+                    docs.append((rich_item, rich_item['git_uuid']))
+
+            if rich_item['Signed-off-by_number'] > 0:
+                nsg = 0
+                # Remove duplicates and the already added Author if exists
+                authors = list(set(item['data']['Signed-off-by']))
+                if item['data']['Author'] in authors:
+                    authors.remove(item['data']['Author'])
+                for author in authors:
+                    # logger.debug('Adding a new commit for %s', author)
+                    # Change the Author in the original commit and generate
+                    # a new enriched item with it
+                    item['data']['Author'] = author
+                    item['data']['is_git_commit_signed_off'] = 1
+                    rich_item = self.get_rich_item(item)
+                    commit_id = item["uuid"] + "_" + str(nsg)
+                    rich_item['git_uuid'] = commit_id
+                    docs.append((rich_item, rich_item['git_uuid']))
+                    nsg += 1
+
+        return docs
+
     def enrich_items(self, ocean_backend, events=False):
         """ Implementation supporting signed-off and multiauthor/committer commits.
         Multiauthor/Multcommiter commits are the ones authored/commited by more
@@ -475,107 +538,20 @@ class GitEnrich(Enrich):
             "message": "Enable users to pass flags\n\nCo-authored-by: mariiapunda <mariiapunda@users.noreply.github.com>",
         Co-authored commits like these are not considered as multiauthored commits in ELK.
         """
-        headers = {"Content-Type": "application/json"}
-
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
         total_signed_off = 0
         total_multi_author = 0
 
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[git] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-        items = ocean_backend.fetch()
-
-        for item in items:
-            if self.pair_programming:
-                # First we need to add the authors field to all commits
-                # Check multi author
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
-                n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
-                if m or n:
-                    logger.debug("[git] Multiauthor detected. Creating one commit "
-                                 "per author: {}".format(item['data']['Author']))
-                    item['data']['authors'] = self.__get_authors(item['data']['Author'])
-                    item['data']['Author'] = item['data']['authors'][0]
-                    item['data']['is_git_commit_multi_author'] = 1
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
-                n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
-                if m or n:
-                    logger.debug("[git] Multicommitter detected: using just the first committer")
-                    item['data']['committers'] = self.__get_authors(item['data']['Commit'])
-                    item['data']['Commit'] = item['data']['committers'][0]
-                # Add the authors list using the original Author and the Signed-off list
-                if 'Signed-off-by' in item['data']:
-                    authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
-                    item['data']['authors_signed_off'] = list(set(authors_all))
-
-            if current >= max_items:
-                try:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("[git] Added {} items to {} ({:.2f} MB)".format(
-                                 total, anonymize_url(url), json_size))
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.warning("[git] Unicode error in enriched items, converting to ascii")
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    total += self.elastic.safe_put_bulk(url, safe_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            unique_field = self.get_field_unique_id()
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % (rich_item[unique_field])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-            if self.pair_programming:
-                # Multi author support
-                if 'authors' in item['data']:
-                    # First author already added in the above commit
-                    authors = item['data']['authors']
-                    for i in range(1, len(authors)):
-                        # logger.debug('Adding a new commit for %s', authors[i])
-                        item['data']['Author'] = authors[i]
-                        item['data']['is_git_commit_multi_author'] = 1
-                        rich_item = self.get_rich_item(item)
-                        commit_id = item["uuid"] + "_" + str(i - 1)
-                        rich_item['git_uuid'] = commit_id
-                        data_json = json.dumps(rich_item)
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total_multi_author += 1
-
-                if rich_item['Signed-off-by_number'] > 0:
-                    nsg = 0
-                    # Remove duplicates and the already added Author if exists
-                    authors = list(set(item['data']['Signed-off-by']))
-                    if item['data']['Author'] in authors:
-                        authors.remove(item['data']['Author'])
-                    for author in authors:
-                        # logger.debug('Adding a new commit for %s', author)
-                        # Change the Author in the original commit and generate
-                        # a new enriched item with it
-                        item['data']['Author'] = author
-                        item['data']['is_git_commit_signed_off'] = 1
-                        rich_item = self.get_rich_item(item)
-                        commit_id = item["uuid"] + "_" + str(nsg)
-                        rich_item['git_uuid'] = commit_id
-                        data_json = json.dumps(rich_item)
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total_signed_off += 1
-                        nsg += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        def count_commits(docs):
+            nonlocal total_signed_off, total_multi_author
+
+            # The commits generated for other authors
+            for rich_item, _ in docs[1:]:
+                if rich_item['is_git_commit_signed_off']:
+                    total_signed_off += 1
+                else:
+                    total_multi_author += 1
+
+        total = super().enrich_items(ocean_backend, on_docs=count_commits)
 
         if total == 0:
             # No items enriched, nothing to upload to ES
@@ -602,12 +578,8 @@ class GitEnrich(Enrich):
         logger.info("{} Starting study - Input: {} Output: {}".format(log_prefix, in_index, out_index))
 
         # Creating connections
-        es_in = Elasticsearch([ocean_backend.elastic.url], retry_on_timeout=True, timeout=100,
-                              verify_certs=self.elastic.requests.verify,
-                              connection_class=RequestsHttpConnection)
-        es_out = Elasticsearch([enrich_backend.elastic.url], retry_on_timeout=True,
-                               timeout=100, verify_certs=self.elastic.requests.verify,
-                               connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(ocean_backend.elastic.url, verify_certs=self.elastic.requests.verify)
+        es_out = ConnectionRegistry.get_client(enrich_backend.elastic.url, verify_certs=self.elastic.requests.verify)
         in_conn = ESPandasConnector(es_conn=es_in, es_index=in_index, sort_on_field=sort_on_field)
         out_conn = ESPandasConnector(es_conn=es_out, es_index=out_index, sort_on_field=sort_on_field, read_only=False)
 
@@ -747,7 +719,8 @@ class GitEnrich(Enrich):
         }
 
         raw_hashes = set([item['data']['commit']
-                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr)])
+                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr,
+                                                          source_includes=['data.commit'])])
         aoc_hashes = set(self.get_unique_hashes_aoc(es_aoc, index_aoc, repository))
 
         hashes_to_delete = list(aoc_hashes.difference(raw_hashes))
@@ -832,7 +805,8 @@ class GitEnrich(Enrich):
 
         current_hashes = set(current_hashes)
         raw_hashes = set([item['data']['commit']
-                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr)])
+                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr,
+                                                          source_includes=['data.commit'])])
 
         hashes_to_delete = list(raw_hashes.difference(current_hashes))
 
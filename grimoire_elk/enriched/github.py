@@ -34,9 +34,7 @@ from grimoire_elk.elastic import ElasticSearch
 from grimoirelab_toolkit.datetime import (datetime_utcnow,
                                           str_to_datetime)
 
-from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
-
-from .utils import get_time_diff_days
+from .utils import get_time_diff_days, ConnectionRegistry
 
 from .enrich import Enrich, metadata, anonymize_url
 from ..elastic_mapping import Mapping as BaseMapping
@@ -762,8 +760,7 @@ class GitHubEnrich(Enrich):
         map_label = dict(zip([""] + reduced_labels, map_label))
 
         # connect to ES
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
 
         # get all repositories
@@ -31,7 +31,6 @@ from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
 GEOLOCATION_INDEX = '/github/'
 GITHUB = 'https://github.com/'
 ISSUE_TYPE = 'issue'
@@ -447,33 +446,27 @@ class GitHubEnrich2(Enrich):
 
         return ecomments
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of an issue or a pull request and of its comments with their ids"""
 
-        for item in ocean_backend.fetch():
-            eitems = []
+        eitem = self.get_rich_item(item)
 
-            eitem = self.get_rich_item(item)
-            items_to_enrich.append(eitem)
-            if item['category'] == ISSUE_TYPE:
-                eitems = self.enrich_issue(item, eitem)
-            elif item['category'] == PULL_TYPE:
-                eitems = self.enrich_pulls(item, eitem)
+        items_to_enrich = [eitem]
+        if item['category'] == ISSUE_TYPE:
+            items_to_enrich.extend(self.enrich_issue(item, eitem))
+        elif item['category'] == PULL_TYPE:
+            items_to_enrich.extend(self.enrich_pulls(item, eitem))
 
-            items_to_enrich.extend(eitems)
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
 
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
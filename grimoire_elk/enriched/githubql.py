@@ -24,10 +24,8 @@
 import logging
 import re
 
-from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
-
 from .enrich import Enrich, metadata
-from .utils import anonymize_url, get_time_diff_days
+from .utils import anonymize_url, get_time_diff_days, ConnectionRegistry
 from ..elastic_mapping import Mapping as BaseMapping
 
 GITHUB = 'https://github.com/'
@@ -352,8 +350,7 @@ class GitHubQLEnrich(Enrich):
         log_prefix = "[{}] Duration analysis".format(data_source)
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
 
         # get all start events that don't have the attribute `duration_from_previous_event`
@@ -597,8 +594,7 @@ class GitHubQLEnrich(Enrich):
         log_prefix = "[{}] Cross reference analysis".format(data_source)
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
-        es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+        es_in = ConnectionRegistry.get_client(enrich_backend.elastic_url, verify_certs=self.elastic.requests.verify)
         in_index = enrich_backend.elastic.index
 
         # Get all the merged pull requests from MergedEvents
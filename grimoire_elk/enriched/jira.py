@@ -30,7 +30,6 @@ from ..elastic_mapping import Mapping as BaseMapping
 from .utils import get_time_diff_days
 
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
 ISSUE_TYPE = 'issue'
 COMMENT_TYPE = 'comment'
 CLOSED_STATUS_CATEGORY_KEY = 'done'
@@ -421,41 +420,36 @@ class JiraEnrich(Enrich):
     def get_field_unique_id(self):
         return "id"
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of an issue, for each of its roles, and of its comments with their ids"""
 
-        for item in ocean_backend.fetch():
-            # This condition should never happen, since the enriched
-            # data heavily relies on the `fields` attribute
-            if "fields" not in item["data"]:
-                logger.warning("[jira] Skipping item with uuid {}, no fields attribute".format(item['uuid']))
-                continue
+        # This condition should never happen, since the enriched
+        # data heavily relies on the `fields` attribute
+        if "fields" not in item["data"]:
+            logger.warning("[jira] Skipping item with uuid {}, no fields attribute".format(item['uuid']))
+            return []
 
-            eitem_creator = self.get_rich_item(item, author_type='creator')
-            eitem_assignee = self.get_rich_item(item, author_type='assignee')
-            eitem_reporter = self.get_rich_item(item, author_type='reporter')
+        eitem_creator = self.get_rich_item(item, author_type='creator')
+        eitem_assignee = self.get_rich_item(item, author_type='assignee')
+        eitem_reporter = self.get_rich_item(item, author_type='reporter')
 
-            items_to_enrich.append(eitem_creator)
-            items_to_enrich.append(eitem_assignee)
-            items_to_enrich.append(eitem_reporter)
+        items_to_enrich = [eitem_creator, eitem_assignee, eitem_reporter]
 
-            comments = item['data'].get('comments_data', [])
-            if comments:
-                rich_item_comments = self.get_rich_item_comments(comments, eitem_creator)
-                items_to_enrich.extend(rich_item_comments)
+        comments = item['data'].get('comments_data', [])
+        if comments:
+            rich_item_comments = self.get_rich_item_comments(comments, eitem_creator)
+            items_to_enrich.extend(rich_item_comments)
 
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
+
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
@@ -19,11 +19,11 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from .enrich import Enrich, metadata
 from .utils import get_time_diff_days, anonymize_url
+from ..elastic_bulk import BulkWriter
 from ..elastic_mapping import Mapping as BaseMapping
 from grimoirelab_toolkit.datetime import str_to_datetime
 
@@ -228,46 +228,27 @@ class KitsuneEnrich(Enrich):
         return eitem
 
     def enrich_items(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[kitsune] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            if current >= max_items:
-                total += self.elastic.safe_put_bulk(url, bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (rich_item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            # Time to enrich also de answers
-            if 'answers_data' in item['data']:
-                for answer in item['data']['answers_data']:
-                    # Add question title in answers
-                    answer['title'] = item['data']['title']
-                    answer['solution'] = 0
-                    if answer['id'] == item['data']['solution']:
-                        answer['solution'] = 1
-                    rich_answer = self.get_rich_item(answer, kind='answer')
-                    self.copy_raw_fields(self.RAW_FIELDS_COPY, item, rich_answer)
-
-                    data_json = json.dumps(rich_answer)
-                    bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                                 (rich_answer[self.get_field_unique_id()])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        with BulkWriter(self.elastic) as writer:
+            logger.debug("[kitsune] Adding items to {} (in {} packs)".format(
+                         anonymize_url(writer.url), self.elastic.max_items_bulk))
+
+            items = ocean_backend.fetch()
+            for item in items:
+                rich_item = self.get_rich_item(item)
+                writer.add(rich_item, rich_item[self.get_field_unique_id()])
+                # Time to enrich also de answers
+                if 'answers_data' in item['data']:
+                    for answer in item['data']['answers_data']:
+                        # Add question title in answers
+                        answer['title'] = item['data']['title']
+                        answer['solution'] = 0
+                        if answer['id'] == item['data']['solution']:
+                            answer['solution'] = 1
+                        rich_answer = self.get_rich_item(answer, kind='answer')
+                        self.copy_raw_fields(self.RAW_FIELDS_COPY, item, rich_answer)
+
+                        writer.add(rich_answer, rich_answer[self.get_field_unique_id()])
+
+        total = writer.total
 
         return total
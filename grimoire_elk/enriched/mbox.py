@@ -19,13 +19,12 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from requests.structures import CaseInsensitiveDict
 import email.utils
 
-from .enrich import Enrich, metadata, anonymize_url
+from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 from .mbox_study_kip import kafka_kip, MAX_LINES_FOR_VOTE
 from grimoirelab_toolkit.datetime import str_to_datetime
@@ -64,6 +63,8 @@ class Mapping(BaseMapping):
 class MBoxEnrich(Enrich):
 
     mapping = Mapping
+    raw_fields_excludes = ['data.body.html']
+    immutable_items = True
 
     def __init__(self, db_sortinghat=None, json_projects_map=None,
                  db_user='', db_password='', db_host='', db_path=None,
@@ -191,57 +192,6 @@ class MBoxEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend):
-        # items is a generator but we need to reuse it so we store all items
-        # from the generator in a list
-        # items = list(items)
-
-        # Use standard method and if fails, use the old one with Unicode control
-        total = 0
-        try:
-            total = super(MBoxEnrich, self).enrich_items(ocean_backend)
-        except UnicodeEncodeError:
-            total = self.enrich_items_old(ocean_backend.fetch())
-
-        return total
-
-    def enrich_items_old(self, items):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[mbox] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        for item in items:
-            if current >= max_items:
-                total += self.elastic.safe_put_bulk(url, bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (rich_item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-        if current == 0:
-            return total
-
-        try:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
-        except UnicodeEncodeError:
-            # Related to body.encode('iso-8859-1'). mbox data
-            logger.error("[mbox] Encoding error ... converting bulk to iso-8859-1")
-            bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
-
-            total += self.elastic.safe_put_bulk(url, bulk_json)
-
-        return total
-
     def kafka_kip(self, ocean_backend, enrich_backend, no_incremental=False):
         # KIP study is not incremental
 
@@ -19,13 +19,13 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from grimoirelab_toolkit.datetime import str_to_datetime
 
 from ..raw.elastic import PRJ_JSON_FILTER_SEPARATOR
 from .enrich import Enrich, metadata, anonymize_url
+from ..elastic_bulk import BulkWriter
 from ..elastic_mapping import Mapping as BaseMapping
 
 logger = logging.getLogger(__name__)
@@ -236,30 +236,16 @@ class MediaWikiEnrich(Enrich):
         return self.enrich_events(items)
 
     def enrich_events(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[mediawiki] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            rich_item_reviews = self.get_rich_item_reviews(item)
-            for enrich_review in rich_item_reviews:
-                if current >= max_items:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    bulk_json = ""
-                    current = 0
-                data_json = json.dumps(enrich_review)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                    (enrich_review[self.get_field_unique_id()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        with BulkWriter(self.elastic) as writer:
+            logger.debug("[mediawiki] Adding items to {} (in {} packs)".format(
+                         anonymize_url(writer.url), self.elastic.max_items_bulk))
+
+            items = ocean_backend.fetch()
+            for item in items:
+                rich_item_reviews = self.get_rich_item_reviews(item)
+                for enrich_review in rich_item_reviews:
+                    writer.add(enrich_review, enrich_review[self.get_field_unique_id()])
+
+        total = writer.total
 
         return total
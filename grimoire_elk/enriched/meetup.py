@@ -28,9 +28,6 @@ from .enrich import Enrich, metadata
 from ..elastic_mapping import Mapping as BaseMapping
 
 
-MAX_SIZE_BULK_ENRICHED_ITEMS = 200
-
-
 logger = logging.getLogger(__name__)
 
 
@@ -344,39 +341,36 @@ class MeetupEnrich(Enrich):
     def get_field_unique_id(self):
         return "id"
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of an event, its comments and its RSVPs with their ids"""
 
-        for item in ocean_backend.fetch():
-            eitem = self.get_rich_item(item)
+        eitem = self.get_rich_item(item)
 
-            if 'uuid' not in eitem:
-                continue
+        if 'uuid' not in eitem:
+            return []
 
-            items_to_enrich.append(eitem)
+        items_to_enrich = [eitem]
 
-            if 'comments' in item['data'] and 'id' in eitem:
-                comments = item['data']['comments']
-                rich_item_comments = self.get_rich_item_comments(comments, eitem)
-                items_to_enrich.extend(rich_item_comments)
+        if 'comments' in item['data'] and 'id' in eitem:
+            comments = item['data']['comments']
+            rich_item_comments = self.get_rich_item_comments(comments, eitem)
+            items_to_enrich.extend(rich_item_comments)
 
-            if 'rsvps' in item['data'] and 'id' in eitem:
-                rsvps = item['data']['rsvps']
-                rich_item_rsvps = self.get_rich_item_rsvps(rsvps, eitem)
-                items_to_enrich.extend(rich_item_rsvps)
+        if 'rsvps' in item['data'] and 'id' in eitem:
+            rsvps = item['data']['rsvps']
+            rich_item_rsvps = self.get_rich_item_rsvps(rsvps, eitem)
+            items_to_enrich.extend(rich_item_rsvps)
 
-            if len(items_to_enrich) < MAX_SIZE_BULK_ENRICHED_ITEMS:
-                continue
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
+
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
@@ -19,10 +19,10 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from grimoire_elk.enriched.enrich import Enrich, metadata, anonymize_url
+from ..elastic_bulk import BulkWriter
 from ..elastic_mapping import Mapping as BaseMapping
 
 
@@ -166,30 +166,15 @@ class MozillaClubEnrich(Enrich):
         return eitem
 
     def enrich_items(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[mozillaclub] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            if current >= max_items:
-                total += self.elastic.safe_put_bulk(url, bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        with BulkWriter(self.elastic) as writer:
+            logger.debug("[mozillaclub] Adding items to {} (in {} packs)".format(
+                         anonymize_url(writer.url), self.elastic.max_items_bulk))
+
+            items = ocean_backend.fetch()
+            for item in items:
+                rich_item = self.get_rich_item(item)
+                writer.add(rich_item, item[self.get_field_unique_id()])
+
+        total = writer.total
 
         return total
@@ -219,44 +219,40 @@ class StackExchangeEnrich(Enrich):
 
         return eitem
 
-    def enrich_items(self, ocean_backend):
-        items_to_enrich = []
-        num_items = 0
-        ins_items = 0
+    def get_rich_docs(self, item, events=False):
+        """Get the rich items of a question and its answers with their ids"""
 
-        items = ocean_backend.fetch()
-        for item in items:
+        items_to_enrich = []
+        answers_tags = []
 
-            answers_tags = []
+        if 'answers' in item['data']:
+            for answer in item['data']['answers']:
+                # Copy mandatory raw fields
+                answer['origin'] = item['origin']
+                answer['tag'] = item['tag']
 
-            if 'answers' in item['data']:
-                for answer in item['data']['answers']:
-                    # Copy mandatory raw fields
-                    answer['origin'] = item['origin']
-                    answer['tag'] = item['tag']
+                rich_answer = self.get_rich_item(answer,
+                                                 kind='answer',
+                                                 question_tags=item['data']['tags'])
+                if 'answer_tags' in rich_answer:
+                    answers_tags.extend(rich_answer['answer_tags'])
+                items_to_enrich.append(rich_answer)
 
-                    rich_answer = self.get_rich_item(answer,
-                                                     kind='answer',
-                                                     question_tags=item['data']['tags'])
-                    if 'answer_tags' in rich_answer:
-                        answers_tags.extend(rich_answer['answer_tags'])
-                    items_to_enrich.append(rich_answer)
+        rich_question = self.get_rich_item(item)
+        rich_question['answers_tags'] = list(set(answers_tags))
+        rich_question['thread_tags'] = rich_question['answers_tags'] + rich_question['question_tags']
+        items_to_enrich.append(rich_question)
 
-            rich_question = self.get_rich_item(item)
-            rich_question['answers_tags'] = list(set(answers_tags))
-            rich_question['thread_tags'] = rich_question['answers_tags'] + rich_question['question_tags']
-            items_to_enrich.append(rich_question)
+        return [(eitem, eitem[self.get_field_unique_id()]) for eitem in items_to_enrich]
 
-            if len(items_to_enrich) < self.elastic.max_items_bulk:
-                continue
+    def enrich_items(self, ocean_backend):
+        num_items = 0
 
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
-            items_to_enrich = []
+        def count_items(docs):
+            nonlocal num_items
+            num_items += len(docs)
 
-        if len(items_to_enrich) > 0:
-            num_items += len(items_to_enrich)
-            ins_items += self.elastic.bulk_upload(items_to_enrich, self.get_field_unique_id())
+        ins_items = super().enrich_items(ocean_backend, on_docs=count_items)
 
         if num_items != ins_items:
             missing = num_items - ins_items
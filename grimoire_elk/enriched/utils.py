@@ -20,17 +20,23 @@
 #
 
 import datetime
+import gzip
 import inspect
 import json
 import logging
 import re
+import threading
+import time
 
 import requests
 import urllib3
 
+from elasticsearch import Elasticsearch, RequestsHttpConnection
 from grimoirelab_toolkit.datetime import (datetime_utcnow,
                                           str_to_datetime)
 
+from ..codec import CodecSerializer
+
 
 BACKOFF_FACTOR = 0.2
 MAX_RETRIES = 21
@@ -38,6 +44,8 @@ MAX_RETRIES_ON_REDIRECT = 5
 MAX_RETRIES_ON_READ = 8
 MAX_RETRIES_ON_CONNECT = 21
 STATUS_FORCE_LIST = [408, 409, 429, 502, 503, 504]
+COMPRESS_MIN_SIZE = 1024  # request bodies smaller than this (bytes) aren't compressed
+MAX_RETRIES_ON_NODE = 2  # connection and read retries on a node before trying the next one
 METADATA_FILTER_RAW = 'metadata__filter_raw'
 REPO_LABELS = 'repository_labels'
 
@@ -140,7 +148,212 @@ def get_time_diff_days(start, end):
     return diff_days
 
 
-def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_RETRIES):
+class NodePool:
+    """Pool of nodes of an ElasticSearch cluster.
+
+    Nodes are selected in turns (`round_robin`) or choosing the one with
+    less requests in progress (`least_loaded`). Nodes failing to connect
+    are considered dead during `dead_timeout` seconds. Scroll and point
+    in time requests of a thread are sent always to the same node.
+
+    :param urls: list of urls of the nodes; the first one identifies the pool
+    """
+    strategy = 'round_robin'
+    dead_timeout = 60
+
+    STRATEGIES = ['round_robin', 'least_loaded']
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.url = urls[0]
+        self.lock = threading.Lock()
+        self.next_node = 0
+        self.inflight = {url: 0 for url in urls}
+        self.dead_until = {}
+        self.local = threading.local()
+
+    def get_node(self, sticky=False):
+        """Select a node to send a request.
+
+        :param sticky: send the request to the same node used by the thread
+            in previous sticky requests (e.g., scrolls)
+        """
+        with self.lock:
+            now = time.time()
+            alive = [url for url in self.urls if self.dead_until.get(url, 0) <= now]
+            if not alive:
+                # Try the node that has been dead for longer
+                alive = [min(self.urls, key=lambda url: self.dead_until[url])]
+
+            node = getattr(self.local, 'node', None) if sticky else None
+            if node not in alive:
+                if self.strategy == 'least_loaded':
+                    node = min(alive, key=lambda url: self.inflight[url])
+                else:
+                    node = alive[self.next_node % len(alive)]
+                    self.next_node += 1
+                if sticky:
+                    self.local.node = node
+
+            self.inflight[node] += 1
+            return node
+
+    def release_node(self, node, dead=False):
+        """Release a node once the request finishes, marking it as dead on errors"""
+
+        with self.lock:
+            self.inflight[node] -= 1
+            if dead:
+                self.dead_until[node] = time.time() + self.dead_timeout
+                logger.warning("Node {} marked as dead for {} sec".format(anonymize_url(node), self.dead_timeout))
+            else:
+                self.dead_until.pop(node, None)
+
+
+# Node pools of the clusters with several nodes, by the url of their first node
+_node_pools = {}
+
+
+def get_node_urls(url):
+    """Get the list of node urls from a comma separated list of urls.
+
+    If `url` is the url of a registered node pool, the urls of the nodes
+    of the pool are returned.
+
+    :param url: url or comma separated list of urls
+    """
+    urls = [node.strip().rstrip('/') for node in url.split(',') if node.strip()]
+
+    if len(urls) == 1 and urls[0] in _node_pools:
+        return list(_node_pools[urls[0]].urls)
+
+    return urls
+
+
+def register_nodes(url):
+    """Register the nodes of a cluster to balance the requests among them.
+
+    :param url: url or comma separated list of urls of the nodes
+
+    :returns: url of the first node, used to identify the cluster
+    """
+    urls = get_node_urls(url)
+
+    if len(urls) > 1 and urls[0] not in _node_pools:
+        _node_pools[urls[0]] = NodePool(urls)
+        logger.debug("Balancing requests among nodes {}".format([anonymize_url(node) for node in urls]))
+
+    return urls[0]
+
+
+def find_node_pool(url):
+    """Find the node pool of the cluster of a request url"""
+
+    for pool_url, pool in _node_pools.items():
+        if url.startswith(pool_url + '/') or url == pool_url:
+            return pool
+    return None
+
+
+class CompressedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter which compresses the bodies of the requests with gzip.
+
+    Bodies smaller than `COMPRESS_MIN_SIZE` bytes or already encoded
+    are sent as they are.
+
+    :param compress_level: gzip compression level, from 1 (fastest) to 9 (smallest),
+        `None` to send the bodies uncompressed
+    """
+    def __init__(self, compress_level, **kwargs):
+        self.compress_level = compress_level
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        body = request.body
+        if self.compress_level and body and 'Content-Encoding' not in request.headers and not hasattr(body, 'read'):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            if isinstance(body, bytes) and len(body) >= COMPRESS_MIN_SIZE:
+                request.body = gzip.compress(body, compresslevel=self.compress_level)
+                request.headers['Content-Encoding'] = 'gzip'
+                request.headers['Content-Length'] = str(len(request.body))
+
+        return super().send(request, **kwargs)
+
+
+class BalancedHTTPAdapter(CompressedHTTPAdapter):
+    """HTTP adapter which balances the requests among the nodes of a cluster.
+
+    Requests to a cluster registered with `register_nodes` are sent to
+    one of its nodes, failing over to the next node when a node can't be
+    reached. Requests to other urls are sent as they are.
+    """
+    def __init__(self, compress_level, max_retries, **kwargs):
+        super().__init__(compress_level, max_retries=max_retries, **kwargs)
+        # Fail over to the next node sooner than retrying on the same one
+        node_retries = max_retries.new(connect=MAX_RETRIES_ON_NODE, read=MAX_RETRIES_ON_NODE)
+        self.node_adapter = CompressedHTTPAdapter(compress_level, max_retries=node_retries, **kwargs)
+
+    def send(self, request, **kwargs):
+        pool = find_node_pool(request.url)
+        if not pool:
+            return super().send(request, **kwargs)
+
+        path = request.url[len(pool.url):]
+        sticky = self.is_sticky(path, request.body)
+
+        for _ in range(len(pool.urls)):
+            node = pool.get_node(sticky)
+            request.url = node + path
+            try:
+                response = self.node_adapter.send(request, **kwargs)
+            except requests.exceptions.ConnectionError:
+                pool.release_node(node, dead=True)
+                continue
+            pool.release_node(node)
+            return response
+
+        # All the nodes failed, keep retrying on one of them
+        node = pool.get_node(sticky)
+        request.url = node + path
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            pool.release_node(node)
+
+    @staticmethod
+    def is_sticky(path, body):
+        """Check whether a request is part of a scroll or a point in time search"""
+
+        if 'scroll' in path or '_pit' in path:
+            return True
+        if isinstance(body, str):
+            return '"pit"' in body
+        if isinstance(body, bytes):
+            return b'"pit"' in body
+        return False
+
+    def close(self):
+        self.node_adapter.close()
+        super().close()
+
+
+def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_RETRIES, compress_level=None,
+                 pool_maxsize=None):
+    """Create a HTTP session which retries the requests on errors.
+
+    Responses are always negotiated with `Accept-Encoding: gzip, deflate`
+    and decompressed transparently. Requests to clusters registered with
+    `register_nodes` are balanced among their nodes.
+
+    :param insecure: don't verify ssl connections
+    :param conn_retries: max retries on connection errors
+    :param total: max retries on any error
+    :param compress_level: gzip level to compress the bodies of the requests,
+        `None` to send them uncompressed
+    :param pool_maxsize: number of connections kept alive per host,
+        `None` to use the default of `requests`
+    """
     conn = requests.Session()
     # {backoff factor} * (2 ^ ({number of total retries} - 1))
     # conn_retries = 21  # 209715.2 = 2.4d
@@ -149,7 +362,11 @@ def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_R
     retries = urllib3.util.Retry(total=total, connect=conn_retries, read=MAX_RETRIES_ON_READ,
                                  redirect=MAX_RETRIES_ON_REDIRECT, backoff_factor=BACKOFF_FACTOR,
                                  allowed_methods=False, status_forcelist=STATUS_FORCE_LIST)
-    adapter = requests.adapters.HTTPAdapter(max_retries=retries)
+    pool_kwargs = {}
+    if pool_maxsize:
+        pool_kwargs = {'pool_connections': pool_maxsize, 'pool_maxsize': pool_maxsize}
+    adapter = BalancedHTTPAdapter(compress_level, max_retries=retries, **pool_kwargs)
+    conn.headers['Accept-Encoding'] = 'gzip, deflate'
     conn.mount('http://', adapter)
     conn.mount('https://', adapter)
 
@@ -160,6 +377,113 @@ def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_R
     return conn
 
 
+class PooledRequestsHttpConnection(RequestsHttpConnection):
+    """Connection of the ElasticSearch clients, with `ConnectionRegistry.pool_maxsize`
+    keep-alive connections per host shared by the threads using the client."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=ConnectionRegistry.pool_maxsize,
+                                                pool_maxsize=ConnectionRegistry.pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+class ConnectionRegistry:
+    """Process-wide registry of HTTP sessions and ElasticSearch clients.
+
+    Creating a session or a client for every index or study opens new
+    connections (and TLS handshakes) to the cluster. The registry hands
+    out the same session for the same TLS settings and the same client
+    for the same cluster, so their keep-alive connections are reused
+    by every object of the process.
+
+    `pool_maxsize` sets the number of connections kept per host, which
+    should be at least the number of threads sending requests at the
+    same time (e.g., concurrent bulks).
+    """
+    pool_maxsize = requests.adapters.DEFAULT_POOLSIZE
+
+    _lock = threading.Lock()
+    _sessions = {}
+    _clients = {}
+
+    @classmethod
+    def get_session(cls, insecure=True, compress_level=None):
+        """Get the session for the given TLS and compression settings.
+
+        :param insecure: don't verify ssl connections
+        :param compress_level: gzip level to compress the bodies of the requests,
+            `None` to send them uncompressed
+        """
+        key = (insecure, compress_level, cls.pool_maxsize)
+
+        with cls._lock:
+            session = cls._sessions.get(key)
+            if not session:
+                session = grimoire_con(insecure, compress_level=compress_level, pool_maxsize=cls.pool_maxsize)
+                cls._sessions[key] = session
+
+        return session
+
+    @classmethod
+    def get_client(cls, url, verify_certs=False, timeout=100, **kwargs):
+        """Get the ElasticSearch client of a cluster.
+
+        :param url: url or comma separated list of urls of the nodes of the cluster
+        :param verify_certs: verify ssl connections
+        :param timeout: timeout of the requests in seconds
+        :param kwargs: other params of the client (e.g., `max_retries`)
+        """
+        nodes = get_node_urls(url)
+        key = (tuple(nodes), verify_certs, timeout, cls.__freeze(kwargs), cls.pool_maxsize)
+
+        with cls._lock:
+            client = cls._clients.get(key)
+            if not client:
+                client = Elasticsearch(nodes, retry_on_timeout=True, timeout=timeout, verify_certs=verify_certs,
+                                       connection_class=PooledRequestsHttpConnection,
+                                       serializer=CodecSerializer(), **kwargs)
+                cls._clients[key] = client
+
+        return client
+
+    @classmethod
+    def __freeze(cls, value):
+        """Get a hashable version of a param of the clients, e.g. a dict of headers"""
+
+        if isinstance(value, dict):
+            return frozenset((key, cls.__freeze(item)) for key, item in value.items())
+        if isinstance(value, (list, tuple)):
+            return tuple(cls.__freeze(item) for item in value)
+        if isinstance(value, set):
+            return frozenset(cls.__freeze(item) for item in value)
+        return value
+
+    @classmethod
+    def clear(cls):
+        """Close and forget the sessions and clients created"""
+
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            for client in cls._clients.values():
+                client.transport.close()
+            cls._sessions.clear()
+            cls._clients.clear()
+
+    @classmethod
+    def reset(cls):
+        """Forget the sessions and clients without closing them.
+
+        Used in forked processes, whose inherited connections belong to
+        the parent process.
+        """
+        cls._lock = threading.Lock()
+        cls._sessions = {}
+        cls._clients = {}
+
+
 def get_last_enrich(backend_cmd, enrich_backend, filter_raw=None):
     last_enrich = None
 
@@ -233,6 +557,35 @@ def get_last_enrich(backend_cmd, enrich_backend, filter_raw=None):
     return last_enrich
 
 
+def has_from_date(backend_cmd, enrich_backend):
+    """Check whether the date or offset from which the raw items are enriched is given.
+
+    It is given with the `from_date` or `offset` params of the Perceval
+    backends, or with the `--from-date` param of the rest of backends.
+    """
+    if not backend_cmd:
+        return '--from-date' in (enrich_backend.backend_params or [])
+
+    signature = inspect.signature(backend_cmd.backend.fetch)
+
+    if 'from_date' in signature.parameters:
+        try:
+            from_date = backend_cmd.from_date
+        except AttributeError:
+            from_date = backend_cmd.parsed_args.from_date
+        return bool(from_date) and \
+            from_date.replace(tzinfo=None) != str_to_datetime("1970-01-01").replace(tzinfo=None)
+
+    if 'offset' in signature.parameters:
+        try:
+            offset = backend_cmd.offset
+        except AttributeError:
+            offset = backend_cmd.parsed_args.offset
+        return offset is not None and offset != 0
+
+    return False
+
+
 def get_min_last_enrich(last_enrich, last_enrich_filtered):
     if last_enrich_filtered:
         min_enrich = min(last_enrich, last_enrich_filtered.replace(tzinfo=None))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Pipeline of stages connected by bounded queues"""
+
+import logging
+import queue
+import threading
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the checks of whether the pipeline was aborted while a stage waits
+POLL_INTERVAL = 0.1
+
+# Value sent through the queues once there aren't more values
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised within a stage when another stage of the pipeline failed"""
+
+
+class Stage:
+    """Step of a pipeline run by a number of threads.
+
+    Every value received by the stage is passed to `func`, which
+    returns an iterable with the values for the next stage (none,
+    one or several of them). The values are sent to the next stage
+    in the same order they were received, even when several workers
+    process them at the same time.
+
+    The time the workers spent processing values (`busy`) and waiting
+    for the previous or the next stage (`waiting`) is accounted, so the
+    bottleneck of the pipeline can be found.
+
+    :param name: name of the stage
+    :param func: function applied to each value
+    :param workers: number of threads running `func`
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+        self.processed = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+        self.lock = threading.Lock()
+
+    def account(self, busy=0.0, waiting=0.0, processed=0):
+        with self.lock:
+            self.busy += busy
+            self.waiting += waiting
+            self.processed += processed
+
+    def stats(self):
+        """Get the values processed and the seconds busy and waiting of the stage"""
+
+        return {
+            'processed': self.processed,
+            'workers': self.workers,
+            'busy': self.busy,
+            'waiting': self.waiting
+        }
+
+
+class Pipeline:
+    """Run the stages of a process at the same time, connected by bounded queues.
+
+    The values generated by `source` are read in a thread of their own
+    and go through the stages in order. Each pair of consecutive stages
+    is connected by a queue of `queue_size` values, so when a stage is
+    slower than the previous ones, they wait for it instead of piling up
+    values in memory (backpressure). The values returned by the last stage
+    are discarded: it is the sink of the pipeline (e.g., the upload).
+
+    When a stage fails, the rest of stages are stopped and `run` raises
+    the error.
+
+    :param source: iterable with the input values of the pipeline
+    :param stages: list of `Stage` objects
+    :param queue_size: max number of values waiting between two stages
+    :param name: name of the pipeline, used in the logs
+    """
+    def __init__(self, source, stages, queue_size=1, name='pipeline'):
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.name = name
+
+        self.reader = Stage('read', None)
+        self.aborted = threading.Event()
+        self.error = None
+
+    def run(self):
+        """Run the pipeline until all the values of the source are processed.
+
+        :returns: dict with the stats of each stage (see `Stage.stats`)
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+
+        threads = [threading.Thread(target=self.__read, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            output = queues[i + 1] if i + 1 < len(queues) else None
+            emitter = _Emitter(output, stage.workers)
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self.__work, args=(stage, queues[i], emitter), daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = {stage.name: stage.stats() for stage in [self.reader] + self.stages}
+        for name, stage_stats in stats.items():
+            logger.debug("[{}] stage {}: {} values, {} workers, {:.2f} sec busy, {:.2f} sec waiting".format(
+                         self.name, name, stage_stats['processed'], stage_stats['workers'],
+                         stage_stats['busy'], stage_stats['waiting']))
+
+        if self.error:
+            raise self.error
+
+        return stats
+
+    def __read(self, output):
+        values = iter(self.source)
+        seq = 0
+        try:
+            while True:
+                task_init = time()
+                try:
+                    value = next(values)
+                except StopIteration:
+                    break
+                self.reader.account(busy=time() - task_init, processed=1)
+
+                self.reader.account(waiting=self.__put(output, (seq, [value])))
+                seq += 1
+
+            self.__put(output, _END)
+        except PipelineAborted:
+            pass
+        except Exception as ex:
+            self.__abort(ex)
+        finally:
+            close = getattr(values, 'close', None)
+            if close:
+                close()
+
+    def __work(self, stage, input_queue, emitter):
+        try:
+            while True:
+                waiting, entry = self.__get(input_queue)
+                stage.account(waiting=waiting)
+                if entry is _END:
+                    # Let the rest of workers of the stage know the values ended
+                    input_queue.put(_END)
+                    emitter.finish(self.__put)
+                    break
+
+                seq, values = entry
+                task_init = time()
+                results = []
+                for value in values:
+                    results.extend(stage.func(value) or [])
+                stage.account(busy=time() - task_init, processed=len(values))
+
+                stage.account(waiting=emitter.emit(seq, results, self.__put))
+        except PipelineAborted:
+            pass
+        except Exception as ex:
+            self.__abort(ex)
+
+    def __abort(self, error):
+        if not self.error:
+            logger.error("[{}] pipeline stopped: {}".format(self.name, error))
+            self.error = error
+        self.aborted.set()
+
+    def __get(self, input_queue):
+        task_init = time()
+        while True:
+            if self.aborted.is_set():
+                raise PipelineAborted()
+            try:
+                entry = input_queue.get(timeout=POLL_INTERVAL)
+                return time() - task_init, entry
+            except queue.Empty:
+                continue
+
+    def __put(self, output, entry):
+        task_init = time()
+        while True:
+            if self.aborted.is_set():
+                raise PipelineAborted()
+            try:
+                output.put(entry, timeout=POLL_INTERVAL)
+                return time() - task_init
+            except queue.Full:
+                continue
+
+
+class _Emitter:
+    """Send the results of the workers of a stage in the order of their inputs"""
+
+    def __init__(self, output, workers):
+        self.output = output
+        self.workers = workers
+        self.next_seq = 0
+        self.out_seq = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def emit(self, seq, results, put):
+        """Queue the results of the input `seq` and send the ones which are next.
+
+        :returns: seconds spent waiting for the next stage
+        """
+        waiting = 0.0
+
+        with self.lock:
+            self.pending[seq] = results
+            while self.next_seq in self.pending:
+                results = self.pending.pop(self.next_seq)
+                self.next_seq += 1
+                if self.output is None or not results:
+                    continue
+                waiting += put(self.output, (self.out_seq, results))
+                self.out_seq += 1
+
+        return waiting
+
+    def finish(self, put):
+        """Send the end of the values once all the workers of the stage finished"""
+
+        with self.lock:
+            self.workers -= 1
+            if self.workers == 0 and self.output is not None:
+                put(self.output, _END)
@@ -30,6 +30,7 @@ from grimoirelab_toolkit.datetime import unixtime_to_datetime
 
 from datetime import datetime
 from ..enriched.utils import get_repository_filter, anonymize_url
+from ..elastic_bulk import BulkWriter
 from ..elastic_items import ElasticItems
 from ..elastic_mapping import Mapping
 from ..errors import ELKError
@@ -54,9 +55,11 @@ class ElasticOcean(ElasticItems):
         parser = cmdline_parser
 
         parser.add_argument("-e", "--elastic_url", default="http://127.0.0.1:9200",
-                            help="Host with elastic search (default: http://127.0.0.1:9200)")
+                            help="Host with elastic search, or comma separated hosts of several "
+                                 "nodes (default: http://127.0.0.1:9200)")
         parser.add_argument("--elastic_url-enrich",
-                            help="Host with elastic search and enriched indexes")
+                            help="Host with elastic search and enriched indexes, or comma separated "
+                                 "hosts of several nodes")
 
     def __init__(self, perceval_backend, from_date=None, fetch_archive=False,
                  project=None, insecure=True, offset=None, anonymize=False,
@@ -67,6 +70,7 @@ class ElasticOcean(ElasticItems):
         self.fetch_archive = fetch_archive  # fetch from archive
         self.project = project  # project to be used for this data source
         self.anonymize = anonymize
+        self.items_consumer = None  # function consuming the items while they are fed
 
     def set_elastic_url(self, url):
         """ Elastic URL """
@@ -76,6 +80,15 @@ class ElasticOcean(ElasticItems):
         """ Elastic used to store last data source state """
         self.elastic = elastic
 
+    def set_items_consumer(self, consumer):
+        """Set the function which receives the raw items while they are fed.
+
+        The function is called with a generator of the raw items added
+        to the index, and it must consume all of them (e.g., to enrich the
+        items without reading them again from the index).
+        """
+        self.items_consumer = consumer
+
     def get_field_date(self):
         """ Field with the update in the JSON items. Now the same in all. """
         return "metadata__updated_on"
@@ -243,39 +256,87 @@ class ElasticOcean(ElasticItems):
     def feed_items(self, items):
         task_init = datetime.now()
 
-        items_pack = []  # to feed item in packs
         drop = 0
         added = 0
-
-        for item in items:
-            # print("%s %s" % (item['url'], item['lastUpdated_date']))
-            # Add date field for incremental analysis if needed
-            self.add_update_date(item)
-            self._fix_item(item)
-            if self.project:
-                item['project'] = self.project
-            if self.anonymize:
-                self.identities.anonymize_item(item)
-            if len(items_pack) >= self.elastic.max_items_bulk:
-                self._items_to_es(items_pack)
-                items_pack = []
-            if not self.drop_item(item):
-                items_pack.append(item)
-                added += 1
-            else:
-                drop += 1
-        self._items_to_es(items_pack)
+        field_id = self.get_field_unique_id()
+        backend_name = self.perceval_backend.__class__.__name__.lower()
+        last_item = None
+        # Immutable items already stored are kept as they are
+        create = self.skip_immutable and self.immutable_items
+
+        items = iter(items)
+        # Error raised by the backend or by the raw upload while the items are consumed
+        feed_error = None
+
+        def add_items():
+            nonlocal feed_error
+
+            try:
+                yield from store_items()
+            except Exception as ex:
+                feed_error = ex
+                raise
+
+        def store_items():
+            nonlocal drop, added, last_item
+
+            for item in items:
+                # print("%s %s" % (item['url'], item['lastUpdated_date']))
+                # Add date field for incremental analysis if needed
+                self.add_update_date(item)
+                self._fix_item(item)
+                if self.project:
+                    item['project'] = self.project
+                if self.anonymize:
+                    self.identities.anonymize_item(item)
+                if not self.drop_item(item):
+                    if create:
+                        writer.create(item, item[field_id], marker=item.get('metadata__updated_on'))
+                    else:
+                        writer.add(item, item[field_id], marker=item.get('metadata__updated_on'))
+                    last_item = item
+                    added += 1
+                    yield item
+                else:
+                    drop += 1
+
+        # Items are sent in bulks while they are fetched, so several
+        # bulks can be in flight while the backend retrieves new items
+        with BulkWriter(self.elastic) as writer:
+            if self.items_consumer:
+                try:
+                    self.items_consumer(add_items())
+                except Exception as ex:
+                    # The raw index stays complete, its items can be consumed again from it
+                    if not feed_error:
+                        logger.error("[{}] Error consuming the items fed to index {}, the rest are only stored: {}".format(
+                                     backend_name, self.elastic.index, ex), exc_info=True)
+
+                # Errors of the collection are raised even if the consumer handled them
+                if feed_error:
+                    raise feed_error
+
+            # Store the items not consumed
+            for _ in add_items():
+                pass
+
+        if added != writer.total + writer.existing:
+            missing = added - writer.total - writer.existing
+            logger.warning("[{}] {}/{} missing JSON items for backend {} [ver. {}], origin {}".format(
+                           backend_name, missing, added, last_item['backend_name'],
+                           last_item['backend_version'], last_item['origin']))
 
         total_time_min = (datetime.now() - task_init).total_seconds() / 60
 
         logger.debug("[{}] Added {} items to index {}".format(
-                     self.perceval_backend.__class__.__name__.lower(),
-                     added, self.elastic.index))
+                     backend_name, writer.total, self.elastic.index))
+        if writer.existing:
+            logger.debug("[{}] Skipped {} items already in index {}".format(
+                         backend_name, writer.existing, self.elastic.index))
         logger.debug("[{}] Dropped {} items using drop_item filter".format(
-                     self.perceval_backend.__class__.__name__.lower(), drop))
+                     backend_name, drop))
         logger.debug("[{}] Finished in {:.2f} min".format(
-                     self.perceval_backend.__class__.__name__.lower(),
-                     total_time_min))
+                     backend_name, total_time_min))
         return self
 
     def _items_to_es(self, json_items):
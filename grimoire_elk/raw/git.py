@@ -70,6 +70,7 @@ class GitOcean(ElasticOcean):
     """Git Ocean feeder"""
 
     mapping = Mapping
+    immutable_items = True
     identities = GitIdentities
 
     def _fix_item(self, item):
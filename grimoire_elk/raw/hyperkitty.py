@@ -64,3 +64,4 @@ class HyperKittyOcean(ElasticOcean):
     """HyperKitty Ocean feeder"""
 
     mapping = Mapping
+    immutable_items = True
@@ -65,6 +65,7 @@ class MBoxOcean(ElasticOcean):
     """MBox Ocean feeder"""
 
     mapping = Mapping
+    immutable_items = True
 
     @classmethod
     def get_perceval_params_from_url(cls, url):
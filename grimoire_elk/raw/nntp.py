@@ -55,6 +55,7 @@ class NNTPOcean(ElasticOcean):
     """NNTP Ocean feeder"""
 
     mapping = Mapping
+    immutable_items = True
 
     @classmethod
     def get_perceval_params_from_url(cls, url):
@@ -29,7 +29,9 @@ import requests
 import pkg_resources
 
 from grimoire_elk.errors import ElasticError
-from grimoire_elk.elastic import ElasticSearch
+from grimoire_elk.elastic import ElasticSearch, REFRESH_POLICIES
+from grimoire_elk.codec import CODECS, get_codec
+from grimoire_elk.enriched.utils import NodePool, register_nodes
 # Connectors for Graal
 from graal.backends.core.coqua import CoQua, CoQuaCommand
 from graal.backends.core.cocom import CoCom, CoComCommand
@@ -284,6 +286,7 @@ def get_connectors():
 def get_elastic(url, es_index, clean=None, backend=None, es_aliases=None, mapping=None):
 
     analyzers = None
+    url = register_nodes(url)
 
     if backend:
         backend.set_elastic_url(url)
@@ -295,9 +298,11 @@ def get_elastic(url, es_index, clean=None, backend=None, es_aliases=None, mappin
             analyzers = backend.get_elastic_analyzers()
     try:
         insecure = True
+        date_field = backend.get_incremental_date() if backend else None
         elastic = ElasticSearch(url=url, index=es_index, mappings=mapping,
                                 clean=clean, insecure=insecure,
-                                analyzers=analyzers, aliases=es_aliases)
+                                analyzers=analyzers, aliases=es_aliases,
+                                date_field=date_field)
 
     except ElasticError:
         msg = "Can't connect to Elastic Search. Is it running?"
@@ -376,6 +381,10 @@ def get_params_parser():
                         help="Only enrich items (DEPRECATED, use --only-enrich)")
     parser.add_argument("--only-enrich", dest='enrich_only', action='store_true',
                         help="Only enrich items")
+    parser.add_argument("--enrich-target", dest='enrich_targets', action='append',
+                        help="Other enrichment of the raw items read at once. Format: [backend]:index[:events]")
+    parser.add_argument("--fused-enrich", dest='fused_enrich', action='store_true',
+                        help="Enrich items while retrieving them, without reading them again from the raw index")
     parser.add_argument("--filter-raw", dest='filter_raw',
                         help="Filter raw items. Format: field:value")
     parser.add_argument("--events-enrich", dest='events_enrich', action='store_true',
@@ -403,6 +412,57 @@ def get_params_parser():
     parser.add_argument('--only-studies', action='store_true', help="Execute only studies.")
     parser.add_argument('--bulk-size', default=1000, type=int,
                         help="Number of items per bulk request to Elasticsearch.")
+    parser.add_argument('--bulk-bytes', default=10 * 1024 * 1024, type=int,
+                        help="Max size in bytes of each bulk request to Elasticsearch.")
+    parser.add_argument('--bulk-concurrency', default=1, type=int,
+                        help="Max number of bulk requests sent concurrently to Elasticsearch.")
+    parser.add_argument('--bulk-retries', default=5, type=int,
+                        help="Max retries of the items rejected by Elasticsearch in a bulk request.")
+    parser.add_argument('--bulk-max-latency', default=30, type=int,
+                        help="Bulk requests slower than this (seconds) reduce the bulk size.")
+    parser.add_argument('--bulk-dead-letter', dest='bulk_dead_letter',
+                        help="NDJSON file to store the items that couldn't be uploaded to Elasticsearch.")
+    parser.add_argument('--es-compression', type=int, choices=range(1, 10), metavar='LEVEL',
+                        help="Compress with gzip, using this level (1-9), the requests sent to Elasticsearch.")
+    parser.add_argument('--elastic-balancing', default='round_robin', choices=NodePool.STRATEGIES,
+                        help="Strategy to balance the requests when several Elasticsearch nodes are given.")
+    parser.add_argument('--json-codec', choices=list(CODECS),
+                        help="JSON codec to encode and decode the Elasticsearch documents (default {}).".format(
+                             get_codec().name))
+    parser.add_argument('--http-pool-size', type=int,
+                        help="Number of HTTP connections kept alive per host, shared by the whole process.")
+    parser.add_argument('--refresh-policy', default='true', choices=REFRESH_POLICIES,
+                        help="Refresh of the index after bulk requests: on each one (true), waiting "
+                             "for the scheduled refresh (wait_for), never (none) or once at the end (end).")
+    parser.add_argument('--last-values-ttl', type=int,
+                        help="Seconds the last dates/offsets of all the repositories are cached, 0 to disable it "
+                             "(default 0).")
+    parser.add_argument('--fetch-slices', default=1, type=int,
+                        help="Number of slices of the indexes read in parallel when enriching.")
+    parser.add_argument('--fetch-read-ahead', default=0, type=int,
+                        help="Number of pages of the indexes read in background while enriching (default 0).")
+    parser.add_argument('--checkpoint-index',
+                        help="Index to store the last raw item enriched of each repository, to resume from it.")
+    parser.add_argument('--enrich-processes', default=0, type=int,
+                        help="Number of processes enriching the items in parallel (default 0, in the main process).")
+    parser.add_argument('--pipeline-queue-size', default=0, type=int,
+                        help="Enrich, encode and upload the items at the same time, with queues of this size "
+                             "between the stages (default 0, one after the other).")
+    parser.add_argument('--enrich-threads', default=1, type=int,
+                        help="Number of threads enriching the items in the pipeline (default 1).")
+    parser.add_argument('--serialize-threads', default=1, type=int,
+                        help="Number of threads encoding the items in the pipeline (default 1).")
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="Don't upload the enriched items whose content is the same as in the index.")
+    parser.add_argument('--route-by-origin', action='store_true',
+                        help="Route the items of each repository to a single shard in the new indexes.")
+    parser.add_argument('--sort-index', action='store_true',
+                        help="Sort the new indexes by the incremental date of the items.")
+    parser.add_argument('--monthly-indexes', action='store_true',
+                        help="Write the new indexes into monthly indexes, by incremental date, behind an alias.")
+    parser.add_argument('--skip-immutable', action='store_true',
+                        help="Don't upload nor enrich again the immutable items (e.g., commits, messages) "
+                             "already stored by this version.")
     parser.add_argument('--scroll-wait', default=900, type=int, help="Wait for available scroll (default 900s)")
     parser.add_argument('--scroll-size', default=100, type=int,
                         help="Number of items to get from Elasticsearch when scrolling.")
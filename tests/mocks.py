@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Stubs of ElasticSearch shared by the tests which mock the HTTP requests"""
+
+import json
+import re
+
+import httpretty
+import requests
+
+from grimoire_elk.elastic import ElasticSearch
+from grimoire_elk.enriched.enrich import Enrich
+from grimoire_elk.raw.elastic import ElasticOcean
+from perceval.backends.core.git import Git
+
+
+class MockElasticSearch(ElasticSearch):
+    """ElasticSearch object of an existing index, created without requests"""
+
+    def __init__(self, url, index, date_field=None):
+        self.requests = requests.Session()
+        self.url = url
+        self.index = index
+        self.major = '7'
+        self.distribution = 'elasticsearch'
+        self.index_url = self.url + "/" + self.index
+        self.date_field = date_field
+        self.new_index = False
+        self.bulk_loading = False
+
+
+class CheckpointServer:
+    """Store the documents of a checkpoints index"""
+
+    def __init__(self, url, index):
+        self.docs = {}
+        self.saved = []
+
+        doc_url = re.compile(url + "/" + index + "/_doc/(.+)")
+        httpretty.register_uri(httpretty.GET, doc_url, body=self.get)
+        httpretty.register_uri(httpretty.PUT, doc_url, body=self.put)
+        httpretty.register_uri(httpretty.DELETE, doc_url, body=self.delete)
+
+    def get(self, request, uri, headers):
+        doc_id = uri.split('/')[-1]
+        if doc_id not in self.docs:
+            return 404, headers, '{"found": false}'
+        return 200, headers, json.dumps({"_id": doc_id, "found": True, "_source": self.docs[doc_id]})
+
+    def put(self, request, uri, headers):
+        doc = json.loads(request.body)
+        self.docs[uri.split('/')[-1]] = doc
+        self.saved.append(doc)
+        return 201, headers, '{"result": "created"}'
+
+    def delete(self, request, uri, headers):
+        found = self.docs.pop(uri.split('/')[-1], None)
+        return (200 if found else 404), headers, '{}'
+
+
+class MockEnrich(Enrich):
+    """Enrich backend which keeps the id and the date of the raw items"""
+
+    def get_rich_item(self, item):
+        return {"uuid": item["uuid"], "metadata__timestamp": item["metadata__timestamp"]}
+
+
+class MockOcean(ElasticOcean):
+    """Ocean backend which returns the given items with their sort values"""
+
+    def __init__(self, items, origin):
+        super().__init__(Git(origin, '/tmp/foo'))
+        self.items = items
+        self.fetched = []
+
+    def fetch(self, _filter=None, ignore_incremental=False, search_after=None, slices=1, source_includes=None):
+        self.fetched.append({"search_after": search_after, "tiebreak_field": self.tiebreak_field})
+        for item in self.items:
+            self.search_after = [item["metadata__timestamp"], item["uuid"], 0]
+            yield item
+
+
+def bulk_response(request, uri, headers):
+    """Acknowledge all the documents of a bulk request"""
+
+    lines = request.body.decode('utf-8').splitlines()
+    items = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[::2]]
+    return 200, headers, json.dumps({"errors": False, "items": items})
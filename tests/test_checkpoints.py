@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk import elk
+from grimoire_elk.checkpoints import CheckpointStore
+from grimoire_elk.enriched.cocom import CocomEnrich
+from grimoire_elk.enriched.colic import ColicEnrich
+from grimoire_elk.enriched.discourse import DiscourseEnrich
+from grimoire_elk.enriched.enrich import Enrich
+from grimoire_elk.enriched.gerrit import GerritEnrich
+from grimoire_elk.enriched.git import GitEnrich
+from grimoire_elk.enriched.github2 import GitHubEnrich2
+from grimoire_elk.enriched.jira import JiraEnrich
+from grimoire_elk.enriched.meetup import MeetupEnrich
+from grimoire_elk.enriched.stackexchange import StackExchangeEnrich
+
+from mocks import CheckpointServer, MockElasticSearch, MockEnrich, MockOcean, bulk_response
+
+ES_URL = "http://es.example.com"
+INDEX = "git_enriched"
+BULK_URL = ES_URL + "/" + INDEX + "/_bulk"
+CHECKPOINTS = "checkpoints"
+ORIGIN = "http://example.com/repo.git"
+
+
+class TestCheckpoints(unittest.TestCase):
+    """Tests for the enrichment checkpoints"""
+
+    def setUp(self):
+        Enrich.checkpoint_index = CHECKPOINTS
+        self.enrich = MockEnrich()
+        self.enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+        self.store = CheckpointStore(ES_URL, CHECKPOINTS)
+
+    def tearDown(self):
+        Enrich.checkpoint_index = None
+
+    @httpretty.activate
+    def test_store(self):
+        """Test whether the checkpoints are stored, read and deleted"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+
+        self.assertIsNone(self.store.get('git', ORIGIN, None, INDEX))
+
+        self.store.save('git', ORIGIN, None, INDEX, "2023-01-01T00:00:00+00:00", [1672531200000, "abc"])
+        checkpoint = self.store.get('git', ORIGIN, None, INDEX)
+        self.assertDictEqual(checkpoint, {"timestamp": "2023-01-01T00:00:00+00:00", "sort": [1672531200000, "abc"]})
+
+        # Each filter raw has its own checkpoint
+        self.assertIsNone(self.store.get('git', ORIGIN, 'data.product:A', INDEX))
+
+        self.store.delete('git', ORIGIN, None, INDEX)
+        self.assertIsNone(self.store.get('git', ORIGIN, None, INDEX))
+        self.assertDictEqual(server.docs, {})
+
+    @httpretty.activate
+    def test_enrich_items(self):
+        """Test whether the checkpoint is stored while items are enriched and used to resume"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_response)
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(5)]
+        ocean = MockOcean(items, ORIGIN)
+        self.enrich.elastic.max_items_bulk = 2
+
+        self.assertIsNone(self.enrich.resume_from_checkpoint(ocean))
+        self.assertEqual(self.enrich.enrich_items(ocean), 5)
+
+        # Checkpoint stored after each bulk
+        self.assertListEqual([doc['timestamp'] for doc in server.saved], ["2023-01-02", "2023-01-04", "2023-01-05"])
+        self.assertListEqual(json.loads(server.saved[-1]['sort']), ["2023-01-05", "4"])
+        self.assertDictEqual(ocean.fetched[0], {"search_after": None, "tiebreak_field": "uuid"})
+
+        # The next enrichment resumes after the last item
+        ocean = MockOcean(items, ORIGIN)
+        checkpoint = self.enrich.resume_from_checkpoint(ocean)
+        self.assertDictEqual(checkpoint, {"timestamp": "2023-01-05", "sort": ["2023-01-05", "4"]})
+        self.assertEqual(ocean.from_date.isoformat(), "2023-01-05T00:00:00+00:00")
+
+        self.enrich.enrich_items(ocean)
+        self.assertListEqual(ocean.fetched[0]['search_after'], ["2023-01-05", "4"])
+
+        # All the items are enriched again
+        self.enrich.delete_checkpoint(ocean)
+        self.assertIsNone(self.enrich.resume_from_checkpoint(ocean))
+
+    @httpretty.activate
+    def test_start_enrichment(self):
+        """Test whether a given from date takes precedence over the checkpoint"""
+
+        CheckpointServer(ES_URL, CHECKPOINTS)
+        connector = self.enrich.get_connector_name()
+        self.store.save(connector, ORIGIN, None, INDEX, "2023-01-05", ["2023-01-05", "4"])
+
+        ocean = MockOcean([], ORIGIN)
+        elk.start_enrichment(ocean, self.enrich, from_date=True)
+        self.assertIsNone(ocean.from_date)
+        self.assertIsNone(self.enrich.checkpoint)
+
+        elk.start_enrichment(ocean, self.enrich)
+        self.assertEqual(ocean.from_date.isoformat(), "2023-01-05T00:00:00+00:00")
+
+        # All the items are enriched again, from a date or not
+        ocean = MockOcean([], ORIGIN)
+        elk.start_enrichment(ocean, self.enrich, no_incremental=True, from_date=True)
+        self.assertIsNone(ocean.from_date)
+        self.assertIsNone(self.store.get(connector, ORIGIN, None, INDEX))
+
+    @httpretty.activate
+    def test_connectors_checkpoints(self):
+        """Test whether the connectors with several rich items per raw item store checkpoints"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_response)
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(3)]
+
+        for klass in [GitEnrich, GerritEnrich, JiraEnrich, GitHubEnrich2, MeetupEnrich,
+                      StackExchangeEnrich, DiscourseEnrich, CocomEnrich, ColicEnrich]:
+            class ConnectorEnrich(klass):
+
+                def get_rich_docs(self, item, events=False):
+                    return [({"uuid": item["uuid"] + suffix, "is_git_commit_signed_off": 1}, item["uuid"] + suffix)
+                            for suffix in ["", "_1"]]
+
+            enrich = ConnectorEnrich()
+            enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+            enrich.elastic.max_items_bulk = 2
+
+            self.assertEqual(enrich.enrich_items(MockOcean(items, ORIGIN)), 6)
+            self.assertEqual(server.saved[-1]['connector'], enrich.get_connector_name())
+            self.assertEqual(server.saved[-1]['timestamp'], "2023-01-03")
+
+    @httpretty.activate
+    def test_items_without_rich_docs(self):
+        """Test whether the checkpoint moves past the raw items without rich items"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        bulk_ids = []
+
+        def bulk_callback(request, uri, headers):
+            lines = request.body.decode('utf-8').splitlines()
+            bulk_ids.extend(json.loads(line)['index']['_id'] for line in lines[::2])
+            return bulk_response(request, uri, headers)
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_callback)
+
+        class SparseEnrich(MockEnrich):
+
+            def get_rich_docs(self, item, events=False):
+                return [] if int(item["uuid"]) % 2 else super().get_rich_docs(item, events)
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(4)]
+
+        for queue_size in [0, 10]:
+            server.saved.clear()
+            bulk_ids.clear()
+            enrich = SparseEnrich()
+            enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+            enrich.pipeline_queue_size = queue_size
+
+            enrich.enrich_items(MockOcean(items, ORIGIN))
+
+            self.assertListEqual(bulk_ids, ["0", "2"])
+            self.assertEqual(server.saved[-1]['timestamp'], "2023-01-04")
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
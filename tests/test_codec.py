@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import dataclasses
+import datetime
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk import codec
+from grimoire_elk.codec import CODECS, CodecSerializer, SearchStreamDecoder
+from grimoire_elk.elastic_items import ElasticItems
+
+from mocks import MockElasticSearch
+
+ES_URL = "http://localhost:9200"
+INDEX = "test_codec"
+INDEX_URL = ES_URL + "/" + INDEX
+
+
+class TestCodec(unittest.TestCase):
+    """Tests for the JSON codecs"""
+
+    def setUp(self):
+        self.codec_name = codec.get_codec().name
+
+    def tearDown(self):
+        codec.set_codec(self.codec_name)
+
+    def test_encode(self):
+        """Test whether the documents are encoded to UTF-8 JSON by every codec"""
+
+        doc = {"title": "Añadir ñandú 😀", "count": 3, 1: [1.5, None, True]}
+
+        for name in CODECS:
+            codec.set_codec(name)
+            data = codec.encode(doc)
+            self.assertIsInstance(data, bytes)
+            self.assertDictEqual(json.loads(data), {"title": "Añadir ñandú 😀", "count": 3, "1": [1.5, None, True]})
+
+    def test_encode_non_finite(self):
+        """Test whether the non-finite floats are encoded as null by every codec"""
+
+        doc = {"nan": float('nan'), "values": [float('inf'), -float('inf'), 1.5], "tuple": (float('nan'),)}
+
+        for name in CODECS:
+            codec.set_codec(name)
+            self.assertDictEqual(json.loads(codec.encode(doc)),
+                                 {"nan": None, "values": [None, None, 1.5], "tuple": [None]})
+
+    def test_encode_unsupported(self):
+        """Test whether the types the standard library can't encode are refused by every codec"""
+
+        @dataclasses.dataclass
+        class Point:
+            x: int
+
+        for name in CODECS:
+            codec.set_codec(name)
+            for value in [datetime.datetime(2023, 1, 1), datetime.date(2023, 1, 1), Point(1), object()]:
+                with self.assertRaises(TypeError):
+                    codec.encode({"value": value})
+
+    def test_encode_surrogates(self):
+        """Test whether the lone surrogates are removed when encoding"""
+
+        doc = {"body": "bad\udc80 text", "number": 2 ** 70}
+
+        for name in CODECS:
+            codec.set_codec(name)
+            with self.assertLogs('grimoire_elk.codec', level='WARNING'):
+                data = codec.encode(doc)
+            self.assertDictEqual(json.loads(data), {"body": "bad text", "number": 2 ** 70})
+
+    def test_decode(self):
+        """Test whether the documents are decoded by every codec"""
+
+        data = '{"title": "A\\u00f1adir \\ud83d\\ude00", "count": 3}'
+
+        for name in CODECS:
+            codec.set_codec(name)
+            self.assertDictEqual(codec.decode(data), {"title": "Añadir 😀", "count": 3})
+            self.assertDictEqual(codec.decode(data.encode('utf-8')), {"title": "Añadir 😀", "count": 3})
+
+    def test_decode_surrogates(self):
+        """Test whether the lone surrogates are removed when decoding"""
+
+        data = b'{"body": "bad\\udc80 text", "ok": "\\ud83d\\ude00"}'
+
+        for name in CODECS:
+            codec.set_codec(name)
+            self.assertDictEqual(codec.decode(data), {"body": "bad text", "ok": "😀"})
+
+    def test_decode_error(self):
+        """Test whether invalid documents raise a ValueError"""
+
+        for name in CODECS:
+            codec.set_codec(name)
+            with self.assertRaises(ValueError):
+                codec.decode(b'{"title": ')
+
+    def test_set_codec_unknown(self):
+        """Test whether an error is raised when the codec is unknown"""
+
+        with self.assertRaises(ValueError):
+            codec.set_codec('unknown')
+
+    def test_serializer(self):
+        """Test whether the serializer of the clients uses the codec"""
+
+        serializer = CodecSerializer()
+
+        self.assertEqual(serializer.dumps('{"query": {}}'), '{"query": {}}')
+        self.assertDictEqual(json.loads(serializer.dumps({"name": "ñandú"})), {"name": "ñandú"})
+        self.assertDictEqual(serializer.loads('{"body": "bad\\udc80 text"}'), {"body": "bad text"})
+
+    def test_search_stream(self):
+        """Test whether the hits of a page are decoded one by one from the chunks of the response"""
+
+        hits = [{"_id": str(i), "_source": {"body": 'a "quoted" {[é😀\\' * i, "list": [{"b": "}]"}]}, "sort": [i]}
+                for i in range(10)]
+        page = {"_scroll_id": "abc", "_shards": {"failures": [{"hits": []}]},
+                "hits": {"total": {"value": 10}, "hits": hits}, "pit_id": "xyz"}
+        data = json.dumps(page, ensure_ascii=False, indent=2).encode('utf-8')
+
+        for name in CODECS:
+            codec.set_codec(name)
+            for size in [1, 7, len(data)]:
+                chunks = [data[i:i + size] for i in range(0, len(data), size)]
+                decoded = SearchStreamDecoder(chunks).decode()
+                self.assertEqual(decoded['_scroll_id'], "abc")
+                self.assertDictEqual(decoded['hits']['total'], {"value": 10})
+                self.assertNotIn('pit_id', decoded)
+
+                self.assertListEqual(list(decoded['hits']['hits']), hits)
+                self.assertEqual(decoded['pit_id'], "xyz")
+
+    def test_search_stream_buffer(self):
+        """Test whether the buffer of the hits is reused, discarding the hits read"""
+
+        hits = [{"_id": str(i), "_source": {"body": "x" * 1000}} for i in range(500)]
+        data = json.dumps({"hits": {"hits": hits}}).encode('utf-8')
+        chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+        decoder = SearchStreamDecoder(chunks)
+        buffer = decoder.buffer
+        sizes = []
+        for i, hit in enumerate(decoder.decode()['hits']['hits']):
+            self.assertEqual(hit['_id'], str(i))
+            sizes.append(len(decoder.buffer))
+
+        self.assertIs(decoder.buffer, buffer)
+        self.assertLess(max(sizes), codec.STREAM_CHUNK_SIZE + 2000)
+        self.assertEqual(len(sizes), 500)
+
+    def test_search_stream_surrogates(self):
+        """Test whether the lone surrogates are removed from every hit"""
+
+        data = b'{"hits": {"hits": [{"_source": {"body": "bad\\udc80 text"}}, {"_source": {"body": "ok"}}]}}'
+
+        for name in CODECS:
+            codec.set_codec(name)
+            decoded = SearchStreamDecoder([data[:30], data[30:]]).decode()
+            self.assertListEqual(list(decoded['hits']['hits']),
+                                 [{"_source": {"body": "bad text"}}, {"_source": {"body": "ok"}}])
+
+    def test_search_stream_truncated(self):
+        """Test whether an error is raised when the results are truncated"""
+
+        data = b'{"_scroll_id": "abc", "hits": {"hits": [{"_source": {"body": "text"}}, {"_source": '
+
+        with self.assertRaises(ValueError):
+            list(SearchStreamDecoder([data]).decode()['hits']['hits'])
+
+        with self.assertRaises(ValueError):
+            SearchStreamDecoder([data[:20]]).decode()
+
+    @httpretty.activate
+    def test_get_elastic_items(self):
+        """Test whether the pages of items are decoded removing the lone surrogates"""
+
+        body = '{"_scroll_id": "abc", "hits": {"total": 1, "hits": [{"_source": {"body": "bad\\udc80 text"}}]}}'
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=body)
+
+        eitems = ElasticItems(None)
+        eitems.elastic = MockElasticSearch(ES_URL, INDEX)
+
+        for name in CODECS:
+            codec.set_codec(name)
+            page = eitems.get_elastic_items()
+            self.assertEqual(page['_scroll_id'], "abc")
+            self.assertDictEqual(page['hits']['hits'][0]['_source'], {"body": "bad text"})
+
+            page = eitems.get_elastic_items(stream=True)
+            self.assertEqual(page['_scroll_id'], "abc")
+            self.assertListEqual([hit['_source'] for hit in page['hits']['hits']], [{"body": "bad text"}])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -183,6 +183,37 @@ class TestElastic(unittest.TestCase):
         self.assertEqual(major, '1')
         self.assertEqual(distribution, OS_DISTRIBUTION)
 
+    @httpretty.activate
+    def test_get_instance(self):
+        """Test whether the version of an instance is retrieved only once"""
+
+        body = """{
+            "name" : "44BPNNH",
+            "cluster_name" : "elasticsearch",
+            "version" : {
+                "number" : "7.10.0"
+            },
+            "tagline" : "You Know, for Search"
+        }"""
+        requests_count = []
+
+        def request_callback(request, uri, headers):
+            requests_count.append(uri)
+            return 200, headers, body
+
+        es_con = "http://es7-cached.com"
+        httpretty.register_uri(httpretty.GET,
+                               es_con,
+                               body=request_callback)
+
+        major, distribution = ElasticSearch.get_instance(es_con, insecure=False)
+        self.assertEqual(major, '7')
+        self.assertEqual(distribution, ES_DISTRIBUTION)
+
+        major, distribution = ElasticSearch.get_instance(es_con, insecure=False)
+        self.assertEqual(major, '7')
+        self.assertEqual(len(requests_count), 1)
+
     @httpretty.activate
     def test_check_instance_es_major_error(self):
         """Test whether an exception is thrown when the ElasticSearch version number is not retrieved"""
@@ -271,6 +302,29 @@ class TestElastic(unittest.TestCase):
 
         self.assertDictEqual(aliases, expected_aliases)
 
+    def test_init_configured(self):
+        """Test whether an index already configured is not configured again"""
+
+        ElasticSearch(self.es_con, self.target_index, GitOcean.mapping, aliases=["A", "B"])
+
+        with self.assertLogs(logger, level='DEBUG') as cm:
+            elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping, aliases=["A", "B"])
+            self.assertRegex(cm.output[-1], 'DEBUG:grimoire_elk.elastic:Index .* already configured')
+
+        r = elastic.requests.get(elastic.index_url + '/_alias')
+        aliases = r.json()[self.target_index]['aliases']
+        self.assertDictEqual(aliases, {'A': {}, 'B': {}})
+
+        # A different configuration is applied
+        with self.assertLogs(logger, level='DEBUG') as cm:
+            ElasticSearch(self.es_con, self.target_index, GitOcean.mapping, aliases=["A", "B", "C"])
+            for output in cm.output:
+                self.assertNotRegex(output, 'already configured')
+
+        r = elastic.requests.get(elastic.index_url + '/_alias')
+        aliases = r.json()[self.target_index]['aliases']
+        self.assertDictEqual(aliases, {'A': {}, 'B': {}, 'C': {}})
+
     def test_safe_index(self):
         """Test whether the index name is correctly defined"""
 
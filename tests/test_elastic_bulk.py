@@ -0,0 +1,613 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import httpretty
+
+from grimoire_elk.errors import ElasticError
+from grimoire_elk.elastic_bulk import BulkWriter, replay_dead_letter
+from grimoire_elk.enriched.utils import grimoire_con
+
+from mocks import MockElasticSearch
+
+ES_URL = "http://es.example.com"
+INDEX = "bulk_test"
+BULK_URL = ES_URL + "/" + INDEX + "/_bulk"
+SETTINGS_URL = ES_URL + "/" + INDEX + "/_settings"
+REFRESH_URL = ES_URL + "/" + INDEX + "/_refresh"
+
+
+class BulkServer:
+    """Reply to bulk requests acknowledging all the documents"""
+
+    def __init__(self):
+        self.bodies = []
+
+    def __call__(self, request, uri, response_headers):
+        self.bodies.append(request.body)
+        return bulk_response(request, response_headers)
+
+
+def bulk_response(request, response_headers):
+    lines = request.body.decode('utf-8').splitlines()
+    items = []
+    for line in lines[::2]:
+        action, meta = list(json.loads(line).items())[0]
+        items.append({action: {"_id": meta['_id'], "status": 200 if action == 'update' else 201}})
+    body = {"took": 1, "errors": False, "items": items}
+    return [200, response_headers, json.dumps(body)]
+
+
+class TestBulkWriter(unittest.TestCase):
+    """BulkWriter tests"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    def test_encode_document(self):
+        """Test whether documents are encoded to UTF-8 and invalid characters removed"""
+
+        doc = {"subject": "café"}
+        data = BulkWriter.encode_document(doc)
+        self.assertIn('"café"'.encode('utf-8'), data)
+        self.assertDictEqual(json.loads(data), {"subject": "café"})
+
+        doc = {"subject": "bad\udc80 char"}
+        self.assertDictEqual(json.loads(BulkWriter.encode_document(doc)), {"subject": "bad char"})
+
+    @httpretty.activate
+    def test_add(self):
+        """Test whether documents are uploaded when the writer is closed"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        writer = BulkWriter(self.elastic)
+        writer.add({"uuid": "1"}, "1")
+        writer.add({"uuid": "2", "subject": "bad\udc80"}, "2")
+
+        self.assertEqual(len(server.bodies), 0)
+
+        total = writer.close()
+        self.assertEqual(total, 2)
+
+        self.assertEqual(len(server.bodies), 1)
+
+        lines = server.bodies[0].decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertDictEqual(json.loads(lines[0]), {"index": {"_id": "1"}})
+        self.assertDictEqual(json.loads(lines[3]), {"uuid": "2", "subject": "bad"})
+
+    @httpretty.activate
+    def test_add_max_bytes(self):
+        """Test whether bulk requests are bounded by the byte budget"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        self.elastic.max_bytes_bulk = 150
+        with BulkWriter(self.elastic) as writer:
+            for i in range(5):
+                writer.add({"uuid": str(i), "data": "x" * 50}, str(i))
+
+        self.assertEqual(writer.total, 5)
+
+        self.assertEqual(len(server.bodies), 5)
+        for body in server.bodies:
+            self.assertLessEqual(len(body), 150)
+
+    @httpretty.activate
+    def test_add_max_items(self):
+        """Test whether bulk requests are bounded by the number of items"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        self.elastic.max_items_bulk = 2
+        with BulkWriter(self.elastic) as writer:
+            for i in range(5):
+                writer.add({"uuid": str(i)}, str(i))
+
+        self.assertEqual(writer.total, 5)
+        self.assertEqual(len(server.bodies), 3)
+
+    @httpretty.activate
+    def test_add_compressed(self):
+        """Test whether bulk requests are compressed with gzip"""
+
+        bodies = []
+
+        def compressed_callback(request, uri, response_headers):
+            self.assertEqual(request.headers['Content-Encoding'], 'gzip')
+            request.body = gzip.decompress(request.body)
+            bodies.append(request.body)
+            return bulk_response(request, response_headers)
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=compressed_callback)
+
+        self.elastic.requests = grimoire_con(compress_level=6)
+        with BulkWriter(self.elastic) as writer:
+            for i in range(50):
+                writer.add({"uuid": str(i), "data": "x" * 50}, str(i))
+
+        self.assertEqual(writer.total, 50)
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(len(bodies[0].splitlines()), 100)
+
+    @httpretty.activate
+    def test_close_empty(self):
+        """Test whether no request is sent when there are no documents"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        writer = BulkWriter(self.elastic)
+        self.assertEqual(writer.close(), 0)
+        self.assertEqual(len(server.bodies), 0)
+
+    def test_inflight_ordered_ack(self):
+        """Test whether concurrent bulks are acknowledged in the order they were sent"""
+
+        elastic = SlowElasticSearch(ES_URL, INDEX)
+        elastic.max_items_bulk = 1
+        elastic.max_inflight_bulks = 3
+
+        watermarks = []
+        writer = BulkWriter(elastic, on_watermark=watermarks.append)
+        writer.add({"uuid": "0"}, "0", marker="2023-01-01")
+        writer.add({"uuid": "1"}, "1", marker="2023-01-02")
+        writer.add({"uuid": "2"}, "2", marker="2023-01-03")
+        writer.add({"uuid": "3"}, "3", marker="2023-01-04")
+
+        # Three bulks in flight and the last document still pending
+        self.assertEqual(len(writer.inflight), 3)
+        self.assertEqual(writer.current, 1)
+
+        total = writer.close()
+        self.assertEqual(total, 4)
+        self.assertEqual(writer.watermark, "2023-01-04")
+        self.assertListEqual(watermarks, ["2023-01-01", "2023-01-02", "2023-01-03", "2023-01-04"])
+
+        # The first bulk was the slowest one, it finished after the ones sent with it
+        self.assertListEqual(elastic.finished, [2, 1, 0, 3])
+        self.assertIsNone(writer.executor)
+
+    @httpretty.activate
+    def test_skip(self):
+        """Test whether the skipped documents move the watermark after the documents added before"""
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=BulkServer())
+
+        watermarks = []
+        writer = BulkWriter(self.elastic, on_watermark=watermarks.append)
+
+        # Nothing pending, the watermark moves right away
+        writer.skip(marker="2023-01-01")
+        self.assertListEqual(watermarks, ["2023-01-01"])
+
+        # The marker waits for the pending documents
+        writer.add({"uuid": "1"}, "1", marker="2023-01-02")
+        writer.skip(marker="2023-01-03")
+        writer.skip()
+        self.assertListEqual(watermarks, ["2023-01-01"])
+
+        writer.close()
+        self.assertListEqual(watermarks, ["2023-01-01", "2023-01-03"])
+        self.assertEqual(writer.total, 1)
+        self.assertEqual(writer.skipped, 3)
+
+    def test_skip_inflight(self):
+        """Test whether the skipped documents are acknowledged after the bulks in flight"""
+
+        elastic = SlowElasticSearch(ES_URL, INDEX)
+        elastic.max_items_bulk = 1
+        elastic.max_inflight_bulks = 3
+
+        watermarks = []
+        writer = BulkWriter(elastic, on_watermark=watermarks.append)
+        writer.add({"uuid": "0"}, "0", marker="2023-01-01")
+        writer.add({"uuid": "1"}, "1", marker="2023-01-02")
+        writer.flush()
+        writer.skip(marker="2023-01-03")
+        writer.skip(marker="2023-01-04")
+        writer.add({"uuid": "2"}, "2", marker="2023-01-05")
+
+        # Consecutive skipped documents share the same entry
+        self.assertEqual(len(writer.inflight), 3)
+
+        writer.close()
+        self.assertListEqual(watermarks, ["2023-01-01", "2023-01-02", "2023-01-04", "2023-01-05"])
+
+    @httpretty.activate
+    def test_create_existing(self):
+        """Test whether the documents created before aren't failures"""
+
+        def bulk_callback(request, uri, headers):
+            lines = request.body.decode('utf-8').splitlines()
+            items = []
+            for line in lines[::2]:
+                doc_id = json.loads(line)['create']['_id']
+                if doc_id == "1":
+                    items.append({"create": {"_id": doc_id, "status": 409,
+                                             "error": {"type": "version_conflict_engine_exception"}}})
+                else:
+                    items.append({"create": {"_id": doc_id, "status": 201}})
+            return 200, headers, json.dumps({"errors": True, "items": items})
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_callback)
+
+        with BulkWriter(self.elastic) as writer:
+            for i in range(3):
+                writer.create({"uuid": str(i)}, str(i))
+
+        self.assertEqual(writer.total, 2)
+        self.assertEqual(writer.existing, 1)
+        self.assertEqual(writer.failed, 0)
+
+    def test_retry_rejected(self):
+        """Test whether only the rejected documents are retried"""
+
+        elastic = RejectingElasticSearch(ES_URL, INDEX)
+        elastic.retry_delay_bulk = 0
+        elastic.rejections = {"1": 2}
+
+        with BulkWriter(elastic) as writer:
+            for i in range(3):
+                writer.add({"uuid": str(i)}, str(i))
+
+        self.assertEqual(writer.total, 3)
+        self.assertEqual(writer.failed, 0)
+        self.assertListEqual(elastic.bulks, [3, 1, 1])
+
+    def test_adaptive_size(self):
+        """Test whether the bulk size shrinks on rejections and grows again later"""
+
+        elastic = RejectingElasticSearch(ES_URL, INDEX)
+        elastic.retry_delay_bulk = 0
+        elastic.max_items_bulk = 8
+        elastic.rejections = {"0": 1}
+
+        writer = BulkWriter(elastic)
+        for i in range(8):
+            writer.add({"uuid": str(i)}, str(i))
+        writer.flush()
+
+        self.assertEqual(writer.bulk_items, 4)
+
+        for i in range(8, 12):
+            writer.add({"uuid": str(i)}, str(i))
+        writer.flush()
+
+        self.assertEqual(writer.bulk_items, 5)
+        self.assertEqual(writer.close(), 12)
+        self.assertListEqual(elastic.bulks, [8, 1, 4])
+
+    def test_dead_letter(self):
+        """Test whether the documents failing for good are stored and can be replayed"""
+
+        elastic = RejectingElasticSearch(ES_URL, INDEX)
+        elastic.retry_delay_bulk = 0
+        elastic.max_retries_bulk = 1
+        elastic.rejections = {"1": 5}
+
+        with tempfile.TemporaryDirectory() as tmp_path:
+            elastic.dead_letter_path = os.path.join(tmp_path, 'dead_letter.json')
+
+            with BulkWriter(elastic) as writer:
+                writer.add({"uuid": "0"}, "0")
+                writer.add({"uuid": "1"}, "1")
+                writer.add({"uuid": "2", "invalid": True}, "2")
+
+            self.assertEqual(writer.total, 1)
+            self.assertEqual(writer.failed, 2)
+
+            with open(elastic.dead_letter_path) as fd:
+                letters = [json.loads(line) for line in fd]
+
+            self.assertEqual(len(letters), 2)
+            self.assertDictEqual(letters[0]['action'], {"index": {"_id": "2"}})
+            self.assertEqual(letters[0]['error']['type'], "mapper_parsing_exception")
+            self.assertDictEqual(letters[1]['document'], {"uuid": "1"})
+            self.assertEqual(letters[1]['status'], 429)
+
+            # The rejected document is uploaded, the invalid one fails again
+            elastic.rejections = {}
+            replayed = replay_dead_letter(elastic, elastic.dead_letter_path)
+            self.assertEqual(replayed, 1)
+
+
+class SlowElasticSearch(MockElasticSearch):
+    """Upload bulks taking less time for the later ones"""
+
+    def __init__(self, url, index):
+        super().__init__(url, index)
+        self.lock = threading.Lock()
+        self.finished = []
+
+    def put_bulk(self, url, bulk_json):
+        doc_id = json.loads(bulk_json.splitlines()[0])['index']['_id']
+        time.sleep(0.2 / (int(doc_id) + 1))
+        with self.lock:
+            self.finished.append(int(doc_id))
+        return {"errors": False, "items": [{"index": {"_id": doc_id, "status": 201}}]}
+
+
+class RejectingElasticSearch(MockElasticSearch):
+    """Reject or fail the documents according to their content"""
+
+    def __init__(self, url, index):
+        super().__init__(url, index)
+        self.rejections = {}
+        self.bulks = []
+
+    def put_bulk(self, url, bulk_json):
+        lines = bulk_json.splitlines()
+        self.bulks.append(len(lines) // 2)
+
+        items = []
+        for action, doc in zip(lines[::2], lines[1::2]):
+            doc_id = json.loads(action)['index']['_id']
+            doc = json.loads(doc)
+            if doc.get('invalid'):
+                result = {"status": 400, "error": {"type": "mapper_parsing_exception"}}
+            elif self.rejections.get(doc_id, 0) > 0:
+                self.rejections[doc_id] -= 1
+                result = {"status": 429, "error": {"type": "es_rejected_execution_exception"}}
+            else:
+                result = {"status": 201}
+            result['_id'] = doc_id
+            items.append({"index": result})
+
+        errors = any('error' in item['index'] for item in items)
+        return {"errors": errors, "items": items}
+
+
+class TestBulkLoad(unittest.TestCase):
+    """Refresh policy and bulk load mode tests"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX)
+        self.settings = []
+        self.refreshes = 0
+
+    def register_settings(self):
+        """Register the settings and refresh endpoints of the index"""
+
+        def settings_callback(request, uri, response_headers):
+            if request.method == 'PUT':
+                self.settings.append(json.loads(request.body)['index'])
+                return [200, response_headers, '{"acknowledged": true}']
+            body = {INDEX: {"settings": {"index": {"number_of_replicas": "1", "refresh_interval": "5s"}}}}
+            return [200, response_headers, json.dumps(body)]
+
+        def refresh_callback(request, uri, response_headers):
+            self.refreshes += 1
+            return [200, response_headers, '{}']
+
+        httpretty.register_uri(httpretty.GET, SETTINGS_URL, body=settings_callback)
+        httpretty.register_uri(httpretty.PUT, SETTINGS_URL, body=settings_callback)
+        httpretty.register_uri(httpretty.POST, REFRESH_URL, body=refresh_callback)
+
+    def test_refresh_param(self):
+        """Test whether the refresh policy is applied to bulk requests"""
+
+        self.assertEqual(self.elastic.get_refresh_param(), '?refresh=true')
+
+        self.elastic.refresh_policy = 'wait_for'
+        self.assertEqual(self.elastic.get_refresh_param(), '?refresh=wait_for')
+
+        self.elastic.refresh_policy = 'none'
+        self.assertEqual(self.elastic.get_refresh_param(), '')
+
+        self.elastic.refresh_policy = 'end'
+        self.assertEqual(self.elastic.get_refresh_param(), '')
+
+    @httpretty.activate
+    def test_refresh_param_encoding_error(self):
+        """Test whether the refresh policy is applied when the bulk is encoded again with iso-8859-1"""
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body='{"errors": false, "items": []}')
+
+        self.elastic.refresh_policy = 'wait_for'
+        bulk_json = '{"index": {"_id": "1"}}\n{"subject": "\u20ac"}\n'
+        self.elastic.put_bulk(BULK_URL, bulk_json)
+
+        self.assertDictEqual(httpretty.last_request().querystring, {"refresh": ["wait_for"]})
+        self.assertNotIn(b"\xe2", httpretty.last_request().body)
+
+    @httpretty.activate
+    def test_refresh_end(self):
+        """Test whether the index is refreshed once when the writer is closed"""
+
+        self.register_settings()
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        self.elastic.refresh_policy = 'end'
+        self.elastic.max_items_bulk = 1
+        with BulkWriter(self.elastic) as writer:
+            writer.add({"uuid": "1"}, "1")
+            writer.add({"uuid": "2"}, "2")
+
+        self.assertEqual(len(server.bodies), 2)
+        self.assertEqual(self.refreshes, 1)
+
+    @httpretty.activate
+    def test_bulk_load(self):
+        """Test whether the index settings are restored after a bulk load"""
+
+        self.register_settings()
+        self.elastic.new_index = True
+        with self.elastic.bulk_load():
+            self.assertTrue(self.elastic.bulk_loading)
+
+        self.assertFalse(self.elastic.bulk_loading)
+        self.assertListEqual(self.settings, [{"refresh_interval": "-1", "number_of_replicas": 0},
+                                             {"refresh_interval": "5s", "number_of_replicas": "1"}])
+        self.assertEqual(self.refreshes, 1)
+
+    @httpretty.activate
+    def test_bulk_load_existing_index(self):
+        """Test whether the replicas of an index not created by this object are kept"""
+
+        self.register_settings()
+        with self.elastic.bulk_load():
+            self.assertTrue(self.elastic.bulk_loading)
+
+        self.assertListEqual(self.settings, [{"refresh_interval": "-1"}, {"refresh_interval": "5s"}])
+        self.assertEqual(self.refreshes, 1)
+
+    @httpretty.activate
+    def test_bulk_load_error(self):
+        """Test whether the index settings are restored when the bulk load fails"""
+
+        self.register_settings()
+        with self.assertRaises(ValueError):
+            with self.elastic.bulk_load():
+                raise ValueError("failed")
+
+        self.assertFalse(self.elastic.bulk_loading)
+        self.assertEqual(len(self.settings), 2)
+        self.assertEqual(self.refreshes, 1)
+
+
+class TestBulkUpdate(unittest.TestCase):
+    """Partial and scripted updates tests"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    @staticmethod
+    def read_actions(body):
+        lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        return list(zip(lines[::2], lines[1::2]))
+
+    @httpretty.activate
+    def test_bulk_update(self):
+        """Test whether only the given fields of the documents are updated"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        docs = [
+            {"uuid": "1", "author_min_date": "2020-01-01", "title": "first"},
+            {"uuid": "2", "author_min_date": "2021-01-01", "title": "second"}
+        ]
+        updated = self.elastic.bulk_update(docs, ["author_min_date"])
+        self.assertEqual(updated, 2)
+
+        actions = self.read_actions(server.bodies[0])
+        self.assertDictEqual(actions[0][0], {"update": {"_id": "1", "retry_on_conflict": 5}})
+        self.assertDictEqual(actions[0][1], {"doc": {"author_min_date": "2020-01-01"}})
+        self.assertDictEqual(actions[1][0], {"update": {"_id": "2", "retry_on_conflict": 5}})
+        self.assertDictEqual(actions[1][1], {"doc": {"author_min_date": "2021-01-01"}})
+
+        self.elastic.bulk_update(docs[:1], ["title"], doc_as_upsert=True)
+        actions = self.read_actions(server.bodies[1])
+        self.assertDictEqual(actions[0][1], {"doc": {"title": "first"}, "doc_as_upsert": True})
+
+    @httpretty.activate
+    def test_bulk_script_update(self):
+        """Test whether the documents are updated with a stored script"""
+
+        server = BulkServer()
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=server)
+
+        self.elastic.max_items_bulk = 2
+        params = {"geo_lat": 40.4, "geo_lon": -3.7}
+        updated = self.elastic.bulk_script_update(["1", "2", "3"], "add_geo_point", params)
+        self.assertEqual(updated, 3)
+        self.assertEqual(len(server.bodies), 2)
+
+        actions = self.read_actions(server.bodies[0]) + self.read_actions(server.bodies[1])
+        self.assertListEqual([action["update"]["_id"] for action, _ in actions], ["1", "2", "3"])
+        for _, update in actions:
+            self.assertDictEqual(update, {"script": {"id": "add_geo_point", "params": params}})
+
+        self.elastic.bulk_script_update(["4"], "add_geo_point", scripted_upsert=True)
+        actions = self.read_actions(server.bodies[2])
+        self.assertDictEqual(actions[0][1], {"script": {"id": "add_geo_point", "params": {}},
+                                             "scripted_upsert": True, "upsert": {}})
+
+    @httpretty.activate
+    def test_bulk_script_update_routing(self):
+        """Test whether the updates target the shard and backing index of each document"""
+
+        server = BulkServer()
+        searches = []
+
+        def search_callback(request, uri, headers):
+            searches.append(json.loads(request.body))
+            hits = [{"_index": INDEX + "-2023.01", "_id": "1", "_routing": "https://a.example.com"},
+                    {"_index": INDEX + "-2023.02", "_id": "2", "_routing": "https://b.example.com"}]
+            return 200, headers, json.dumps({"hits": {"hits": hits}})
+
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/_bulk", body=server)
+        httpretty.register_uri(httpretty.POST, ES_URL + "/" + INDEX + "/_search", body=search_callback)
+
+        self.elastic.routing_field = "origin"
+        self.elastic.partitioned = True
+        self.elastic.date_field = "metadata__timestamp"
+
+        updated = self.elastic.bulk_script_update(["1", "2", "3"], "add_geo_point", scripted_upsert=True)
+        self.assertEqual(updated, 3)
+        self.assertListEqual(searches[0]['query']['ids']['values'], ["1", "2", "3"])
+
+        actions = [action["update"] for action, _ in self.read_actions(server.bodies[0])]
+        self.assertDictEqual(actions[0], {"_id": "1", "_index": INDEX + "-2023.01",
+                                          "routing": "https://a.example.com", "retry_on_conflict": 5})
+        self.assertDictEqual(actions[1], {"_id": "2", "_index": INDEX + "-2023.02",
+                                          "routing": "https://b.example.com", "retry_on_conflict": 5})
+
+        # The documents not found are created where they would be uploaded
+        self.assertEqual(actions[2]["_index"], self.elastic.get_partition({}))
+        self.assertEqual(actions[2]["routing"], "3")
+
+        # Updates of documents with new values are routed as them if they aren't found
+        self.elastic.bulk_update([{"uuid": "4", "origin": "https://c.example.com",
+                                   "metadata__timestamp": "2023-03-01T00:00:00+00:00"}],
+                                 ["metadata__timestamp"], doc_as_upsert=True)
+        action = self.read_actions(server.bodies[1])[0][0]["update"]
+        self.assertEqual(action["_index"], INDEX + "-2023.03")
+        self.assertEqual(action["routing"], "https://c.example.com")
+
+    @httpretty.activate
+    def test_put_script(self):
+        """Test whether scripts are stored in the cluster"""
+
+        script_url = ES_URL + "/_scripts/add_geo_point"
+        httpretty.register_uri(httpretty.PUT, script_url, body='{"acknowledged": true}')
+
+        self.elastic.put_script("add_geo_point", "ctx._source.geo = params.geo_lat")
+        self.assertDictEqual(json.loads(httpretty.last_request().body),
+                             {"script": {"lang": "painless", "source": "ctx._source.geo = params.geo_lat"}})
+
+        httpretty.register_uri(httpretty.PUT, script_url, status=400, body='{"error": "compile error"}')
+        with self.assertRaises(ElasticError):
+            self.elastic.put_script("add_geo_point", "ctx._source.geo = ")
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
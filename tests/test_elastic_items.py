@@ -23,12 +23,16 @@ import configparser
 import logging
 import json
 import os
+import threading
 import unittest
 
+import httpretty
 import requests
 
+from grimoire_elk import elastic as elastic_module
 from grimoire_elk.elastic import ElasticSearch
 from grimoire_elk.elastic_items import (ElasticItems,
+                                        MAX_SHARD_DOC,
                                         logger)
 from grimoirelab_toolkit.datetime import str_to_datetime
 from grimoire_elk.raw.kitsune import KitsuneOcean
@@ -40,6 +44,8 @@ from perceval.backends.core.git import Git
 from perceval.backends.core.confluence import Confluence
 from perceval.backends.core.meetup import Meetup
 
+from mocks import MockElasticSearch
+
 
 CONFIG_FILE = 'tests.conf'
 
@@ -556,6 +562,246 @@ class TestElasticItems(unittest.TestCase):
             self.assertRegex(cm.output[-1], 'DEBUG:grimoire_elk.elastic_items:No results found from*')
 
 
+ES_URL = "http://localhost:9200"
+INDEX = "pit_test"
+INDEX_URL = ES_URL + "/" + INDEX
+
+
+class TestElasticItemsPit(unittest.TestCase):
+    """Unit tests for the reading of items with point in time"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX)
+        self.items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(5)]
+        self.searches = []
+        self.closed = []
+
+    def tearDown(self):
+        elastic_module._versions_cache.clear()
+
+    def search(self, query):
+        """Return the page of items of a search with point in time"""
+
+        self.searches.append(query)
+        start = int(query['search_after'][1]) + 1 if 'search_after' in query else 0
+        slice_ = query.get('slice', {"id": 0, "max": 1})
+        hits = [{"_source": item, "sort": [item["metadata__timestamp"], i]}
+                for i, item in enumerate(self.items)
+                if i >= start and i % slice_['max'] == slice_['id']][:query['size']]
+        return {"pit_id": "pit-{}".format(len(self.searches)), "hits": {"hits": hits}}
+
+    def register_cluster(self, version):
+        def search_callback(request, uri, headers):
+            return 200, headers, json.dumps(self.search(json.loads(request.body)))
+
+        def close_callback(request, uri, headers):
+            self.closed.append(json.loads(request.body)['id'])
+            return 200, headers, '{"succeeded": true}'
+
+        httpretty.register_uri(httpretty.GET, ES_URL + "/", body=json.dumps({"version": {"number": version}}))
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_pit", body='{"id": "pit-0"}')
+        httpretty.register_uri(httpretty.POST, ES_URL + "/_search", body=search_callback)
+        httpretty.register_uri(httpretty.DELETE, ES_URL + "/_pit", body=close_callback)
+
+    @httpretty.activate
+    def test_fetch_pit(self):
+        """Test whether items are read with point in time and search_after"""
+
+        self.register_cluster("7.17.0")
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.scroll_size = 2
+
+        items = [item['uuid'] for item in eitems.fetch()]
+        self.assertListEqual(items, ["0", "1", "2", "3", "4"])
+        self.assertListEqual(eitems.search_after, ["2023-01-05", 4])
+
+        self.assertEqual(len(self.searches), 3)
+        self.assertDictEqual(self.searches[0]['pit'], {"id": "pit-0", "keep_alive": "10m"})
+        self.assertListEqual(self.searches[0]['sort'],
+                             [{"metadata__timestamp": {"order": "asc"}}, {"_shard_doc": "asc"}])
+        self.assertNotIn('search_after', self.searches[0])
+        self.assertDictEqual(self.searches[1]['pit'], {"id": "pit-1", "keep_alive": "10m"})
+        self.assertListEqual(self.searches[1]['search_after'], ["2023-01-02", 1])
+        self.assertListEqual(self.searches[2]['search_after'], ["2023-01-04", 3])
+        self.assertListEqual(self.closed, ["pit-3"])
+
+    @httpretty.activate
+    def test_fetch_pit_search_after(self):
+        """Test whether the reading is resumed from the given sort values"""
+
+        self.register_cluster("8.6.0")
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+
+        items = [item['uuid'] for item in eitems.fetch(search_after=["2023-01-03", 2])]
+        self.assertListEqual(items, ["3", "4"])
+        self.assertListEqual(self.searches[0]['search_after'], ["2023-01-03", 2])
+        self.assertEqual(len(self.closed), 1)
+
+    @httpretty.activate
+    def test_fetch_sliced(self):
+        """Test whether items are read in parallel slices with a safe watermark"""
+
+        self.register_cluster("7.17.0")
+        self.items = [{"uuid": str(i), "metadata__timestamp": "2023-01-{:02d}".format(i + 1)} for i in range(20)]
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.scroll_size = 3
+
+        # httpretty is not thread safe, the slices search without HTTP requests
+        lock = threading.Lock()
+
+        def search_pit(pit_id, search_after=None, slice_=None, **kwargs):
+            query = {"size": eitems.scroll_size, "slice": slice_}
+            if search_after:
+                query['search_after'] = search_after
+            with lock:
+                return self.search(query)
+
+        eitems.get_elastic_items_pit = search_pit
+
+        fetched = []
+        for item in eitems.fetch(slices=3):
+            fetched.append(item['metadata__timestamp'])
+            # All the items until the watermark have been fetched
+            if eitems.watermark:
+                pending = [i["metadata__timestamp"] for i in self.items if i["metadata__timestamp"] not in fetched]
+                self.assertTrue(all(date > eitems.watermark for date in pending))
+
+        self.assertListEqual(sorted(fetched), [item["metadata__timestamp"] for item in self.items])
+        self.assertEqual(eitems.watermark, "2023-01-20")
+
+        self.assertSetEqual({search['slice']['id'] for search in self.searches}, {0, 1, 2})
+        self.assertTrue(all(search['slice']['max'] == 3 for search in self.searches))
+        self.assertEqual(len(self.closed), 1)
+
+    @httpretty.activate
+    def test_fetch_read_ahead(self):
+        """Test whether the pages are read in background ahead of the items processed"""
+
+        self.register_cluster("7.17.0")
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.scroll_size = 2
+        eitems.fetch_read_ahead = 1
+
+        items = [item['uuid'] for item in eitems.fetch()]
+        self.assertListEqual(items, ["0", "1", "2", "3", "4"])
+        self.assertListEqual(eitems.search_after, ["2023-01-05", 4])
+        self.assertEqual(len(self.searches), 3)
+        self.assertListEqual(self.closed, ["pit-3"])
+
+        # The point in time is closed when the reading is interrupted
+        for item in eitems.fetch():
+            break
+        self.assertEqual(item['uuid'], "0")
+        self.assertEqual(len(self.closed), 2)
+
+    @httpretty.activate
+    def test_fetch_tiebreak(self):
+        """Test whether the items are resumed after the sort values stored without `_shard_doc`"""
+
+        self.register_cluster("7.17.0")
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.tiebreak_field = "uuid"
+
+        list(eitems.fetch(search_after=["2023-01-03", 2]))
+        self.assertListEqual(self.searches[0]['sort'],
+                             [{"metadata__timestamp": {"order": "asc"}}, {"uuid": {"order": "asc"}},
+                              {"_shard_doc": "asc"}])
+        self.assertListEqual(self.searches[0]['search_after'], ["2023-01-03", 2, MAX_SHARD_DOC])
+
+    @httpretty.activate
+    def test_fetch_scroll_search_after(self):
+        """Test whether the items until the sort values are skipped when reading with scroll"""
+
+        self.register_cluster("7.10.2")
+        hits = [{"_source": item, "sort": [item["metadata__timestamp"], item["uuid"]]} for item in self.items]
+        page = {"_scroll_id": "scroll-1", "hits": {"total": {"value": 5}, "hits": hits}}
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=json.dumps(page))
+        httpretty.register_uri(httpretty.POST, ES_URL + "/_search/scroll",
+                               body='{"_scroll_id": "scroll-1", "hits": {"hits": []}}')
+        httpretty.register_uri(httpretty.DELETE, ES_URL + "/_search/scroll", body='{}')
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.tiebreak_field = "uuid"
+
+        items = [item['uuid'] for item in eitems.fetch(search_after=["2023-01-02", "1"])]
+        self.assertListEqual(items, ["2", "3", "4"])
+
+        search = [request for request in httpretty.latest_requests() if INDEX + "/_search" in request.path]
+        query = json.loads(search[0].body)
+        self.assertListEqual(query['sort'], [{"metadata__timestamp": {"order": "asc"}}, {"uuid": {"order": "asc"}}])
+
+    @httpretty.activate
+    def test_fetch_scroll_fallback(self):
+        """Test whether items are read with scroll when point in time is not supported"""
+
+        self.register_cluster("7.10.2")
+        page = {"_scroll_id": "scroll-1", "hits": {"total": {"value": 1}, "hits": [{"_source": self.items[0]}]}}
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=json.dumps(page))
+        httpretty.register_uri(httpretty.POST, ES_URL + "/_search/scroll",
+                               body='{"_scroll_id": "scroll-1", "hits": {"hits": []}}')
+        httpretty.register_uri(httpretty.DELETE, ES_URL + "/_search/scroll", body='{}')
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+
+        items = [item['uuid'] for item in eitems.fetch()]
+        self.assertListEqual(items, ["0"])
+        self.assertListEqual(self.searches, [])
+        self.assertFalse(self.elastic.supports_pit())
+
+    @httpretty.activate
+    def test_fetch_source_fields(self):
+        """Test whether only the requested fields of the items are read"""
+
+        self.register_cluster("7.17.0")
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+        eitems.set_source_fields(excludes=["data.body.html"])
+
+        list(eitems.fetch())
+        self.assertDictEqual(self.searches[0]['_source'], {"excludes": ["data.body.html"]})
+
+        list(eitems.fetch(source_includes=["data.commit"]))
+        self.assertDictEqual(self.searches[-1]['_source'],
+                             {"includes": ["data.commit"], "excludes": ["data.body.html"]})
+
+        eitems.set_source_fields()
+        list(eitems.fetch())
+        self.assertNotIn('_source', self.searches[-1])
+
+    @httpretty.activate
+    def test_fetch_source_fields_scroll(self):
+        """Test whether only the requested fields of the items are read with scroll"""
+
+        self.register_cluster("7.10.2")
+        scrolls = []
+
+        def search_callback(request, uri, headers):
+            scrolls.append(json.loads(request.body))
+            return 200, headers, '{"_scroll_id": "scroll-1", "hits": {"total": {"value": 0}, "hits": []}}'
+
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=search_callback)
+        httpretty.register_uri(httpretty.DELETE, ES_URL + "/_search/scroll", body='{}')
+
+        eitems = ElasticItems(Git('http://example.com', '/tmp/foo'))
+        eitems.elastic = self.elastic
+
+        list(eitems.fetch(source_includes=["data.commit"]))
+        self.assertDictEqual(scrolls[0]['_source'], {"includes": ["data.commit"]})
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
     unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import functools
+import json
+import unittest
+
+import httpretty
+import requests
+
+from grimoire_elk import elk
+from grimoire_elk.enriched.enrich import Enrich
+from grimoire_elk.raw.elastic import ElasticOcean
+from perceval.backends.core.git import Git
+
+from mocks import CheckpointServer, MockElasticSearch, MockEnrich, bulk_response
+
+ES_URL = "http://es.example.com"
+INDEX = "git_enriched"
+BULK_URL = ES_URL + "/" + INDEX + "/_bulk"
+RAW_INDEX = "git_raw"
+RAW_BULK_URL = ES_URL + "/" + RAW_INDEX + "/_bulk"
+CHECKPOINTS = "checkpoints"
+ORIGIN = "http://example.com/repo.git"
+
+
+class TestEnrichFedItems(unittest.TestCase):
+    """Tests for the enrichment of the items while they are fed to the raw index"""
+
+    def setUp(self):
+        Enrich.checkpoint_index = CHECKPOINTS
+        self.enrich = MockEnrich()
+        self.enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    def tearDown(self):
+        Enrich.checkpoint_index = None
+
+    @httpretty.activate
+    def test_enrich_fed_items(self):
+        """Test whether the items are enriched while they are fed to the raw index"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        bulks = {RAW_INDEX: [], INDEX: []}
+
+        def bulk_callback(request, uri, headers):
+            index = uri.split('/')[-2]
+            ids = [json.loads(line)['index']['_id'] for line in request.body.decode('utf-8').splitlines()[::2]]
+            bulks[index].extend(ids)
+            return bulk_response(request, uri, headers)
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_callback)
+        httpretty.register_uri(httpretty.PUT, RAW_BULK_URL, body=bulk_callback)
+
+        items = [{"uuid": str(i), "origin": ORIGIN, "updated_on": 1672531200 + i,
+                  "timestamp": 1672617600 + i, "data": {}} for i in range(5)]
+
+        ocean = ElasticOcean(Git(ORIGIN, '/tmp/foo'))
+        ocean.set_elastic(MockElasticSearch(ES_URL, RAW_INDEX))
+        ocean.set_items_consumer(functools.partial(elk.enrich_fed_items,
+                                                   ocean_backend=ocean, enrich_backend=self.enrich))
+        self.enrich.elastic.max_items_bulk = 2
+
+        ocean.feed_items(items)
+
+        self.assertListEqual(bulks[RAW_INDEX], ["0", "1", "2", "3", "4"])
+        self.assertListEqual(bulks[INDEX], ["0", "1", "2", "3", "4"])
+
+        # The enrichment of the raw index resumes after the fed items
+        self.assertEqual(server.saved[-1]['timestamp'], "2023-01-02T00:00:04+00:00")
+        self.assertIsNone(server.saved[-1]['sort'])
+
+    @httpretty.activate
+    def test_enrich_fed_items_error(self):
+        """Test whether all the items are fed to the raw index when their enrichment fails"""
+
+        CheckpointServer(ES_URL, CHECKPOINTS)
+        raw_ids = []
+
+        def bulk_callback(request, uri, headers):
+            lines = request.body.decode('utf-8').splitlines()
+            raw_ids.extend(json.loads(line)['index']['_id'] for line in lines[::2])
+            return bulk_response(request, uri, headers)
+
+        httpretty.register_uri(httpretty.PUT, RAW_BULK_URL, body=bulk_callback)
+
+        def fail(items, ocean_backend):
+            next(items)
+            raise ValueError("Can't enrich")
+
+        items = [{"uuid": str(i), "origin": ORIGIN, "updated_on": 1672531200 + i,
+                  "timestamp": 1672617600 + i, "data": {}} for i in range(5)]
+
+        ocean = ElasticOcean(Git(ORIGIN, '/tmp/foo'))
+        ocean.set_elastic(MockElasticSearch(ES_URL, RAW_INDEX))
+        ocean.set_items_consumer(functools.partial(fail, ocean_backend=ocean))
+
+        with self.assertLogs('grimoire_elk.raw.elastic', level='ERROR'):
+            ocean.feed_items(items)
+
+        self.assertListEqual(raw_ids, ["0", "1", "2", "3", "4"])
+
+    @httpretty.activate
+    def test_feed_error(self):
+        """Test whether the errors of the backend are raised and not taken as errors of the consumer"""
+
+        CheckpointServer(ES_URL, CHECKPOINTS)
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_response)
+        httpretty.register_uri(httpretty.PUT, RAW_BULK_URL, body=bulk_response)
+
+        def fetch():
+            for i in range(3):
+                yield {"uuid": str(i), "origin": ORIGIN, "updated_on": 1672531200 + i,
+                       "timestamp": 1672617600 + i, "data": {}}
+            raise requests.exceptions.ConnectionError("Connection lost")
+
+        ocean = ElasticOcean(Git(ORIGIN, '/tmp/foo'))
+        ocean.set_elastic(MockElasticSearch(ES_URL, RAW_INDEX))
+        ocean.set_items_consumer(functools.partial(elk.enrich_fed_items,
+                                                   ocean_backend=ocean, enrich_backend=self.enrich))
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            ocean.feed_items(fetch())
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk.enriched.enrich import Enrich
+
+from mocks import CheckpointServer, MockElasticSearch, MockEnrich, MockOcean, bulk_response
+
+ES_URL = "http://es.example.com"
+INDEX = "git_enriched"
+BULK_URL = ES_URL + "/" + INDEX + "/_bulk"
+MGET_URL = ES_URL + "/" + INDEX + "/_mget"
+CHECKPOINTS = "checkpoints"
+ORIGIN = "http://example.com/repo.git"
+
+
+class TestEnrichImmutable(unittest.TestCase):
+    """Tests for the skipping of the immutable items already enriched"""
+
+    def setUp(self):
+        Enrich.checkpoint_index = CHECKPOINTS
+        self.enrich = MockEnrich()
+        self.enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    def tearDown(self):
+        Enrich.checkpoint_index = None
+
+    @httpretty.activate
+    def test_skip_immutable(self):
+        """Test whether the immutable items already enriched by this version aren't enriched again"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        bulks = []
+
+        def bulk_callback(request, uri, headers):
+            bulks.append(request.body)
+            return bulk_response(request, uri, headers)
+
+        stored = {"0": self.enrich.gelk_version, "1": "0.0.1", "2": self.enrich.gelk_version}
+
+        def mget_response(request, uri, headers):
+            ids = [doc['_id'] for doc in json.loads(request.body)['docs']]
+            docs = [{"_id": doc_id, "found": True, "_source": {"metadata__gelk_version": stored[doc_id]}}
+                    for doc_id in ids if doc_id in stored]
+            return 200, headers, json.dumps({"docs": docs})
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_callback)
+        httpretty.register_uri(httpretty.POST, MGET_URL, body=mget_response)
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(4)]
+        self.enrich.elastic.max_items_bulk = 3
+        self.enrich.immutable_items = True
+        Enrich.skip_immutable = True
+        try:
+            self.assertEqual(self.enrich.enrich_items(MockOcean(items, ORIGIN)), 2)
+        finally:
+            Enrich.skip_immutable = False
+
+        ids = [json.loads(line)['index']['_id'] for body in bulks for line in body.decode('utf-8').splitlines()[::2]]
+        self.assertListEqual(ids, ["1", "3"])
+        self.assertEqual(server.saved[-1]['timestamp'], "2023-01-04")
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
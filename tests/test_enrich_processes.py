@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import random
+import time
+import unittest
+
+from grimoire_elk.enriched.enrich import Enrich
+
+
+class MockEnrich(Enrich):
+    """Enrich the items in a random time, recording the process"""
+
+    def get_rich_item(self, item):
+        if item['uuid'] == 'error':
+            raise ValueError("Wrong item")
+        time.sleep(random.random() / 100)
+        return {"uuid": item["uuid"], "pid": os.getpid(), "project": self.prjs_map['git'][item['origin']]}
+
+    def get_rich_events(self, item):
+        for i in range(int(item['uuid']) % 3):
+            yield {"uuid": item["uuid"], "id": str(i)}
+
+    def get_field_event_unique_id(self):
+        return "id"
+
+
+class TestEnrichProcesses(unittest.TestCase):
+    """Tests for the enrichment of the items in several processes"""
+
+    def setUp(self):
+        self.enrich = MockEnrich()
+        self.enrich.prjs_map = {'git': {"https://example.com/repo.git": "Main"}}
+        self.enrich.enrich_processes = 3
+        self.enrich.scroll_size = 4
+        self.items = [{"uuid": str(i), "origin": "https://example.com/repo.git"} for i in range(50)]
+
+    def test_iter_rich_docs(self):
+        """Test whether the items are enriched by the workers and returned in order"""
+
+        markers = ((item, i) for i, item in enumerate(self.items))
+        results = list(self.enrich.iter_rich_docs(markers))
+
+        self.assertListEqual([marker for _, marker, _ in results], list(range(50)))
+        self.assertListEqual([docs[0][1] for _, _, docs in results], [str(i) for i in range(50)])
+
+        # The state of the enricher is available in the workers
+        docs = [docs[0][0] for _, _, docs in results]
+        self.assertTrue(all(doc['project'] == "Main" for doc in docs))
+        self.assertNotIn(os.getpid(), {doc['pid'] for doc in docs})
+
+    def test_iter_rich_events(self):
+        """Test whether the events of the items keep their ids"""
+
+        results = list(self.enrich.iter_rich_docs(((item, None) for item in self.items[:5]), events=True))
+
+        ids = [[doc_id for _, doc_id in docs] for _, _, docs in results]
+        self.assertListEqual(ids, [[], ["1_0"], ["2_0", "2_1"], [], ["4_0"]])
+
+    def test_main_process(self):
+        """Test whether the items are enriched in the main process by default"""
+
+        self.enrich.enrich_processes = 0
+        results = list(self.enrich.iter_rich_docs(((item, None) for item in self.items[:3])))
+
+        self.assertSetEqual({docs[0][0]['pid'] for _, _, docs in results}, {os.getpid()})
+
+    def test_worker_error(self):
+        """Test whether the errors of the workers are raised"""
+
+        items = self.items[:10] + [{"uuid": "error"}]
+
+        with self.assertRaises(ValueError):
+            list(self.enrich.iter_rich_docs((item, None) for item in items))
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk.enriched.enrich import CONTENT_HASH, Enrich
+
+from mocks import CheckpointServer, MockElasticSearch, MockEnrich, MockOcean, bulk_response
+
+ES_URL = "http://es.example.com"
+INDEX = "git_enriched"
+BULK_URL = ES_URL + "/" + INDEX + "/_bulk"
+MGET_URL = ES_URL + "/" + INDEX + "/_mget"
+CHECKPOINTS = "checkpoints"
+ORIGIN = "http://example.com/repo.git"
+
+
+class TestEnrichUnchanged(unittest.TestCase):
+    """Tests for the skipping of the enriched items whose content didn't change"""
+
+    def setUp(self):
+        Enrich.checkpoint_index = CHECKPOINTS
+        self.enrich = MockEnrich()
+        self.enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    def tearDown(self):
+        Enrich.checkpoint_index = None
+
+    @httpretty.activate
+    def test_skip_unchanged(self):
+        """Test whether the items whose content didn't change aren't uploaded"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        bulks = []
+
+        def bulk_callback(request, uri, headers):
+            bulks.append(request.body)
+            return bulk_response(request, uri, headers)
+
+        httpretty.register_uri(httpretty.PUT, BULK_URL, body=bulk_callback)
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(4)]
+        stored = {}
+        for item in items[:3]:
+            eitem = self.enrich.get_rich_item(item)
+            eitem['metadata__enriched_on'] = "2022-01-01T00:00:00+00:00"
+            stored[item['uuid']] = {CONTENT_HASH: self.enrich.get_content_hash(eitem)}
+        # The content of the second item changed
+        stored["1"] = {CONTENT_HASH: "0" * 40}
+
+        def mget_response(request, uri, headers):
+            ids = [doc['_id'] for doc in json.loads(request.body)['docs']]
+            docs = [{"_id": doc_id, "found": doc_id in stored, "_source": stored.get(doc_id)} for doc_id in ids]
+            return 200, headers, json.dumps({"docs": docs})
+
+        httpretty.register_uri(httpretty.POST, MGET_URL, body=mget_response)
+
+        Enrich.skip_unchanged = True
+        try:
+            self.enrich.elastic.max_items_bulk = 10
+            self.assertEqual(self.enrich.enrich_items(MockOcean(items, ORIGIN)), 2)
+        finally:
+            Enrich.skip_unchanged = False
+
+        self.assertEqual(len(bulks), 1)
+        lines = bulks[0].decode('utf-8').splitlines()
+        self.assertListEqual([json.loads(line)['index']['_id'] for line in lines[::2]], ["1", "3"])
+        self.assertIn(CONTENT_HASH, json.loads(lines[1]))
+
+        # The checkpoint covers the skipped items too
+        self.assertEqual(server.saved[-1]['timestamp'], "2023-01-04")
+
+    def test_content_hash(self):
+        """Test whether the content hash ignores the volatile fields"""
+
+        eitem = {"uuid": "1", "title": "ñandú", "metadata__enriched_on": "2023-01-01T00:00:00+00:00"}
+        content_hash = self.enrich.get_content_hash(eitem)
+
+        eitem['metadata__enriched_on'] = "2023-02-01T00:00:00+00:00"
+        eitem[CONTENT_HASH] = content_hash
+        self.assertEqual(self.enrich.get_content_hash(eitem), content_hash)
+
+        eitem['title'] = "nandu"
+        self.assertNotEqual(self.enrich.get_content_hash(eitem), content_hash)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
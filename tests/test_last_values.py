@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk import elastic as elastic_module
+from grimoire_elk.elastic_bulk import BulkWriter
+
+from mocks import MockElasticSearch, bulk_response
+
+ES_URL = "http://es.example.com"
+INDEX = "last_values_test"
+SEARCH_URL = ES_URL + "/" + INDEX + "/_search"
+
+
+class TestLastValues(unittest.TestCase):
+    """Tests for the lookup of the last values of all the origins at once"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX)
+        self.elastic.last_values_ttl = 600
+        self.queries = []
+
+    def tearDown(self):
+        elastic_module._last_values_cache.clear()
+
+    def register_search(self, pages):
+        def search_callback(request, uri, headers):
+            query = json.loads(request.body)
+            self.queries.append(query)
+            return 200, headers, json.dumps(pages[len(self.queries) - 1])
+
+        httpretty.register_uri(httpretty.POST, SEARCH_URL, body=search_callback)
+
+    @httpretty.activate
+    def test_get_last_date(self):
+        """Test whether the dates of all the origins are read in one aggregation"""
+
+        buckets = [
+            {"key": {"origin": "https://a.example.com"},
+             "1": {"value": 1577836800000, "value_as_string": "2020-01-01T00:00:00.000Z"}},
+            {"key": {"origin": "https://b.example.com"},
+             "1": {"value": 1609459200000, "value_as_string": "2021-01-01T00:00:00.000Z"}}
+        ]
+        self.register_search([
+            {"aggregations": {"groups": {"after_key": {"origin": "https://a.example.com"}, "buckets": buckets[:1]}}},
+            {"aggregations": {"groups": {"after_key": {"origin": "https://b.example.com"}, "buckets": buckets[1:]}}},
+            {"aggregations": {"groups": {"buckets": []}}}
+        ])
+
+        fltr = {"name": "origin", "value": "https://b.example.com"}
+        last_date = self.elastic.get_last_date("metadata__updated_on", filters_=[fltr])
+        self.assertEqual(last_date.isoformat(), "2021-01-01T00:00:00+00:00")
+
+        self.assertEqual(len(self.queries), 3)
+        composite = self.queries[0]['aggs']['groups']['composite']
+        self.assertListEqual(composite['sources'], [{"origin": {"terms": {"field": "origin"}}}])
+        self.assertNotIn('after', composite)
+        self.assertDictEqual(self.queries[1]['aggs']['groups']['composite']['after'],
+                             {"origin": "https://a.example.com"})
+
+        # The rest of origins are read from the cache
+        fltr = {"name": "origin", "value": "https://a.example.com"}
+        last_date = self.elastic.get_last_date("metadata__updated_on", filters_=[fltr])
+        self.assertEqual(last_date.isoformat(), "2020-01-01T00:00:00+00:00")
+
+        fltr = {"name": "origin", "value": "https://c.example.com"}
+        self.assertIsNone(self.elastic.get_last_date("metadata__updated_on", filters_=[fltr, None]))
+        self.assertEqual(len(self.queries), 3)
+
+    @httpretty.activate
+    def test_get_last_offset(self):
+        """Test whether the offsets are read by every combination of the filters"""
+
+        bucket = {"key": {"origin": "https://a.example.com", "tag": "a"}, "1": {"value": 3.0}}
+        self.register_search([{"aggregations": {"groups": {"buckets": [bucket]}}}])
+
+        fltrs = [{"name": "tag", "value": "a"}, {"name": "origin", "value": "https://a.example.com"}]
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=fltrs), 3)
+
+        sources = self.queries[0]['aggs']['groups']['composite']['sources']
+        self.assertListEqual([list(source) for source in sources], [["origin"], ["tag"]])
+
+    @httpretty.activate
+    def test_cache_disabled(self):
+        """Test whether each origin is queried when the cache is disabled"""
+
+        self.register_search([{"aggregations": {"1": {"value": 3.0}}}] * 2)
+        self.elastic.last_values_ttl = 0
+
+        fltr = {"name": "origin", "value": "https://a.example.com"}
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[fltr]), 3)
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[fltr]), 3)
+
+        self.assertEqual(len(self.queries), 2)
+        self.assertNotIn('groups', self.queries[0].get('aggs', {}))
+
+    @httpretty.activate
+    def test_forget_written_origins(self):
+        """Test whether the origins written to the index are looked up again"""
+
+        def search_callback(request, uri, headers):
+            query = json.loads(request.body)
+            self.queries.append(query)
+            if 'groups' in query['aggs']:
+                buckets = [{"key": {"origin": origin}, "1": {"value": 3.0}} for origin in ["a", "b"]]
+                return 200, headers, json.dumps({"aggregations": {"groups": {"buckets": buckets}}})
+            return 200, headers, json.dumps({"aggregations": {"1": {"value": 5.0}}})
+
+        def bulk_callback(request, uri, headers):
+            lines = request.body.decode('utf-8').splitlines()
+            items = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[::2]]
+            return 200, headers, json.dumps({"errors": False, "items": items})
+
+        httpretty.register_uri(httpretty.POST, SEARCH_URL, body=search_callback)
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/" + INDEX + "/_bulk", body=bulk_callback)
+
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "a"}]), 3)
+
+        with BulkWriter(self.elastic) as writer:
+            writer.add({"origin": "a", "offset": 5}, "1")
+
+        # The written origin is read from the index, the rest from the cache
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "a"}]), 5)
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "b"}]), 3)
+        self.assertEqual(len(self.queries), 2)
+
+        # Items of unknown origin make all the values outdated
+        with BulkWriter(self.elastic) as writer:
+            writer.add({"offset": 5}, "2")
+
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "b"}]), 3)
+        self.assertEqual(len(self.queries), 3)
+        self.assertIn('groups', self.queries[-1]['aggs'])
+
+    @httpretty.activate
+    def test_forget_origins_on_error(self):
+        """Test whether the origins written are looked up again when the upload fails"""
+
+        self.register_search([{"aggregations": {"groups": {"buckets": [{"key": {"origin": "a"}, "1": {"value": 3.0}}]}}},
+                              {"aggregations": {"1": {"value": 5.0}}}])
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/" + INDEX + "/_bulk", body=bulk_response)
+
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "a"}]), 3)
+
+        self.elastic.max_items_bulk = 1
+        with self.assertRaises(KeyError):
+            self.elastic.bulk_upload([{"uuid": "1", "origin": "a", "offset": 5}, {"origin": "a"}], "uuid")
+
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": "a"}]), 5)
+        self.assertEqual(len(self.queries), 2)
+
+    @httpretty.activate
+    def test_forget_updated_origins(self):
+        """Test whether the origins of the documents updated are looked up again"""
+
+        def search_callback(request, uri, headers):
+            query = json.loads(request.body)
+            self.queries.append(query)
+            if 'groups' in query['aggs']:
+                buckets = [{"key": {"origin": origin}, "1": {"value": 3.0}} for origin in ["a", "b"]]
+                return 200, headers, json.dumps({"aggregations": {"groups": {"buckets": buckets}}})
+            return 200, headers, json.dumps({"aggregations": {"1": {"value": 5.0}}})
+
+        def bulk_callback(request, uri, headers):
+            lines = request.body.decode('utf-8').splitlines()
+            items = [{"update": {"_id": json.loads(line)['update']['_id'], "status": 200}} for line in lines[::2]]
+            return 200, headers, json.dumps({"errors": False, "items": items})
+
+        httpretty.register_uri(httpretty.POST, SEARCH_URL, body=search_callback)
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/" + INDEX + "/_bulk", body=bulk_callback)
+
+        def get_offset(origin):
+            return self.elastic.get_last_offset("offset", filters_=[{"name": "origin", "value": origin}])
+
+        self.assertEqual(get_offset("a"), 3)
+
+        self.assertEqual(self.elastic.bulk_update([{"uuid": "1", "origin": "a", "offset": 5}], ["offset"]), 1)
+        self.assertEqual(get_offset("a"), 5)
+        self.assertEqual(get_offset("b"), 3)
+        self.assertEqual(len(self.queries), 2)
+
+        # The origins of the documents updated by a script are unknown
+        self.assertEqual(self.elastic.bulk_script_update(["2"], "set_offset"), 1)
+        self.assertEqual(get_offset("b"), 3)
+        self.assertEqual(len(self.queries), 3)
+        self.assertIn('groups', self.queries[-1]['aggs'])
+
+    @httpretty.activate
+    def test_aggregation_error(self):
+        """Test whether the origin is queried alone when the aggregation fails"""
+
+        def search_callback(request, uri, headers):
+            self.queries.append(request.body)
+            if b'composite' in request.body:
+                return 400, headers, '{"error": "unknown aggregation"}'
+            return 200, headers, '{"aggregations": {"1": {"value": 5.0}}}'
+
+        httpretty.register_uri(httpretty.POST, SEARCH_URL, body=search_callback)
+
+        fltr = {"name": "origin", "value": "https://a.example.com"}
+        self.assertEqual(self.elastic.get_last_offset("offset", filters_=[fltr]), 5)
+        self.assertEqual(len(self.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+import unittest
+
+import httpretty
+
+from grimoire_elk.enriched import utils
+from grimoire_elk.enriched.utils import (ConnectionRegistry,
+                                         NodePool,
+                                         get_node_urls,
+                                         grimoire_con,
+                                         register_nodes)
+
+NODE_1 = "http://node1.example.com"
+NODE_2 = "http://node2.example.com"
+NODES = NODE_1 + "," + NODE_2 + "/"
+
+
+class TestNodePool(unittest.TestCase):
+    """Tests for the balancing of requests among nodes"""
+
+    def setUp(self):
+        self.served = []
+
+    def tearDown(self):
+        utils._node_pools.clear()
+
+    def register_node(self, node, fail=False):
+        def request_callback(request, uri, headers):
+            if fail:
+                raise socket.error("Connection refused")
+            self.served.append(node)
+            return 200, headers, '{"count": 1}'
+
+        for method in [httpretty.GET, httpretty.POST]:
+            httpretty.register_uri(method, node + "/test/_count", body=request_callback)
+            httpretty.register_uri(method, node + "/_search/scroll", body=request_callback)
+
+    def test_register_nodes(self):
+        """Test whether the nodes of a cluster are registered"""
+
+        self.assertEqual(register_nodes(NODE_1), NODE_1)
+        self.assertListEqual(get_node_urls(NODE_1), [NODE_1])
+
+        self.assertEqual(register_nodes(NODES), NODE_1)
+        self.assertListEqual(get_node_urls(NODE_1), [NODE_1, NODE_2])
+        self.assertListEqual(get_node_urls(NODES), [NODE_1, NODE_2])
+
+    @httpretty.activate
+    def test_round_robin(self):
+        """Test whether the requests are sent to the nodes in turns"""
+
+        self.register_node(NODE_1)
+        self.register_node(NODE_2)
+
+        url = register_nodes(NODES)
+        conn = grimoire_con()
+        for _ in range(4):
+            conn.get(url + "/test/_count")
+
+        self.assertListEqual(self.served, [NODE_1, NODE_2, NODE_1, NODE_2])
+
+    def test_least_loaded(self):
+        """Test whether the node with less requests in progress is selected"""
+
+        pool = NodePool([NODE_1, NODE_2])
+        pool.strategy = 'least_loaded'
+
+        node = pool.get_node()
+        self.assertEqual(node, NODE_1)
+        self.assertEqual(pool.get_node(), NODE_2)
+
+        pool.release_node(node)
+        self.assertEqual(pool.get_node(), NODE_1)
+
+    @httpretty.activate
+    def test_dead_node(self):
+        """Test whether failing nodes are skipped during the cool-down"""
+
+        self.register_node(NODE_1, fail=True)
+        self.register_node(NODE_2)
+
+        url = register_nodes(NODES)
+        conn = grimoire_con()
+        for _ in range(3):
+            r = conn.get(url + "/test/_count")
+            self.assertEqual(r.json()['count'], 1)
+
+        self.assertListEqual(self.served, [NODE_2, NODE_2, NODE_2])
+
+        pool = utils.find_node_pool(url + "/test/_count")
+        self.assertIn(NODE_1, pool.dead_until)
+
+    @httpretty.activate
+    def test_sticky_scroll(self):
+        """Test whether scroll requests of a thread go to the same node"""
+
+        self.register_node(NODE_1)
+        self.register_node(NODE_2)
+
+        url = register_nodes(NODES)
+        conn = grimoire_con()
+        conn.get(url + "/test/_count")
+        for _ in range(3):
+            conn.post(url + "/_search/scroll", data='{"scroll": "10m", "scroll_id": "abc"}')
+
+        self.assertListEqual(self.served, [NODE_1, NODE_2, NODE_2, NODE_2])
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    """Tests for the registry of sessions and clients"""
+
+    def tearDown(self):
+        ConnectionRegistry.clear()
+        utils._node_pools.clear()
+
+    def test_get_session(self):
+        """Test whether the same session is returned for the same settings"""
+
+        session = ConnectionRegistry.get_session()
+        self.assertIs(ConnectionRegistry.get_session(), session)
+        self.assertIs(ConnectionRegistry.get_session(insecure=True), session)
+        self.assertFalse(session.verify)
+
+        secure = ConnectionRegistry.get_session(insecure=False)
+        self.assertIsNot(secure, session)
+        self.assertTrue(secure.verify)
+
+        compressed = ConnectionRegistry.get_session(compress_level=6)
+        self.assertIsNot(compressed, session)
+        self.assertEqual(compressed.get_adapter(NODE_1).compress_level, 6)
+
+    def test_pool_maxsize(self):
+        """Test whether the size of the connection pools is set"""
+
+        pool_maxsize = ConnectionRegistry.pool_maxsize
+        ConnectionRegistry.pool_maxsize = 4
+        try:
+            session = ConnectionRegistry.get_session()
+            client = ConnectionRegistry.get_client(NODE_1)
+        finally:
+            ConnectionRegistry.pool_maxsize = pool_maxsize
+
+        adapter = session.get_adapter(NODE_1)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.node_adapter._pool_maxsize, 4)
+
+        connection = client.transport.get_connection()
+        self.assertEqual(connection.session.get_adapter(NODE_1)._pool_maxsize, 4)
+
+    def test_get_client(self):
+        """Test whether the same client is returned for the same cluster"""
+
+        register_nodes(NODES)
+
+        client = ConnectionRegistry.get_client(NODES)
+        self.assertIs(ConnectionRegistry.get_client(NODE_1), client)
+        self.assertEqual(len(client.transport.connection_pool.connections), 2)
+
+        self.assertIsNot(ConnectionRegistry.get_client(NODE_1, verify_certs=True), client)
+        self.assertIsNot(ConnectionRegistry.get_client(NODE_1, timeout=3600, max_retries=50), client)
+        self.assertIsNot(ConnectionRegistry.get_client(NODE_2), client)
+
+    def test_get_client_unhashable_params(self):
+        """Test whether the clients with params such as dicts or lists are reused"""
+
+        client = ConnectionRegistry.get_client(NODE_1, headers={"X-Opaque-Id": "gelk", "X-Tags": ["a", "b"]})
+        self.assertIs(ConnectionRegistry.get_client(NODE_1, headers={"X-Tags": ["a", "b"], "X-Opaque-Id": "gelk"}),
+                      client)
+        self.assertIsNot(ConnectionRegistry.get_client(NODE_1, headers={"X-Opaque-Id": "other"}), client)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import unittest
+
+import httpretty
+
+from grimoirelab_toolkit.datetime import datetime_utcnow
+
+from grimoire_elk import elastic as elastic_module
+from grimoire_elk.elastic_bulk import BulkWriter
+from grimoire_elk.elastic_mapping import Mapping
+
+from mocks import MockElasticSearch
+
+ES_URL = "http://es.example.com"
+INDEX = "git_raw"
+INDEX_URL = ES_URL + "/" + INDEX
+ALIAS_URL = ES_URL + "/_alias/" + INDEX
+PARTITIONS = ["git_raw-2023.01", "git_raw-2023.02", "git_raw-2023.03"]
+
+
+class GitMapping(Mapping):
+
+    @staticmethod
+    def get_elastic_mappings(es_major):
+        return {"items": '{"properties": {"data": {"properties": {"message": {"type": "text"}}}}}'}
+
+
+class TestPartitions(unittest.TestCase):
+    """Tests for the indexes partitioned in monthly backing indexes"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX, date_field="metadata__timestamp")
+
+    def tearDown(self):
+        elastic_module._versions_cache.clear()
+
+    def register_partitions(self, partitions):
+        body = {partition: {"aliases": {INDEX: {}}, "mappings": {}} for partition in partitions}
+        httpretty.register_uri(httpretty.GET, ALIAS_URL, body=json.dumps(body))
+        httpretty.register_uri(httpretty.GET, INDEX_URL, body=json.dumps(body))
+
+    @httpretty.activate
+    def test_create_partitioned_index(self):
+        """Test whether the template and the first backing index are created"""
+
+        templates = []
+
+        def put_template(request, uri, headers):
+            templates.append(json.loads(request.body))
+            return 200, headers, '{"acknowledged": true}'
+
+        partition = INDEX + "-" + datetime_utcnow().strftime("%Y.%m")
+        httpretty.register_uri(httpretty.GET, ES_URL + "/", body='{"version": {"number": "7.17.9"}}')
+        httpretty.register_uri(httpretty.GET, INDEX_URL, status=404, body='{}')
+        httpretty.register_uri(httpretty.GET, ALIAS_URL, status=404, body='{}')
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/_index_template/" + INDEX, body=put_template)
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/" + partition, body='{"acknowledged": true}')
+
+        mappings = GitMapping.get_elastic_mappings(es_major='7')
+        self.assertTrue(self.elastic.create_partitioned_index(mappings=mappings, aliases=["git"]))
+        self.assertTrue(self.elastic.partitioned)
+        self.assertTrue(self.elastic.new_index)
+        self.assertEqual(httpretty.last_request().path, "/" + partition)
+        self.assertEqual(self.elastic.get_bulk_url(), ES_URL + "/_bulk")
+
+        template = templates[0]
+        self.assertListEqual(template['index_patterns'], [INDEX + "-*"])
+        self.assertEqual(template['priority'], 100 + len(INDEX))
+        self.assertDictEqual(template['template']['aliases'], {INDEX: {}, "git": {}})
+        self.assertDictEqual(template['template']['mappings']['properties'],
+                             {"data": {"properties": {"message": {"type": "text"}}}})
+        self.assertIn('dynamic_templates', template['template']['mappings'])
+
+    @httpretty.activate
+    def test_legacy_template(self):
+        """Test whether a legacy template is stored when the instance doesn't support index templates"""
+
+        templates = []
+
+        def put_template(request, uri, headers):
+            templates.append(json.loads(request.body))
+            return 200, headers, '{"acknowledged": true}'
+
+        httpretty.register_uri(httpretty.GET, ES_URL + "/", body='{"version": {"number": "7.5.2"}}')
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/_template/" + INDEX, body=put_template)
+
+        self.elastic.put_partition_template(aliases=["git"])
+
+        template = templates[0]
+        self.assertListEqual(template['index_patterns'], [INDEX + "-*"])
+        self.assertEqual(template['order'], 100 + len(INDEX))
+        self.assertDictEqual(template['aliases'], {INDEX: {}, "git": {}})
+        self.assertIn('dynamic_templates', template['mappings'])
+        self.assertNotIn('template', template)
+
+    @httpretty.activate
+    def test_plain_index(self):
+        """Test whether an existing plain index isn't partitioned"""
+
+        httpretty.register_uri(httpretty.GET, INDEX_URL, body=json.dumps({INDEX: {"mappings": {}}}))
+
+        self.assertFalse(self.elastic.create_partitioned_index())
+        self.assertFalse(self.elastic.partitioned)
+
+    def test_get_partition(self):
+        """Test whether the documents go to the backing index of the month of their date"""
+
+        self.assertEqual(self.elastic.get_partition({"metadata__timestamp": "2023-01-31T23:30:00-02:00"}),
+                         "git_raw-2023.02")
+        self.assertEqual(self.elastic.get_partition({"metadata__timestamp": "2023-12-01T00:00:00"}),
+                         "git_raw-2023.12")
+
+        start, end = self.elastic.get_partition_dates("git_raw-2023.12")
+        self.assertEqual(start.isoformat(), "2023-12-01T00:00:00+00:00")
+        self.assertEqual(end.isoformat(), "2024-01-01T00:00:00+00:00")
+
+    @httpretty.activate
+    def test_partitions_url(self):
+        """Test whether only the backing indexes after the date are read"""
+
+        self.register_partitions(PARTITIONS)
+        self.elastic.partitioned = True
+
+        self.assertEqual(self.elastic.get_partitions_url(), INDEX_URL)
+
+        from_date = datetime.datetime(2023, 2, 15)
+        self.assertEqual(self.elastic.get_partitions_url(from_date),
+                         ES_URL + "/git_raw-2023.02,git_raw-2023.03")
+
+    @httpretty.activate
+    def test_bulk_stale_copies(self):
+        """Test whether the copies of the documents in other backing indexes are deleted"""
+
+        bodies = []
+
+        def bulk_callback(request, uri, headers):
+            bodies.append(request.body)
+            items = []
+            for line in request.body.decode('utf-8').splitlines():
+                action, meta = list(json.loads(line).items())[0]
+                if action in ['index', 'delete']:
+                    items.append({action: {"_index": meta['_index'], "_id": meta['_id'], "status": 200}})
+            return 200, headers, json.dumps({"errors": False, "items": items})
+
+        hits = [{"_index": "git_raw-2023.01", "_id": "1"}, {"_index": "git_raw-2023.02", "_id": "2"}]
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=json.dumps({"hits": {"hits": hits}}))
+        httpretty.register_uri(httpretty.PUT, ES_URL + "/_bulk", body=bulk_callback)
+
+        self.elastic.partitioned = True
+        with BulkWriter(self.elastic) as writer:
+            writer.add({"uuid": "1", "metadata__timestamp": "2023-02-10T00:00:00+00:00"}, "1")
+            writer.add({"uuid": "2", "metadata__timestamp": "2023-02-11T00:00:00+00:00"}, "2")
+
+        self.assertEqual(writer.total, 2)
+
+        actions = [json.loads(line) for line in bodies[0].decode('utf-8').splitlines()]
+        self.assertDictEqual(actions[0], {"index": {"_id": "1", "_index": "git_raw-2023.02"}})
+        self.assertDictEqual(actions[2], {"index": {"_id": "2", "_index": "git_raw-2023.02"}})
+        self.assertDictEqual(actions[4], {"delete": {"_index": "git_raw-2023.01", "_id": "1"}})
+        self.assertEqual(len(actions), 5)
+
+    @httpretty.activate
+    def test_delete_partitions(self):
+        """Test whether the expired backing indexes are deleted"""
+
+        self.register_partitions(PARTITIONS + ["git_raw-2099.01"])
+        for partition in PARTITIONS:
+            httpretty.register_uri(httpretty.DELETE, ES_URL + "/" + partition, body='{"acknowledged": true}')
+
+        self.elastic.partitioned = True
+        kept = self.elastic.delete_partitions(datetime.datetime(2023, 3, 1, tzinfo=datetime.timezone.utc))
+
+        deleted = [request.path for request in httpretty.latest_requests() if request.method == 'DELETE']
+        self.assertListEqual(sorted(set(deleted)), ["/git_raw-2023.01", "/git_raw-2023.02"])
+        self.assertListEqual(kept, ["git_raw-2023.03", "git_raw-2099.01"])
+
+    @httpretty.activate
+    def test_delete_items(self):
+        """Test whether the items are deleted one by one only from the backing index of the retention date"""
+
+        self.register_partitions(PARTITIONS + ["git_raw-2099.01"])
+        for partition in PARTITIONS:
+            httpretty.register_uri(httpretty.DELETE, ES_URL + "/" + partition, body='{"acknowledged": true}')
+        httpretty.register_uri(httpretty.POST, ES_URL + "/git_raw-2023.03/_delete_by_query", body='{"deleted": 1}')
+
+        self.elastic.partitioned = True
+        before_date = datetime.datetime(2023, 3, 15, tzinfo=datetime.timezone.utc)
+        retention_time = int((datetime_utcnow() - before_date).total_seconds() // 60)
+        self.elastic.delete_items(retention_time)
+
+        requests = [(request.method, request.path.split('?')[0]) for request in httpretty.latest_requests()
+                    if request.method != 'GET']
+        self.assertListEqual(sorted(set(requests)), [("DELETE", "/git_raw-2023.01"),
+                                                     ("DELETE", "/git_raw-2023.02"),
+                                                     ("POST", "/git_raw-2023.03/_delete_by_query")])
+
+        # No items are deleted when the retention date is before the backing indexes
+        httpretty.reset()
+        self.register_partitions(["git_raw-2099.01"])
+        self.elastic.delete_items(retention_time + 60 * 24 * 365 * 100)
+        self.assertFalse([request for request in httpretty.latest_requests() if request.method != 'GET'])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import random
+import threading
+import time
+import unittest
+
+import httpretty
+
+from grimoire_elk.enriched.enrich import CONTENT_HASH, Enrich
+from grimoire_elk.pipeline import Pipeline, Stage
+
+from mocks import CheckpointServer, MockElasticSearch, MockEnrich, MockOcean
+
+ES_URL = "http://es.example.com"
+INDEX = "git_enriched"
+CHECKPOINTS = "checkpoints"
+ORIGIN = "http://example.com/repo.git"
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests for the pipeline of stages"""
+
+    def test_run(self):
+        """Test whether the values go through the stages in order"""
+
+        output = []
+
+        def square(value):
+            time.sleep(random.random() / 200)
+            return [value * value]
+
+        def expand(value):
+            # Values are dropped and generated by the stages
+            return [value, -value] if value % 2 else []
+
+        stages = [
+            Stage('square', square, workers=4),
+            Stage('expand', expand, workers=3),
+            Stage('sink', output.append)
+        ]
+        stats = Pipeline(range(100), stages, queue_size=2).run()
+
+        expected = []
+        for i in range(100):
+            if i % 2:
+                expected.extend([i * i, -i * i])
+        self.assertListEqual(output, expected)
+
+        self.assertListEqual(list(stats), ['read', 'square', 'expand', 'sink'])
+        self.assertEqual(stats['read']['processed'], 100)
+        self.assertEqual(stats['square']['processed'], 100)
+        self.assertEqual(stats['square']['workers'], 4)
+        self.assertEqual(stats['sink']['processed'], 100)
+        self.assertGreater(stats['square']['busy'], 0)
+
+    def test_backpressure(self):
+        """Test whether the source isn't read further than the queues allow"""
+
+        read = []
+        release = threading.Event()
+
+        def source():
+            for i in range(50):
+                read.append(i)
+                yield i
+
+        def sink(value):
+            release.wait()
+
+        pipeline = Pipeline(source(), [Stage('copy', lambda value: [value]), Stage('sink', sink)], queue_size=2)
+        thread = threading.Thread(target=pipeline.run)
+        thread.start()
+
+        time.sleep(0.3)
+        # Values in the queues and in the stages
+        self.assertLessEqual(len(read), 8)
+
+        release.set()
+        thread.join()
+        self.assertEqual(len(read), 50)
+
+    def test_error(self):
+        """Test whether the error of a stage stops the pipeline and it is raised"""
+
+        closed = []
+
+        def source():
+            try:
+                for i in range(1000):
+                    yield i
+            finally:
+                closed.append(True)
+
+        def fail(value):
+            if value == 10:
+                raise ValueError("Wrong value")
+            return [value]
+
+        stages = [Stage('fail', fail, workers=2), Stage('sink', lambda value: None)]
+        with self.assertRaisesRegex(ValueError, "Wrong value"):
+            Pipeline(source(), stages, queue_size=1).run()
+
+        self.assertListEqual(closed, [True])
+
+    def test_source_error(self):
+        """Test whether the error reading the source is raised"""
+
+        def source():
+            yield 1
+            raise RuntimeError("Can't read")
+
+        with self.assertRaises(RuntimeError):
+            Pipeline(source(), [Stage('sink', lambda value: None)]).run()
+
+
+class TestEnrichPipeline(unittest.TestCase):
+    """Tests for the enrichment run as a pipeline"""
+
+    def setUp(self):
+        Enrich.checkpoint_index = CHECKPOINTS
+        self.enrich = MockEnrich()
+        self.enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+
+    def tearDown(self):
+        Enrich.checkpoint_index = None
+
+    @httpretty.activate
+    def test_enrich_pipeline(self):
+        """Test whether the items are skipped, uploaded and checkpointed in order by the pipeline"""
+
+        server = CheckpointServer(ES_URL, CHECKPOINTS)
+        bulks = []
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(6)]
+        eitem = self.enrich.get_rich_item(items[2])
+        stored = {
+            "0": {"metadata__gelk_version": self.enrich.gelk_version},
+            "2": {CONTENT_HASH: self.enrich.get_content_hash(eitem)}
+        }
+
+        # The stages send requests at the same time, the index is mocked without HTTP
+        def put_bulk(url, bulk_json):
+            bulks.append(bulk_json)
+            lines = bulk_json.decode('utf-8').splitlines()
+            results = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[::2]]
+            return {"errors": False, "items": results}
+
+        def mget_fields(ids, fields, routings=None):
+            return {doc_id: stored[doc_id] for doc_id in ids if doc_id in stored}
+
+        self.enrich.elastic.put_bulk = put_bulk
+        self.enrich.elastic.mget_fields = mget_fields
+
+        self.enrich.elastic.max_items_bulk = 2
+        self.enrich.immutable_items = True
+        self.enrich.pipeline_queue_size = 2
+        self.enrich.enrich_threads = 3
+        self.enrich.serialize_threads = 2
+        Enrich.skip_immutable = True
+        Enrich.skip_unchanged = True
+        try:
+            self.assertEqual(self.enrich.enrich_items(MockOcean(items, ORIGIN)), 4)
+        finally:
+            Enrich.skip_immutable = False
+            Enrich.skip_unchanged = False
+
+        ids = [json.loads(line)['index']['_id'] for body in bulks for line in body.decode('utf-8').splitlines()[::2]]
+        self.assertListEqual(ids, ["1", "3", "4", "5"])
+        self.assertEqual(server.saved[-1]['timestamp'], "2023-01-06")
+
+    @httpretty.activate
+    def test_enrich_pipeline_processes(self):
+        """Test whether the processes are forked before the threads of the pipeline start"""
+
+        CheckpointServer(ES_URL, CHECKPOINTS)
+        bulks = []
+        forks = []
+
+        def put_bulk(url, bulk_json):
+            bulks.append(bulk_json)
+            lines = bulk_json.decode('utf-8').splitlines()
+            results = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[::2]]
+            return {"errors": False, "items": results}
+
+        class ProcessesEnrich(MockEnrich):
+
+            def get_enrich_pool(self):
+                forks.append(threading.active_count())
+                return super().get_enrich_pool()
+
+        enrich = ProcessesEnrich()
+        enrich.elastic = MockElasticSearch(ES_URL, INDEX)
+        enrich.elastic.put_bulk = put_bulk
+        enrich.elastic.max_items_bulk = 2
+        enrich.enrich_processes = 2
+        enrich.scroll_size = 2
+        enrich.pipeline_queue_size = 2
+        enrich.serialize_threads = 2
+
+        items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}".format(i + 1)} for i in range(6)]
+        threads = threading.active_count()
+        self.assertEqual(enrich.enrich_items(MockOcean(items, ORIGIN)), 6)
+
+        self.assertListEqual(forks, [threads])
+        ids = [json.loads(line)['index']['_id'] for body in bulks for line in body.decode('utf-8').splitlines()[::2]]
+        self.assertListEqual(ids, [str(i) for i in range(6)])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
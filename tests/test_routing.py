@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import unittest
+
+import httpretty
+
+from grimoire_elk.elastic import ElasticSearch
+from grimoire_elk.elastic_bulk import BulkWriter
+
+from mocks import MockElasticSearch
+
+ES_URL = "http://es.example.com"
+INDEX = "routing_test"
+INDEX_URL = ES_URL + "/" + INDEX
+ORIGIN = "https://example.com/repo.git"
+
+
+class TestRouting(unittest.TestCase):
+    """Tests for the routing by origin and the sorting of the indexes"""
+
+    def setUp(self):
+        self.elastic = MockElasticSearch(ES_URL, INDEX, date_field="metadata__timestamp")
+
+    def tearDown(self):
+        ElasticSearch.route_by_origin = False
+        ElasticSearch.sort_index = False
+
+    def test_index_definition(self):
+        """Test whether the routing and sorting are defined when the index is created"""
+
+        analyzers = '{"settings": {"analysis": {"analyzer": {}}}}'
+        self.assertEqual(self.elastic.get_index_definition(analyzers), analyzers)
+
+        ElasticSearch.route_by_origin = True
+        ElasticSearch.sort_index = True
+        definition = json.loads(self.elastic.get_index_definition(analyzers))
+
+        expected = {
+            "settings": {
+                "analysis": {"analyzer": {}},
+                "index.sort.field": "metadata__timestamp",
+                "index.sort.order": "desc"
+            },
+            "mappings": {
+                "_routing": {"required": True},
+                "properties": {"metadata__timestamp": {"type": "date"}}
+            }
+        }
+        self.assertDictEqual(definition, expected)
+
+    @httpretty.activate
+    def test_create_index(self):
+        """Test whether the routing of an existing index is read from its mapping"""
+
+        created = []
+
+        def put_index(request, uri, headers):
+            created.append(json.loads(request.body))
+            return 200, headers, '{"acknowledged": true}'
+
+        httpretty.register_uri(httpretty.GET, INDEX_URL, status=404, body='{}')
+        httpretty.register_uri(httpretty.PUT, INDEX_URL, body=put_index)
+
+        ElasticSearch.route_by_origin = True
+        self.assertIsNone(self.elastic.create_index())
+        self.assertEqual(self.elastic.routing_field, "origin")
+        self.assertDictEqual(created[0], {"mappings": {"_routing": {"required": True}}})
+
+        # The routing of the existing indexes doesn't depend on the option
+        ElasticSearch.route_by_origin = False
+        info = {INDEX: {"mappings": {"_routing": {"required": True}}}}
+        httpretty.register_uri(httpretty.GET, INDEX_URL, body=json.dumps(info))
+        self.elastic.create_index()
+        self.assertEqual(self.elastic.routing_field, "origin")
+
+        ElasticSearch.route_by_origin = True
+        httpretty.register_uri(httpretty.GET, INDEX_URL, body=json.dumps({INDEX: {"mappings": {}}}))
+        self.elastic.create_index()
+        self.assertIsNone(self.elastic.routing_field)
+
+    @httpretty.activate
+    def test_bulk_routing(self):
+        """Test whether the documents are uploaded with the routing of their origin"""
+
+        bodies = []
+
+        def bulk_callback(request, uri, headers):
+            bodies.append(request.body)
+            lines = request.body.decode('utf-8').splitlines()
+            items = [{"index": {"_id": json.loads(line)['index']['_id'], "status": 201}} for line in lines[::2]]
+            return 200, headers, json.dumps({"errors": False, "items": items})
+
+        httpretty.register_uri(httpretty.PUT, INDEX_URL + "/_bulk", body=bulk_callback)
+
+        self.elastic.routing_field = "origin"
+        with BulkWriter(self.elastic) as writer:
+            writer.add({"uuid": "1", "origin": ORIGIN}, "1")
+            writer.add({"uuid": "2"}, "2")
+
+        lines = bodies[0].decode('utf-8').splitlines()
+        self.assertDictEqual(json.loads(lines[0]), {"index": {"_id": "1", "routing": ORIGIN}})
+        self.assertDictEqual(json.loads(lines[2]), {"index": {"_id": "2", "routing": "2"}})
+
+    @httpretty.activate
+    def test_last_item_routing(self):
+        """Test whether the last date of an origin is read from its shard"""
+
+        body = '{"aggregations": {"1": {"value": 1577836800000, "value_as_string": "2020-01-01T00:00:00.000Z"}}}'
+        httpretty.register_uri(httpretty.POST, INDEX_URL + "/_search", body=body)
+
+        self.elastic.routing_field = "origin"
+        self.elastic.last_values_ttl = 0
+        fltr = {"name": "origin", "value": ORIGIN}
+        last_date = self.elastic.get_last_date("metadata__updated_on", filters_=[fltr])
+
+        self.assertEqual(last_date.isoformat(), "2020-01-01T00:00:00+00:00")
+        self.assertDictEqual(httpretty.last_request().querystring, {"routing": [ORIGIN]})
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2023 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import unittest
+import unittest.mock
+
+import requests
+
+from grimoire_elk import elk
+from grimoire_elk.elastic_items import SharedScan
+from grimoire_elk.enriched.enrich import Enrich, ThreadSortingHatClient
+from grimoire_elk.errors import ELKError
+from grimoire_elk.raw.elastic import ElasticOcean
+from grimoirelab_toolkit.datetime import str_to_datetime
+from perceval.backends.core.git import Git
+
+from mocks import MockElasticSearch
+
+ES_URL = "http://es.example.com"
+RAW_INDEX = "git_raw"
+ORIGIN = "http://example.com/repo.git"
+
+
+class RecordingElasticSearch(MockElasticSearch):
+    """ElasticSearch stub which keeps the ids of the uploaded documents"""
+
+    def __init__(self, url, index):
+        super().__init__(url, index)
+        self.uploaded = []
+
+    def put_bulk(self, url, bulk_json):
+        lines = bulk_json.decode('utf-8').splitlines()
+        ids = [json.loads(line)['index']['_id'] for line in lines[::2]]
+        self.uploaded.extend(ids)
+        return {"errors": False, "items": [{"index": {"_id": doc_id, "status": 201}} for doc_id in ids]}
+
+
+class MockOcean(ElasticOcean):
+    """Ocean backend which returns the given items with their sort values"""
+
+    def __init__(self, items):
+        super().__init__(Git(ORIGIN, '/tmp/foo'))
+        self.set_elastic(RecordingElasticSearch(ES_URL, RAW_INDEX))
+        self.items = items
+        self.fetched = []
+
+    def fetch(self, _filter=None, ignore_incremental=False, search_after=None, slices=1, source_includes=None):
+        self.fetched.append({"from_date": self.from_date, "filter": _filter})
+        for item in self.items:
+            if _filter and item['uuid'] not in _filter['value']:
+                continue
+            self.search_after = [item["metadata__timestamp"], item["uuid"], 0]
+            yield item
+
+
+class MockEnrich(Enrich):
+
+    def get_rich_item(self, item):
+        item['enriched_by'] = self.elastic.index
+        return {"uuid": item["uuid"], "metadata__timestamp": item["metadata__timestamp"]}
+
+    def get_rich_events(self, item):
+        for i in range(2):
+            yield {"uuid": item["uuid"], "id": str(i)}
+
+    def get_field_event_unique_id(self):
+        return "id"
+
+
+class TestSharedScan(unittest.TestCase):
+    """Tests for the reading of the raw items once for several consumers"""
+
+    def setUp(self):
+        self.items = [{"uuid": str(i), "metadata__timestamp": "2023-01-0{}T00:00:00+00:00".format(i + 1)}
+                      for i in range(5)]
+
+    def test_run(self):
+        """Test whether each reader gets its own copy of the items newer than its incremental date"""
+
+        ocean = MockOcean(self.items)
+        scan = SharedScan(ocean, queue_size=1)
+        scan.get_reader()
+        scan.get_reader(from_date=str_to_datetime("2023-01-03"))
+
+        def consume(reader):
+            return [(item, reader.search_after[1]) for item in reader.fetch()]
+
+        results = scan.run([consume, consume])
+
+        self.assertListEqual([(item['uuid'], sort) for item, sort in results[0]], [(str(i), str(i)) for i in range(5)])
+        self.assertListEqual([(item['uuid'], sort) for item, sort in results[1]],
+                             [(str(i), str(i)) for i in range(2, 5)])
+        self.assertEqual(results[0][2][0], results[1][0][0])
+        self.assertIsNot(results[0][2][0], results[1][0][0])
+
+        # The items are read once from the oldest incremental date
+        self.assertListEqual(ocean.fetched, [{"from_date": None, "filter": None}])
+        self.assertEqual(ocean.tiebreak_field, "uuid")
+
+    def test_fetch_again(self):
+        """Test whether other reads of the items of a reader are done from the index"""
+
+        ocean = MockOcean(self.items)
+        scan = SharedScan(ocean)
+        scan.get_reader(from_date=str_to_datetime("2023-01-02"))
+
+        def consume(reader):
+            first = [item['uuid'] for item in reader.fetch()]
+            second = [item['uuid'] for item in reader.fetch(_filter={"name": "uuid", "value": ["1", "3"]})]
+            return first, second
+
+        self.assertEqual(scan.run([consume])[0], (["1", "2", "3", "4"], ["1", "3"]))
+        self.assertEqual(ocean.fetched[1]['from_date'], str_to_datetime("2023-01-02"))
+
+    def test_fetch_search_after(self):
+        """Test whether a reader resumes after the item with the sort values of its checkpoint"""
+
+        dates = ["2023-01-01", "2023-01-02", "2023-01-02", "2023-01-02", "2023-01-03"]
+        items = [{"uuid": str(i), "metadata__timestamp": date + "T00:00:00+00:00"} for i, date in enumerate(dates)]
+
+        scan = SharedScan(MockOcean(items))
+        scan.get_reader(from_date=str_to_datetime("2023-01-02"))
+        scan.get_reader()
+
+        def consume_checkpoint(reader):
+            return [item['uuid'] for item in reader.fetch(search_after=["2023-01-02T00:00:00+00:00", "2"])]
+
+        def consume(reader):
+            return [item['uuid'] for item in reader.fetch()]
+
+        self.assertListEqual(scan.run([consume_checkpoint, consume]), [["3", "4"], ["0", "1", "2", "3", "4"]])
+
+    def test_consumer_error(self):
+        """Test whether the error of a consumer doesn't stop the rest"""
+
+        scan = SharedScan(MockOcean(self.items * 20), queue_size=1)
+        scan.get_reader()
+        scan.get_reader()
+
+        def fail(reader):
+            next(reader.fetch())
+            raise ValueError("Can't consume")
+
+        def count(reader):
+            return len(list(reader.fetch()))
+
+        with self.assertRaises(ValueError):
+            scan.run([fail, count])
+
+        self.assertEqual(scan.readers[1].result, 100)
+
+    def test_scan_error(self):
+        """Test whether the readers fail when the items can't be read"""
+
+        class FailingOcean(MockOcean):
+            def fetch(self, *args, **kwargs):
+                yield from super().fetch(*args, **kwargs)
+                raise requests.exceptions.ConnectionError("Connection lost")
+
+        scan = SharedScan(FailingOcean(self.items))
+        scan.get_reader()
+
+        errors = []
+
+        def consume(reader):
+            try:
+                list(reader.fetch())
+            except ELKError as ex:
+                errors.append(ex)
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            scan.run([consume])
+
+        self.assertEqual(len(errors), 1)
+
+    def test_enrich_targets_items(self):
+        """Test whether the items and their events are enriched reading the raw items once"""
+
+        ocean = MockOcean(self.items)
+        targets = []
+        for index, events, from_date in [("git_enriched", False, None),
+                                         ("git_enriched_events", True, str_to_datetime("2023-01-04"))]:
+            enrich = MockEnrich()
+            enrich.set_elastic(RecordingElasticSearch(ES_URL, index))
+            target_ocean = MockOcean(self.items)
+            target_ocean.from_date = from_date
+            targets.append((enrich, events, target_ocean))
+
+        totals = elk.enrich_targets_items(ocean, targets)
+
+        self.assertListEqual(totals, [5, 4])
+        self.assertListEqual(targets[0][0].elastic.uploaded, [str(i) for i in range(5)])
+        self.assertListEqual(targets[1][0].elastic.uploaded, ["3_0", "3_1", "4_0", "4_1"])
+        self.assertEqual(len(ocean.fetched), 1)
+
+    def test_sortinghat_client_per_thread(self):
+        """Test whether each consumer thread uses a SortingHat client of its own"""
+
+        class MockClient:
+            def __init__(self, **params):
+                self.params = params
+                self.gqlc = unittest.mock.Mock()
+
+            def connect(self):
+                pass
+
+            def execute(self, op):
+                return self
+
+        with unittest.mock.patch('grimoire_elk.enriched.enrich.SortingHatClient', MockClient, create=True):
+            sh_db = ThreadSortingHatClient(host="localhost", user="root")
+            main_client = sh_db.execute("query")
+            clients = []
+
+            def consume(reader):
+                clients.append(sh_db.execute("query"))
+                clients.append(sh_db.execute("query"))
+                return len(list(reader.fetch()))
+
+            scan = SharedScan(MockOcean(self.items))
+            for _ in range(2):
+                scan.get_reader()
+            totals = scan.run([consume, consume])
+
+            self.assertListEqual(totals, [5, 5])
+            self.assertIs(clients[0], clients[1])
+            self.assertIs(clients[2], clients[3])
+            self.assertIsNot(clients[0], clients[2])
+            self.assertNotIn(main_client, clients)
+            self.assertDictEqual(main_client.params, {"host": "localhost", "user": "root"})
+
+            # The clients are replaced, e.g. in a forked process
+            sh_db.connect()
+            self.assertIsNot(sh_db.execute("query"), main_client)
+            self.assertIs(sh_db.execute("query"), sh_db.execute("query"))
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -24,9 +24,12 @@ import logging
 from datetime import datetime
 from os import sys
 
-from grimoire_elk.elk import feed_backend, enrich_backend
+from grimoire_elk.elk import feed_backend, enrich_backend, get_enrich_backend
 from grimoire_elk.elastic import ElasticSearch
 from grimoire_elk.elastic_items import ElasticItems
+from grimoire_elk.codec import set_codec
+from grimoire_elk.enriched.enrich import Enrich
+from grimoire_elk.enriched.utils import ConnectionRegistry, NodePool
 from grimoire_elk.utils import get_params, config_logging
 
 
@@ -50,14 +53,75 @@ if __name__ == '__main__':
             # Configure elastic bulk size and scrolling
             if args.bulk_size:
                 ElasticSearch.max_items_bulk = args.bulk_size
+            if args.bulk_bytes:
+                ElasticSearch.max_bytes_bulk = args.bulk_bytes
+            if args.bulk_concurrency:
+                ElasticSearch.max_inflight_bulks = args.bulk_concurrency
+            if args.bulk_retries is not None:
+                ElasticSearch.max_retries_bulk = args.bulk_retries
+            if args.bulk_max_latency:
+                ElasticSearch.max_latency_bulk = args.bulk_max_latency
+            if args.bulk_dead_letter:
+                ElasticSearch.dead_letter_path = args.bulk_dead_letter
+            if args.refresh_policy:
+                ElasticSearch.refresh_policy = args.refresh_policy
+            if args.last_values_ttl is not None:
+                ElasticSearch.last_values_ttl = args.last_values_ttl
+            if args.route_by_origin:
+                ElasticSearch.route_by_origin = True
+            if args.sort_index:
+                ElasticSearch.sort_index = True
+            if args.monthly_indexes:
+                ElasticSearch.monthly_indexes = True
+            if args.elastic_balancing:
+                NodePool.strategy = args.elastic_balancing
+            if args.json_codec:
+                set_codec(args.json_codec)
+            if args.http_pool_size:
+                ConnectionRegistry.pool_maxsize = args.http_pool_size
+            if args.es_compression:
+                ElasticSearch.compress_level = args.es_compression
+                ElasticItems.compress_level = args.es_compression
             if args.scroll_size:
                 ElasticItems.scroll_size = args.scroll_size
             if args.scroll_wait:
                 ElasticItems.scroll_wait = args.scroll_wait
+            if args.fetch_slices:
+                ElasticItems.fetch_slices = args.fetch_slices
+            if args.fetch_read_ahead:
+                ElasticItems.fetch_read_ahead = args.fetch_read_ahead
+            if args.checkpoint_index:
+                Enrich.checkpoint_index = args.checkpoint_index
+            if args.skip_unchanged:
+                Enrich.skip_unchanged = True
+            if args.enrich_processes:
+                Enrich.enrich_processes = args.enrich_processes
+            if args.pipeline_queue_size:
+                Enrich.pipeline_queue_size = args.pipeline_queue_size
+                Enrich.enrich_threads = args.enrich_threads
+                Enrich.serialize_threads = args.serialize_threads
+            if args.skip_immutable:
+                ElasticItems.skip_immutable = True
             if not args.enrich_only:
+                fused_enrich = None
+                if args.fused_enrich and not args.events_enrich and not args.filter_raw:
+                    enrich_index = args.index_enrich if args.index_enrich else args.index + "_enrich"
+                    fused_enrich = get_enrich_backend(args.elastic_url_enrich if args.elastic_url_enrich else url,
+                                                      False, args.backend, args.backend_args, None, enrich_index,
+                                                      json_projects_map=args.json_projects_map,
+                                                      db_sortinghat=args.db_sortinghat,
+                                                      db_user=args.db_user, db_password=args.db_password,
+                                                      db_host=args.db_host)
+                    if not fused_enrich.can_enrich_fed_items():
+                        logging.warning("Items of {} can't be enriched while retrieving them".format(args.backend))
+                        fused_enrich = None
+                elif args.fused_enrich:
+                    logging.warning("Events and filtered raw items can't be enriched while retrieving them")
+
                 feed_backend(url, clean, args.fetch_cache,
                              args.backend, args.backend_args,
-                             args.index, args.index_enrich, args.project)
+                             args.index, args.index_enrich, args.project,
+                             fused_enrich=fused_enrich)
                 logging.info("Backend feed completed")
 
             studies_args = None
@@ -71,7 +135,17 @@ if __name__ == '__main__':
                                          "params": {}
                                          })
 
-            if args.enrich or args.enrich_only:
+            enrich_targets = []
+            for target in args.enrich_targets or []:
+                target_params = target.split(':')
+                enrich_targets.append({
+                    'backend': target_params[0] if target_params[0] else args.backend,
+                    'index': target_params[1] if len(target_params) > 1 and target_params[1] else None,
+                    'events': len(target_params) > 2 and target_params[2] == 'events'
+                })
+
+            # After a fused enrichment, only the items it couldn't enrich are pending
+            if args.enrich or args.enrich_only or args.fused_enrich:
                 unaffiliated_group = None
                 enrich_backend(url, clean, args.backend, args.backend_args, None,
                                args.index, args.index_enrich,
@@ -86,7 +160,8 @@ if __name__ == '__main__':
                                args.author_id, args.author_uuid,
                                args.filter_raw,
                                args.jenkins_rename_file, unaffiliated_group,
-                               args.pair_programming, studies_args)
+                               args.pair_programming, studies_args,
+                               enrich_targets=enrich_targets)
                 logging.info("Enrich backend completed")
             elif args.events_enrich:
                 logging.info("Enrich option is needed for events_enrich")